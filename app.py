@@ -1,14 +1,24 @@
 # app.py
 
+import uuid
+
 import streamlit as st
-from PIL import Image
 import pandas as pd
 
-from ocr_module import extract_text
-from translator import translate_text, detect_lang_for_display, detect_lang_code
+import metrics
+from ocr_module import extract_text_cached, ingest_image
+from ocr_pool import get_ocr_pool
+from translator import detect_lang_code, lang_display
 from parser import parse_receipt
 from split_engine import split_bill
-from category_module import categorize_item_en
+from category_module import categorize_many
+from pipeline import normalize_lines, iter_process
+from warmup import start_warmup, warmup_status
+from prefetch import get_prefetcher
+from result_cache import get_result_cache, digest, MISSING
+from pipeline_state import PipelineState
+from thread_budget import get_thread_budget
+from receipt_history import get_receipt_history
 
 # ------------------ UI STYLE ------------------
 
@@ -45,47 +55,194 @@ st.markdown(
 
 # ------------------ CACHED OCR ------------------
 
-@st.cache_data(show_spinner=False)
-def run_ocr_cached(file_bytes: bytes, ocr_lang: str):
+def cached_ocr_lines(file_digest: str, ocr_lang: str):
+    """
+    Строки OCR из кэша процесса (result_cache) или None.
+    """
+    lines = get_result_cache().get(("ocr", file_digest, ocr_lang))
+    return None if lines is MISSING else list(lines)
+
+
+def store_ocr_lines(file_digest: str, ocr_lang: str, lines) -> None:
+    get_result_cache().put(("ocr", file_digest, ocr_lang), tuple(lines))
+
+
+def run_ocr_cached(file_bytes: bytes, ocr_lang: str, image=None, file_digest: str = None):
     """
-    Кешируем результат OCR по (байты файла + язык).
+    Кешируем результат OCR по (хэш файла + язык) в ограниченном кэше процесса.
     Чтобы при смене языка перевода / групп не пересчитывать OCR.
+    Под ним — дисковый кэш (ocr_cache), переживающий перезапуски.
+    image — уже декодированная картинка (в ключ кэша не входит).
     """
-    return extract_text(file_bytes, ocr_lang=ocr_lang)
+    file_digest = file_digest or digest(file_bytes)
+    lines = cached_ocr_lines(file_digest, ocr_lang)
+    if lines is None:
+        pool = get_ocr_pool()
+        lines = extract_text_cached(
+            file_bytes,
+            ocr_lang=ocr_lang,
+            image=image,
+            extract=pool.extract if pool is not None else None,
+        )
+        store_ocr_lines(file_digest, ocr_lang, lines)
+    return list(lines)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def ingest_image_cached(file_bytes: bytes):
+    """
+    Декодируем загруженный файл один раз; массив общий для показа и OCR
+    (cache_resource не копирует значение).
+    """
+    return ingest_image(file_bytes)
 
 
-@st.cache_data(show_spinner=False)
 def translate_items_cached(items, src_lang: str, tgt_lang: str):
     """
-    Кэш для перевода названий позиций.
+    Кэш для перевода названий позиций (ключ — хэш названий + пара языков).
     items — итерируемый объект с строками (названия).
+    Все названия уходят в NLLB одним батчем (translate_batch),
+    если фон (prefetch) ещё не перевёл их на этот язык.
+    Неудачный перевод не кэшируется.
     """
-    from translator import translate_text  # локальный импорт, чтобы не было циклов
-    results = []
-    for name in items:
-        name = str(name) if name is not None else ""
-        if not name.strip():
-            results.append(name)
-            continue
+    from translator import translate_batch  # локальный импорт, чтобы не было циклов
+    names = [str(name) if name is not None else "" for name in items]
+    cache = get_result_cache()
+    key = ("translate", digest(names), src_lang, tgt_lang)
+    cached = cache.get(key)
+    if cached is not MISSING:
+        return list(cached)
+
+    prefetcher = get_prefetcher()
+    result = prefetcher.get(names, src_lang, tgt_lang) if prefetcher is not None else None
+    if result is None:
         try:
-            results.append(
-                translate_text(
-                    name,
-                    src_lang=src_lang,
-                    tgt_lang=tgt_lang,
-                )
-            )
+            if prefetcher is None:
+                translated = translate_batch(names, src_lang=src_lang, tgt_lang=tgt_lang)
+            else:
+                with prefetcher.foreground():
+                    translated = translate_batch(names, src_lang=src_lang, tgt_lang=tgt_lang)
         except Exception:
-            results.append(name)
-    return results
+            return names
+        result = [tr if name.strip() else name for name, tr in zip(names, translated)]
+
+    cache.put(key, tuple(result))
+    return list(result)
+
+
+def seed_translations(rows, src_lang: str, tgt_lang: str = None) -> None:
+    """
+    Переводы, уже сделанные потоковым конвейером (item_en / item_translated),
+    кладём в кэш под тем же ключом, что у translate_items_cached, —
+    стадии ниже не гоняют те же названия через NLLB второй раз.
+    """
+    if not rows:
+        return
+    names = [str(r["item"]) if r.get("item") is not None else "" for r in rows]
+    cache = get_result_cache()
+    for lang, field in (("en", "item_en"), (tgt_lang, "item_translated")):
+        if lang is None or any(field not in r for r in rows):
+            continue
+        result = [r[field] if name.strip() else name for name, r in zip(names, rows)]
+        if result == names and src_lang != lang:
+            continue  # похоже на неудачный перевод — как и translate_items_cached, не кэшируем
+        cache.put(("translate", digest(names), src_lang, lang), tuple(result))
+
+
+def translate_column(df, src_lang: str, tgt_lang: str):
+    """
+    Перевод колонки item для стадий конвейера (tuple — стабильный ключ кэша).
+    """
+    return translate_items_cached(tuple(df["item"]), src_lang, tgt_lang)
+
+
+def with_categories(df, items_en):
+    """
+    Позиции + английские названия + категория (исходный df не меняется:
+    он хранится в состоянии конвейера).
+    """
+    out = df.copy()
+    out["item_en"] = items_en
+    out["category"] = categorize_many(items_en)
+    return out
+
+
+def category_totals(df):
+    return (
+        df.groupby("category", as_index=False)["total"]
+          .sum()
+          .sort_values("total", ascending=False)
+    )
+
+
+def split_labels(df_display):
+    """
+    Подписи для выбора групп: [(индекс строки, «название — сумма»)].
+    """
+    labels = []
+    for idx, item, amount in zip(df_display.index, df_display["item"], df_display["total"]):
+        label = f"{item}"
+        labels.append((idx, f"{label} — {amount}" if amount != "" else label))
+    return labels
+
+
+def get_pipeline_state() -> PipelineState:
+    """
+    Состояние конвейера текущей сессии: между прогонами скрипта пересчитываются
+    только стадии ниже изменившегося входа (файл, язык OCR, язык перевода).
+    """
+    state = st.session_state.get("pipeline")
+    if state is None:
+        state = st.session_state["pipeline"] = PipelineState()
+    state.begin()
+    return state
+
+# ------------------ WARM-UP ------------------
+
+@st.cache_resource(show_spinner=False)
+def start_warmup_once():
+    """
+    Прогрев моделей в фоне — один раз на процесс сервера.
+    Если OCR идёт через пул процессов, языки прогревает сам пул.
+    """
+    return start_warmup(ocr_langs=[] if get_ocr_pool() is not None else None)
+
+
+start_warmup_once()
+
+_WARMUP_ICONS = {"pending": "⏳", "loading": "🔄", "ready": "✅"}
+with st.sidebar:
+    st.caption("Модели")
+    for name, state in warmup_status().items():
+        st.caption(f"{_WARMUP_ICONS.get(state, '⚠️')} {name}: {state}")
+    cache_stats = get_result_cache().stats()
+    st.caption(
+        f"Кэш результатов: {cache_stats['entries']} зап., "
+        f"{cache_stats['bytes'] / 2**20:.1f} / {cache_stats['max_bytes'] / 2**20:.0f} МБ, "
+        f"попаданий {cache_stats['hit_rate']:.0%}, вытеснено {cache_stats['evictions']}"
+    )
+    threads = get_thread_budget().allocation()
+    st.caption(
+        f"Потоки CPU ({threads['cpu_threads']}): "
+        + ", ".join(
+            f"{kind} {a['limit']}×{a['threads_per_call']} (ждут {a['waiting']})"
+            for kind, a in ((k, threads[k]) for k in ("ocr", "translate"))
+        )
+    )
 
 # ------------------ FILE UPLOAD ------------------
 
 uploaded_file = st.file_uploader("Загрузите фото чека", type=["jpg", "jpeg", "png"])
 
 if uploaded_file is not None:
-    image = Image.open(uploaded_file)
-    st.image(image, caption="Загруженный чек", width="stretch")
+    file_bytes = uploaded_file.getvalue()
+    ingested = ingest_image_cached(file_bytes)
+    st.image(ingested.array, caption="Загруженный чек", width="stretch")
+    st.caption(
+        "Загрузка: "
+        + ", ".join(f"{k[:-3]} {v:.0f} мс" for k, v in ingested.timings.items())
+        + f" (исходник {ingested.original_size[0]}×{ingested.original_size[1]})"
+    )
 
     # ------------------ OCR LANGUAGE SELECTION ------------------
     st.subheader("🌍 Язык / страна чека для OCR")
@@ -109,34 +266,7 @@ if uploaded_file is not None:
     )
     ocr_lang = OCR_LANG_CHOICES[ocr_label]
 
-    # ------------------ OCR ------------------
-    st.subheader("🔍 Распознавание текста (OCR)")
-
-    with st.spinner("Извлечение текста..."):
-        file_bytes = uploaded_file.getvalue()
-        lines = run_ocr_cached(file_bytes, ocr_lang)
-
-    # нормализация
-    if isinstance(lines, str):
-        lines = [ln.strip() for ln in lines.splitlines() if ln.strip()]
-    else:
-        lines = [str(ln).strip() for ln in lines if str(ln).strip()]
-
-    st.caption(f"DEBUG: найдено строк: {len(lines)}")  # можно потом убрать
-
-    if not lines:
-        st.error("Текст не найден 😿")
-        st.stop()
-
-    raw_text = "\n".join(lines)
-    st.text(raw_text)
-
-    # авто-определение языка по всему тексту
-    src_lang_code = detect_lang_code(raw_text)
-    src_lang_display = detect_lang_for_display(raw_text)
-    st.caption(f"Обнаруженный язык чека: {src_lang_display}")
-
-    # ------------------ TRANSLATION ------------------
+    # ------------------ TRANSLATION LANGUAGE ------------------
     st.subheader("🌐 Перевод позиций")
 
     LANG_CHOICES = {
@@ -161,47 +291,146 @@ if uploaded_file is not None:
     target_label = st.selectbox("Выберите язык перевода", list(LANG_CHOICES.keys()))
     target_lang = LANG_CHOICES[target_label]
 
+    # ------------------ OCR ------------------
+    st.subheader("🔍 Распознавание текста (OCR)")
+
+    # Строки OCR текущего файла живут в сессии: повторные прогоны скрипта их не пересчитывают
+    # Тот же ключ, что у run_ocr_cached и остальных кэшей (result_cache.digest)
+    ocr_key = (digest(file_bytes), ocr_lang)
+    # Трасса стадий этого прогона (SABAI_METRICS=1), показывается под таблицей позиций
+    metrics.detach()
+    trace = metrics.start_receipt(ocr_key[0][:12])
+    session_lines = st.session_state.get("ocr_lines", {})
+
+    if ocr_key in session_lines:
+        lines = session_lines[ocr_key]
+    elif get_ocr_pool() is not None:
+        with st.spinner("Извлечение текста..."):
+            lines = run_ocr_cached(file_bytes, ocr_lang, image=ingested.array, file_digest=ocr_key[0])
+    elif (hit := cached_ocr_lines(*ocr_key)) is not None:
+        lines = hit
+    else:
+        # Потоковый режим: позиции появляются по мере распознавания полос чека
+        live = st.empty()
+        rows = []
+        with st.spinner("Извлечение текста..."):
+            for event in iter_process(file_bytes, ocr_lang, target_lang, image=ingested.array):
+                if event["event"] == "items":
+                    rows.extend(event["items"])
+                    live.dataframe(
+                        pd.DataFrame(rows)[["item_translated", "qty", "price", "total", "category"]],
+                        width="stretch",
+                    )
+                elif event["event"] == "done":
+                    lines = event["lines"]
+                    # Язык в done — по всему тексту, как у стадии src_lang ниже
+                    seed_translations(event["items"], event["src_lang"], target_lang)
+        live.empty()
+        store_ocr_lines(*ocr_key, lines)
+
+    st.session_state["ocr_lines"] = {ocr_key: lines}
+
+    # Дальше — стадии с зависимостями: выбор групп в split bill ничего не пересчитывает,
+    # смена языка перевода — только перевод для показа
+    pipe = get_pipeline_state()
+    pipe.input("ocr_lines", lines, key=ocr_key)
+    pipe.input("ocr_lang", ocr_lang)
+    pipe.input("target_lang", target_lang)
+
+    # нормализация
+    lines = pipe.stage("lines", ["ocr_lines"], normalize_lines)
+
+    if trace is not None:
+        trace.count("ocr_lines", len(lines))
+
+    if not lines:
+        metrics.finish_receipt(trace)
+        st.error("Текст не найден 😿")
+        st.stop()
+
+    raw_text = pipe.stage("raw_text", ["lines"], "\n".join)
+    st.text(raw_text)
+
+    # авто-определение языка по всему тексту
+    src_lang_code = pipe.stage("src_lang", ["raw_text", "ocr_lang"], detect_lang_code)
+    src_lang_display = lang_display(src_lang_code)
+    st.caption(f"Обнаруженный язык чека: {src_lang_display}")
+
     # ------------------ PARSING (по оригинальным OCR-строкам) ------------------
     st.subheader("🧠 Структурирование чека")
 
-    df = parse_receipt(lines)
+    parsed = pipe.stage("items", ["lines"], parse_receipt)
+
+    # Неудачный перевод (вернулись исходные названия) не запоминаем — повторим в следующем прогоне
+    def translated_ok(src_lang: str, tgt_lang: str):
+        return lambda out: src_lang == tgt_lang or out != list(parsed["item"])
 
     # --- перевод в EN для категоризации (один словарь regex на английском) ---
-    items_en = translate_items_cached(
-        tuple(df["item"]),
-        src_lang_code,
-        "en",
+    items_en = pipe.stage(
+        "items_en", ["items", "src_lang"], lambda d, src: translate_column(d, src, "en"),
+        keep=translated_ok(src_lang_code, "en"),
     )
-
-    df["item_en"] = items_en
-    df["category"] = df["item_en"].apply(categorize_item_en)
+    df = pipe.stage("categorized", ["items", "items_en"], with_categories)
+    if trace is not None:
+        trace.count("items", len(df))
 
     # Переводим только названия позиций для отображения
-    df_display = df.copy()
-
-    translated_items = translate_items_cached(
-        tuple(df["item"]),   # tuple для стабильного ключа кэша
-        src_lang_code,
-        target_lang,
+    translated_items = pipe.stage(
+        "translated", ["items", "src_lang", "target_lang"], translate_column,
+        keep=translated_ok(src_lang_code, target_lang),
+    )
+    df_display = pipe.stage(
+        "display", ["categorized", "translated"], lambda d, tr: d.assign(item=tr)
     )
-    df_display["item"] = translated_items
 
     st.dataframe(df_display, width="stretch")
 
+    # Пока пользователь смотрит таблицу — переводим на другие вероятные языки в фоне
+    prefetcher = get_prefetcher()
+    if prefetcher is not None and "display" in pipe.recomputed:
+        if st.session_state.get("last_target_lang") != target_lang:
+            st.session_state["last_target_lang"] = target_lang
+            prefetcher.record_choice(target_lang)
+        # Своя сессия: новый чек отменяет фон только этого пользователя
+        session_id = st.session_state.setdefault("prefetch_session", uuid.uuid4().hex)
+        prefetcher.schedule(ocr_key, tuple(df["item"]), src_lang_code,
+                            exclude=(target_lang, "en"), session=session_id)
+
+    record = metrics.finish_receipt(trace)
+    if record is not None:
+        with st.expander(f"⏱ Стадии: {record['wall_ms']:.0f} мс, строк OCR {record['counts'].get('ocr_lines', 0)}"):
+            st.caption("Пересчитано в этом прогоне: " + (", ".join(pipe.recomputed) or "ничего"))
+            st.dataframe(pd.DataFrame.from_dict(record["stages"], orient="index"), width="stretch")
+            if record["caches"]:
+                st.caption("Кэши: " + ", ".join(
+                    f"{name} {c['hit']}/{c['hit'] + c['miss']}" for name, c in record["caches"].items()
+                ))
+
     st.markdown("---")
 
     # ================== DS / ANALYTICS BLOCK ==================
     st.subheader("📊 Распределение трат по категориям (offline)")
 
     # если ты уже добавил df["category"] (через EN-правила)
-    cat_sum = (
-        df.groupby("category", as_index=False)["total"]
-          .sum()
-          .sort_values("total", ascending=False)
-    )
+    cat_sum = pipe.stage("cat_sum", ["categorized"], category_totals)
 
     st.dataframe(cat_sum, width="stretch")
     st.bar_chart(cat_sum.set_index("category")["total"])
+
+    # Сводки по всем сохранённым чекам — из агрегатов, без пересчёта позиций
+    history = get_receipt_history()
+    if history is not None:
+        with st.expander("📚 История трат (все сохранённые чеки)"):
+            hist_cat = pd.DataFrame(history.totals("category"))
+            if hist_cat.empty:
+                st.caption("Пока пусто: чек сохраняется в историю по кнопке «Рассчитать итог».")
+            else:
+                st.dataframe(hist_cat.rename(columns={"key": "category"}), width="stretch")
+                by_month = pd.DataFrame(history.timeline("receipts", "month"))
+                st.bar_chart(by_month.set_index("bucket")["total"])
+                hist_groups = pd.DataFrame(history.totals("group"))
+                if not hist_groups.empty:
+                    st.dataframe(hist_groups.rename(columns={"key": "group"}), width="stretch")
     # ===========================================================
 
     # ------------------ SPLIT BILL ------------------
@@ -210,11 +439,7 @@ if uploaded_file is not None:
     assignments = {}
     groups = ["A", "B", "C", "D"]
 
-    for idx, row in df_display.iterrows():
-        label = f"{row.get('item', f'Позиция {idx}')}"
-        amount = row.get("total", "")
-        text = f"{label} — {amount}" if amount != "" else label
-
+    for idx, text in pipe.stage("split_labels", ["display"], split_labels):
         selected = st.multiselect(
             text,
             groups,
@@ -226,4 +451,13 @@ if uploaded_file is not None:
         totals = split_bill(df, assignments)  # считаем по исходным данным (до перевода)
         st.subheader("💰 Итог по группам:")
         st.write(totals)
+        if history is not None:
+            # Тот же файл и язык OCR — та же запись: повторный расчёт заменяет раскладку
+            history.save_receipt(
+                f"{ocr_key[0]}:{ocr_key[1]}",
+                df.to_dict("records"),
+                {pos: assignments.get(idx, []) for pos, idx in enumerate(df.index)},
+                ocr_lang=ocr_lang,
+                src_lang=src_lang_code,
+            )
         st.success("✔ Готово! Прошу высший балл у комиссии ;-)")
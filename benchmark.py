@@ -0,0 +1,298 @@
+# benchmark.py
+
+"""
+Бенчмарк по стадиям на синтетических чеках (см. synthetic_receipts.py).
+
+    python benchmark.py --out bench.json
+    python benchmark.py --save-baseline                 # записать bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json  # код 1, если стадия стала медленнее
+    python benchmark.py --only parse,split              # только стадии с такими префиксами
+
+Каждая стадия меряется отдельно (медиана по повторам, время на один вызов),
+плюс пропускная способность разбора в зависимости от длины чека.
+NLLB и PaddleOCR по умолчанию заменяются заглушками, чтобы всё шло офлайн;
+--real-models — мерить с настоящими моделями.
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import random
+import argparse
+import platform
+import statistics
+from contextlib import contextmanager, nullcontext
+
+import synthetic_receipts
+
+BASELINE_PATH = os.environ.get("SABAI_BENCH_BASELINE", "bench_baseline.json")
+
+# Допустимое замедление относительно базовой линии (0.25 = +25%)
+REGRESSION_TOLERANCE = float(os.environ.get("SABAI_BENCH_TOLERANCE", "0.25"))
+
+# Длины чеков (число позиций) для кривой пропускной способности
+SCALING_ITEMS = (10, 50, 200, 1000)
+
+# Размеры картинок (ширина, высота): телефонное фото, длинный чек, «простыня»
+IMAGE_SIZES = ((1080, 1920), (1600, 4800), (3000, 12000))
+
+
+# ------------------ ЗАГЛУШКИ МОДЕЛЕЙ ------------------
+
+class StubOCR:
+    """
+    Вместо PaddleOCR: строки латинского чека через каждые line_height пикселей,
+    в старом формате [[box, (text, score)], ...].
+    """
+
+    def __init__(self, line_height: int = 32, seed: int = 0):
+        self.line_height = line_height
+        self.lines = synthetic_receipts.receipt_lines(400, "latin", seed)
+
+    def ocr(self, img):
+        height, width = img.shape[:2]
+        page = []
+        for k, y in enumerate(range(self.line_height // 2, height - self.line_height, self.line_height)):
+            x0, x1, y1 = width * 0.05, width * 0.9, y + self.line_height * 0.6
+            box = [[x0, y], [x1, y], [x1, y1], [x0, y1]]
+            page.append([box, (self.lines[k % len(self.lines)], 0.98)])
+        return [page]
+
+
+def _stub_generate(texts, src_lang, tgt_lang, batch_size, backend=None):
+    return [t.lower() for t in texts]
+
+
+@contextmanager
+def stub_models():
+    """
+    Подменяет NLLB, память переводов и PaddleOCR на время бенчмарка.
+    """
+    import translator
+    import ocr_module
+
+    saved = (translator._generate, translator.get_translation_memory, ocr_module.get_ocr)
+    stub_ocr = StubOCR()
+    translator._generate = _stub_generate
+    translator.get_translation_memory = lambda: None
+    ocr_module.get_ocr = lambda lang_code="ru", replica=0: stub_ocr
+    try:
+        yield
+    finally:
+        translator._generate, translator.get_translation_memory, ocr_module.get_ocr = saved
+
+
+# ------------------ ИЗМЕРЕНИЕ ------------------
+
+def measure(fn, repeat: int = 5, items: int = None, min_time: float = 0.05) -> dict:
+    """
+    Время одного вызова fn: число вызовов в серии подбирается так, чтобы серия
+    шла не меньше min_time секунд; берём медиану и минимум по repeat сериям.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed * 2 >= min_time else 10
+    runs = [t / number for t in timer.repeat(repeat, number)]
+
+    median = statistics.median(runs)
+    out = {
+        "median_ms": median * 1000,
+        "min_ms": min(runs) * 1000,
+        "calls": number,
+        "repeat": repeat,
+    }
+    if items:
+        out["items"] = items
+        out["items_per_s"] = items / median if median > 0 else None
+    return out
+
+
+# ------------------ СТАДИИ ------------------
+
+def _bench_parse(results: dict, repeat: int, seed: int) -> None:
+    from parser import parse_receipt, iter_items
+
+    for layout in synthetic_receipts.LAYOUTS:
+        lines = synthetic_receipts.receipt_lines(40, layout, seed)
+        n = len(lines)
+        results[f"parse_receipt/{layout}"] = measure(lambda: parse_receipt(lines), repeat, n)
+
+    # Пропускная способность в зависимости от длины чека (строк в секунду)
+    for n_items in SCALING_ITEMS:
+        lines = synthetic_receipts.receipt_lines(n_items, "7eleven_th", seed)
+        results[f"parse_scaling/{n_items}"] = measure(
+            lambda: list(iter_items(lines)), repeat, len(lines)
+        )
+
+
+def _bench_categorize(results: dict, repeat: int, seed: int) -> None:
+    from category_module import categorize_item_en, categorize_many
+
+    rng = random.Random(seed)
+    names = [rng.choice(synthetic_receipts._LATIN_ITEMS).lower() for _ in range(1000)]
+    names += ["unknown thing %d" % i for i in range(200)]
+
+    results["categorize_item_en"] = measure(
+        lambda: [categorize_item_en(n) for n in names], repeat, len(names)
+    )
+    results["categorize_many"] = measure(lambda: categorize_many(names), repeat, len(names))
+
+
+def _bench_split(results: dict, repeat: int, seed: int) -> None:
+    import pandas as pd
+    from split_engine import split_bill
+
+    rng = random.Random(seed)
+    groups = ["A", "B", "C", "D"]
+    for n in (20, 500):
+        df = pd.DataFrame({"total": [round(rng.uniform(3, 149), 2) for _ in range(n)]})
+        assignments = {i: rng.sample(groups, rng.randint(0, 3)) for i in range(n)}
+        results[f"split_bill/{n}"] = measure(lambda: split_bill(df, assignments), repeat, n)
+
+
+def _bench_image(results: dict, repeat: int, seed: int) -> None:
+    from ocr_module import _to_ndarray, extract_text
+
+    for width, height in IMAGE_SIZES:
+        data = synthetic_receipts.receipt_image(width, height, n_items=60, seed=seed)
+        results[f"to_ndarray/{width}x{height}"] = measure(lambda: _to_ndarray(data), repeat)
+
+    # OCR-обвязка (разбор результата) на заглушке: сама модель не меряется
+    data = synthetic_receipts.receipt_image(*IMAGE_SIZES[0], n_items=60, seed=seed)
+    array = _to_ndarray(data)
+    results["extract_text/stub"] = measure(lambda: extract_text(array, "en"), repeat)
+
+
+def _bench_lang_and_translate(results: dict, repeat: int, seed: int) -> None:
+    from parser import iter_items
+    from translator import detect_receipt_lang, translate_batch
+    from pipeline import process_lines
+
+    texts = {
+        layout: "\n".join(synthetic_receipts.receipt_lines(40, layout, seed))
+        for layout in synthetic_receipts.LAYOUTS
+    }
+    ocr_langs = {"7eleven_th": "th", "ru": "ru", "latin": "en"}
+
+    def detect_all():
+        # Без lru_cache — иначе меряем словарь
+        detect_receipt_lang.cache_clear()
+        for layout, text in texts.items():
+            detect_receipt_lang(text, ocr_langs[layout])
+
+    results["detect_lang"] = measure(detect_all, repeat, len(texts))
+
+    names = [it.item for it in iter_items(synthetic_receipts.receipt_lines(200, "7eleven_th", seed))]
+    results["translate_batch/th-en"] = measure(
+        lambda: translate_batch(names, "th", "en"), repeat, len(names)
+    )
+
+    lines = synthetic_receipts.receipt_lines(40, "ru", seed)
+    results["process_lines/ru"] = measure(
+        lambda: process_lines(lines, target_lang="en", ocr_lang="ru"), repeat, len(lines)
+    )
+
+
+STAGES = {
+    "parse": _bench_parse,
+    "categorize": _bench_categorize,
+    "split": _bench_split,
+    "image": _bench_image,
+    "translate": _bench_lang_and_translate,
+}
+
+
+def run_benchmarks(only=None, repeat: int = 5, seed: int = 0, real_models: bool = False) -> dict:
+    """
+    Прогоняет выбранные группы стадий. Возвращает
+    {"meta": {...}, "stages": {имя: {"median_ms", "min_ms", ...}}}.
+    """
+    results = {}
+    groups = [name for name in STAGES if not only or any(name.startswith(p) for p in only)]
+
+    with nullcontext() if real_models else stub_models():
+        for name in groups:
+            STAGES[name](results, repeat, seed)
+
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "repeat": repeat,
+        "stub_models": not real_models,
+    }
+    return {"meta": meta, "stages": results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    """
+    Сравнение с базовой линией по медиане: [(стадия, base_ms, cur_ms, ratio, regressed)].
+    Стадии, которых нет в одном из прогонов, пропускаются.
+    """
+    rows = []
+    for name, base in baseline.get("stages", {}).items():
+        cur = current["stages"].get(name)
+        if cur is None or not base.get("median_ms"):
+            continue
+        ratio = cur["median_ms"] / base["median_ms"]
+        rows.append((name, base["median_ms"], cur["median_ms"], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def _print_results(report: dict) -> None:
+    for name, r in report["stages"].items():
+        rate = f"  {r['items_per_s']:>12,.0f}/s" if r.get("items_per_s") else ""
+        print(f"{name:<28} {r['median_ms']:>10.3f} ms{rate}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="SabAI Bill: бенчмарк по стадиям")
+    ap.add_argument("--out", help="куда записать результаты (JSON)")
+    ap.add_argument("--baseline", help="сравнить с базовой линией (JSON)")
+    ap.add_argument("--save-baseline", action="store_true",
+                    help=f"записать результаты как базовую линию ({BASELINE_PATH})")
+    ap.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                    help="допустимое замедление, доля (0.25 = +25%%)")
+    ap.add_argument("--only", help="группы стадий через запятую: " + ",".join(STAGES))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--real-models", action="store_true", help="не подменять NLLB и PaddleOCR")
+    args = ap.parse_args(argv)
+
+    only = [p.strip() for p in args.only.split(",") if p.strip()] if args.only else None
+    report = run_benchmarks(only, repeat=args.repeat, seed=args.seed, real_models=args.real_models)
+    _print_results(report)
+
+    for path in filter(None, [args.out, BASELINE_PATH if args.save_baseline else None]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("meta", {}).get("stub_models") != report["meta"]["stub_models"]:
+        print("WARNING: baseline and current run differ in --real-models", file=sys.stderr)
+
+    regressions = 0
+    print()
+    for name, base_ms, cur_ms, ratio, regressed in compare(report, baseline, args.tolerance):
+        mark = "REGRESSION" if regressed else ""
+        regressions += regressed
+        print(f"{name:<28} {base_ms:>10.3f} -> {cur_ms:>10.3f} ms  x{ratio:.2f} {mark}")
+    print(f"\n{regressions} regression(s) over +{args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
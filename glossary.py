@@ -0,0 +1,98 @@
+# glossary.py
+
+"""
+Локальный глоссарий частых позиций в чеках: такие строки переводятся
+без NLLB. Ключ — (src, tgt), внутри — нормализованная строка → перевод.
+
+Свой словарь можно положить в JSON (SABAI_GLOSSARY_PATH):
+    {"th:en": {"น้ำแข็ง": "ice"}, "ru:en": {"сметана": "sour cream"}}
+Записи из файла дополняют и перекрывают встроенные.
+"""
+
+import os
+import json
+import re
+from functools import lru_cache
+
+GLOSSARY_PATH = os.environ.get("SABAI_GLOSSARY_PATH", "")
+
+BUILTIN_GLOSSARY = {
+    ("th", "en"): {
+        "น้ำดื่ม": "drinking water",
+        "น้ำเปล่า": "water",
+        "น้ำแข็ง": "ice",
+        "กาแฟ": "coffee",
+        "กาแฟเย็น": "iced coffee",
+        "ชาเย็น": "iced tea",
+        "นมสด": "fresh milk",
+        "ขนมปัง": "bread",
+        "ข้าวสวย": "steamed rice",
+        "ข้าวผัด": "fried rice",
+        "ไก่ทอด": "fried chicken",
+        "ถุง": "bag",
+        "ถุงพลาสติก": "plastic bag",
+        "เบียร์": "beer",
+        "ค่าบริการ": "service charge",
+    },
+    ("th", "ru"): {
+        "น้ำดื่ม": "питьевая вода",
+        "น้ำเปล่า": "вода",
+        "น้ำแข็ง": "лёд",
+        "กาแฟ": "кофе",
+        "นมสด": "молоко",
+        "ขนมปัง": "хлеб",
+        "ข้าวสวย": "рис",
+        "ถุง": "пакет",
+        "ถุงพลาสติก": "пакет",
+        "เบียร์": "пиво",
+    },
+    ("ru", "en"): {
+        "хлеб": "bread",
+        "молоко": "milk",
+        "вода": "water",
+        "пакет": "bag",
+        "пакет майка": "plastic bag",
+        "кофе": "coffee",
+        "чай": "tea",
+        "сахар": "sugar",
+        "яйца": "eggs",
+        "пиво": "beer",
+        "сок": "juice",
+    },
+    ("en", "ru"): {
+        "water": "вода",
+        "coffee": "кофе",
+        "tea": "чай",
+        "bag": "пакет",
+        "beer": "пиво",
+        "service charge": "сервисный сбор",
+    },
+}
+
+
+def normalize_term(text: str) -> str:
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+@lru_cache(maxsize=1)
+def _load() -> dict:
+    table = {pair: dict(terms) for pair, terms in BUILTIN_GLOSSARY.items()}
+    if GLOSSARY_PATH and os.path.exists(GLOSSARY_PATH):
+        with open(GLOSSARY_PATH, encoding="utf-8") as f:
+            extra = json.load(f)
+        for pair_key, terms in extra.items():
+            src, _, tgt = pair_key.partition(":")
+            bucket = table.setdefault((src, tgt), {})
+            for term, translation in terms.items():
+                bucket[normalize_term(term)] = translation
+    return table
+
+
+def lookup(text: str, src_lang: str, tgt_lang: str):
+    """
+    Перевод из глоссария или None.
+    """
+    terms = _load().get((src_lang, tgt_lang))
+    if not terms:
+        return None
+    return terms.get(normalize_term(text))
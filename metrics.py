@@ -0,0 +1,408 @@
+# metrics.py
+
+"""
+Лёгкая трассировка стадий конвейера.
+
+    @traced("parse_receipt", items=len)
+    def parse_receipt(...): ...
+
+    with stage("ocr") as span:
+        result = ocr.ocr(img)
+        span.add(len(lines))
+
+    with receipt_trace("IMG_0001.jpg"):
+        process_receipt(...)
+
+На каждую стадию пишется: число вызовов, wall-время, CPU-время процесса
+(вместе с потоками torch/paddle), пик памяти Python (только при
+SABAI_METRICS_TRACEMALLOC=1) и число обработанных элементов.
+Попадания/промахи кэшей — через cache(name, hit).
+
+Выгрузка: JSON lines по чеку (SABAI_METRICS_PATH) и текст Prometheus
+(prometheus_text(), он же GET /metrics в service.py).
+
+Выключено по умолчанию (SABAI_METRICS=1 — включить): тогда обёртка —
+одна проверка флага, stage() возвращает общий пустой объект.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get("SABAI_METRICS", "0") == "1"
+
+# Куда дописывать JSON lines по каждому чеку (пусто — только в памяти)
+METRICS_PATH = os.environ.get("SABAI_METRICS_PATH", "")
+
+# Пик памяти через tracemalloc: точнее, но заметно замедляет Python-код
+METRICS_TRACEMALLOC = os.environ.get("SABAI_METRICS_TRACEMALLOC", "0") == "1"
+
+# Сколько последних чеков держать в памяти (для UI и /health)
+METRICS_RECENT = int(os.environ.get("SABAI_METRICS_RECENT", "100"))
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_local = threading.local()
+_current = contextvars.ContextVar("sabai_receipt_trace", default=None)
+
+# Агрегаты за всё время жизни процесса
+_stages = {}   # стадия -> {"calls", "wall", "cpu", "items", "peak"}
+_caches = {}   # кэш -> {"hit", "miss"}
+_receipts = {"count": 0, "wall": 0.0}
+_recent = deque(maxlen=METRICS_RECENT)
+
+
+def enable(flag: bool = True) -> None:
+    global _enabled
+    _enabled = flag
+    if flag and METRICS_TRACEMALLOC:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _merge(table: dict, name: str, wall: float, cpu: float, items: int, peak: int) -> None:
+    st = table.get(name)
+    if st is None:
+        st = table[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "items": 0, "peak": 0}
+    st["calls"] += 1
+    st["wall"] += wall
+    st["cpu"] += cpu
+    st["items"] += items
+    if peak > st["peak"]:
+        st["peak"] = peak
+
+
+# ------------------ СТАДИИ ------------------
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, items: int) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """
+    Один замер стадии. Вложенные стадии считаются и в себе, и в родителе.
+    """
+    __slots__ = ("name", "items", "_t0", "_c0", "_mem0", "_peak", "_parent")
+
+    def __init__(self, name: str, items: int = 0):
+        self.name = name
+        self.items = items
+
+    def add(self, items: int) -> None:
+        self.items += items
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self._parent = stack[-1] if stack else None
+        stack.append(self)
+
+        self._mem0 = None
+        if METRICS_TRACEMALLOC:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                self._mem0, _ = tracemalloc.get_traced_memory()
+                self._peak = self._mem0
+                tracemalloc.reset_peak()
+
+        self._c0 = time.process_time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._c0
+        _local.stack.pop()
+
+        peak = 0
+        if self._mem0 is not None:
+            import tracemalloc
+            # reset_peak во вложенной стадии сбрасывает и наш пик — берём максимум с детьми
+            top = max(self._peak, tracemalloc.get_traced_memory()[1])
+            peak = top - self._mem0
+            if self._parent is not None and self._parent._mem0 is not None:
+                self._parent._peak = max(self._parent._peak, top)
+
+        with _lock:
+            _merge(_stages, self.name, wall, cpu, self.items, peak)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(self.name, wall, cpu, self.items, peak)
+        return False
+
+
+def stage(name: str, items: int = 0):
+    """
+    Контекстный менеджер замера стадии; при выключенных метриках — пустышка.
+    """
+    return Span(name, items) if _enabled else _NOOP
+
+
+def traced(name: str, items=None):
+    """
+    Декоратор: замер каждого вызова функции как стадии name.
+    items(result) — сколько элементов обработано (например, len).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name) as span:
+                result = fn(*args, **kwargs)
+                if items is not None:
+                    span.items += items(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def cache(name: str, hit: bool, count: int = 1) -> None:
+    """
+    Попадание/промах кэша name (count штук за раз).
+    """
+    if not _enabled or count <= 0:
+        return
+    key = "hit" if hit else "miss"
+    with _lock:
+        _caches.setdefault(name, {"hit": 0, "miss": 0})[key] += count
+    trace = _current.get()
+    if trace is not None:
+        trace.cache(name, key, count)
+
+
+# ------------------ ЧЕК ------------------
+
+class ReceiptTrace:
+    """
+    Все стадии и кэши одного чека. Потоки, запущенные с копией контекста
+    (bind), пишут в тот же объект.
+    """
+
+    def __init__(self, receipt_id=None):
+        self.receipt_id = receipt_id
+        self.started = time.time()
+        self.stages = {}
+        self.caches = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+        self._token = None
+
+    def add(self, name, wall, cpu, items, peak) -> None:
+        with self._lock:
+            _merge(self.stages, name, wall, cpu, items, peak)
+
+    def cache(self, name, key, count) -> None:
+        with self._lock:
+            self.caches.setdefault(name, {"hit": 0, "miss": 0})[key] += count
+
+    def count(self, name: str, value: int) -> None:
+        """Произвольный счётчик чека: строки OCR, позиции и т.п."""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def record(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "calls": st["calls"],
+                    "wall_ms": round(st["wall"] * 1000, 3),
+                    "cpu_ms": round(st["cpu"] * 1000, 3),
+                    "items": st["items"],
+                    "peak_kb": round(st["peak"] / 1024, 1),
+                }
+                for name, st in self.stages.items()
+            }
+            return {
+                "receipt": self.receipt_id,
+                "ts": round(self.started, 3),
+                "wall_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+                "cpu_ms": round((time.process_time() - self._c0) * 1000, 3),
+                "max_rss_kb": _max_rss_kb(),
+                "stages": stages,
+                "caches": {k: dict(v) for k, v in self.caches.items()},
+                "counts": dict(self.counts),
+            }
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def start_receipt(receipt_id=None):
+    """
+    Начать трассу чека в текущем контексте. None, если метрики выключены
+    или трасса уже открыта.
+    """
+    if not _enabled or _current.get() is not None:
+        # Вложенный чек (например, iter_process внутри app.py) пишет во внешнюю трассу
+        return None
+    trace = ReceiptTrace(receipt_id)
+    trace._token = _current.set(trace)
+    return trace
+
+
+def finish_receipt(trace):
+    """
+    Закрыть трассу: запись уходит в агрегаты, в память и в JSONL.
+    """
+    if trace is None:
+        return None
+    if trace._token is not None:
+        try:
+            _current.reset(trace._token)
+        except ValueError:  # закрываем из другого контекста
+            _current.set(None)
+        trace._token = None
+
+    record = trace.record()
+    with _lock:
+        _receipts["count"] += 1
+        _receipts["wall"] += record["wall_ms"] / 1000
+        _recent.append(record)
+    if METRICS_PATH:
+        write_jsonl(METRICS_PATH, [record])
+    return record
+
+
+def detach() -> None:
+    """
+    Забыть незакрытую трассу текущего контекста, ничего не записывая
+    (например, прогон Streamlit прервался на середине).
+    """
+    _current.set(None)
+
+
+@contextmanager
+def receipt_trace(receipt_id=None):
+    trace = start_receipt(receipt_id)
+    try:
+        yield trace
+    finally:
+        finish_receipt(trace)
+
+
+def count(name: str, value: int) -> None:
+    """Счётчик в трассе текущего чека (если она есть)."""
+    if not _enabled:
+        return
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def bind(fn):
+    """
+    fn, который выполнится в копии текущего контекста — для потоков
+    и run_in_executor, чтобы стадии попали в трассу чека.
+    """
+    if not _enabled:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+# ------------------ ВЫГРУЗКА ------------------
+
+def recent(n: int = None) -> list:
+    with _lock:
+        records = list(_recent)
+    return records[-n:] if n else records
+
+
+def write_jsonl(path: str, records=None) -> None:
+    records = recent() if records is None else records
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "stages": {k: dict(v) for k, v in _stages.items()},
+            "caches": {k: dict(v) for k, v in _caches.items()},
+            "receipts": dict(_receipts),
+        }
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """
+    Агрегаты в текстовом формате Prometheus (version 0.0.4).
+    """
+    snap = snapshot()
+    out = []
+
+    def family(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lbl = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            out.append(f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}")
+
+    stages = sorted(snap["stages"].items())
+    family("sabai_stage_calls_total", "counter", "Stage invocations.",
+           [({"stage": n}, s["calls"]) for n, s in stages])
+    family("sabai_stage_wall_seconds_total", "counter", "Wall time spent in stage.",
+           [({"stage": n}, f"{s['wall']:.6f}") for n, s in stages])
+    family("sabai_stage_cpu_seconds_total", "counter", "Process CPU time spent in stage.",
+           [({"stage": n}, f"{s['cpu']:.6f}") for n, s in stages])
+    family("sabai_stage_items_total", "counter", "Items processed by stage.",
+           [({"stage": n}, s["items"]) for n, s in stages])
+    if METRICS_TRACEMALLOC:
+        family("sabai_stage_peak_memory_bytes", "gauge", "Max Python heap growth within a stage.",
+               [({"stage": n}, s["peak"]) for n, s in stages])
+
+    caches = sorted(snap["caches"].items())
+    family("sabai_cache_requests_total", "counter", "Cache lookups by result.",
+           [({"cache": n, "result": r}, c[r]) for n, c in caches for r in ("hit", "miss")])
+
+    family("sabai_receipts_total", "counter", "Receipts traced.",
+           [({}, snap["receipts"]["count"])])
+    family("sabai_receipt_wall_seconds_total", "counter", "Wall time of traced receipts.",
+           [({}, f"{snap['receipts']['wall']:.6f}")])
+    return "\n".join(out) + "\n"
+
+
+def reset() -> None:
+    with _lock:
+        _stages.clear()
+        _caches.clear()
+        _receipts.update(count=0, wall=0.0)
+        _recent.clear()
+
+
+if _enabled:
+    enable(True)
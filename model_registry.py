@@ -0,0 +1,186 @@
+# model_registry.py
+
+"""
+Общий реестр тяжёлых моделей (PaddleOCR по языкам, NLLB).
+
+Вместо бесконечного lru_cache: помним примерный размер каждой модели,
+держим суммарный объём в пределах бюджета и выгружаем давно не
+использованные модели. Закреплённые (pinned) модели не выгружаются никогда.
+
+Размер — из size_fn модели (например, байты весов) или из таблицы оценок
+по семейству (SABAI_MODEL_SIZES_MB). Прирост RSS не годится: после выгрузки
+освобождённая память переиспользуется, а параллельный инференс добавляет своё.
+"""
+
+import gc
+import os
+import time
+import threading
+
+# Бюджет памяти под модели, МБ
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("SABAI_MODEL_MEMORY_MB", "4096"))
+
+# Модели, которые никогда не выгружаем, через запятую: "nllb,ocr:th"
+PINNED_MODELS = {
+    key.strip()
+    for key in os.environ.get("SABAI_PINNED_MODELS", "nllb").split(",")
+    if key.strip()
+}
+
+
+# Оценка размера, МБ, для моделей без size_fn: по ключу целиком, без суффикса
+# «#…» (реплика, бэкенд) или по семейству (часть до двоеточия). Переопределение: SABAI_MODEL_SIZES_MB="ocr=300,nllb=2400"
+MODEL_SIZES_MB = {"ocr": 400, "nllb": 2500}
+MODEL_SIZES_MB.update(
+    (key.strip(), float(mb))
+    for key, _, mb in (
+        pair.partition("=") for pair in os.environ.get("SABAI_MODEL_SIZES_MB", "").split(",")
+    )
+    if key.strip() and mb.strip()
+)
+
+# Для семейств, которых нет в таблице
+DEFAULT_MODEL_SIZE_MB = 512
+
+
+def estimate_size(key: str) -> int:
+    """
+    Примерный размер модели в байтах по таблице MODEL_SIZES_MB.
+    """
+    mb = DEFAULT_MODEL_SIZE_MB
+    for candidate in (key.split(":", 1)[0], key.split("#", 1)[0], key):
+        mb = MODEL_SIZES_MB.get(candidate, mb)
+    return int(mb * 1024 * 1024)
+
+
+class _Entry:
+    __slots__ = ("key", "model", "size", "last_used", "loads")
+
+    def __init__(self, key: str, model, size: int):
+        self.key = key
+        self.model = model
+        self.size = size
+        self.last_used = time.time()
+        self.loads = 1
+
+
+class ModelRegistry:
+    """
+    LRU-реестр моделей с бюджетом по памяти.
+    """
+
+    def __init__(self, budget_bytes: int = None, pinned=None):
+        if budget_bytes is None:
+            budget_bytes = MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+        self.budget_bytes = budget_bytes
+        self.pinned = set(PINNED_MODELS if pinned is None else pinned)
+        self.evictions = 0
+        self._entries = {}  # key -> _Entry, порядок вставки не важен
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def _is_pinned(self, key: str) -> bool:
+        # "nllb" закрепляет и "nllb:facebook/..." — по префиксу до двоеточия
+        return key in self.pinned or key.split(":", 1)[0] in self.pinned
+
+    def get(self, key: str, loader, size_fn=None):
+        """
+        Вернуть модель по ключу, при необходимости загрузив её через loader().
+        size_fn(model) → байты; если не задан — оценка из MODEL_SIZES_MB.
+        Разные модели грузятся параллельно, одна и та же — один раз.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.time()
+                return entry.model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Грузим вне общего лока (уже загруженные модели отдаются без ожидания),
+        # одну и ту же — только один раз
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.last_used = time.time()
+                    return entry.model
+
+            model = loader()
+            size = size_fn(model) if size_fn else estimate_size(key)
+
+            with self._lock:
+                self._entries[key] = _Entry(key, model, size)
+                self._evict_locked(keep=key)
+            return model
+
+    def _evict_locked(self, keep: str = None) -> None:
+        total = sum(e.size for e in self._entries.values())
+        if total <= self.budget_bytes:
+            return
+
+        victims = sorted(
+            (e for e in self._entries.values() if e.key != keep and not self._is_pinned(e.key)),
+            key=lambda e: e.last_used,
+        )
+        freed = False
+        for e in victims:
+            if total <= self.budget_bytes:
+                break
+            del self._entries[e.key]
+            total -= e.size
+            self.evictions += 1
+            freed = True
+
+        if freed:
+            gc.collect()
+
+    def pin(self, key: str) -> None:
+        with self._lock:
+            self.pinned.add(key)
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            self.pinned.discard(key)
+            self._evict_locked()
+
+    def unload(self, key: str) -> bool:
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+        if removed:
+            gc.collect()
+        return removed
+
+    def set_budget(self, budget_bytes: int) -> None:
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict_locked()
+
+    def loaded(self) -> list:
+        with self._lock:
+            return sorted(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Что загружено и сколько (примерно) занимает.
+        """
+        with self._lock:
+            models = [
+                {
+                    "key": e.key,
+                    "mb": round(e.size / (1024 * 1024), 1),
+                    "pinned": self._is_pinned(e.key),
+                    "last_used": e.last_used,
+                }
+                for e in sorted(self._entries.values(), key=lambda e: -e.last_used)
+            ]
+            total = sum(e.size for e in self._entries.values())
+        return {
+            "models": models,
+            "total_mb": round(total / (1024 * 1024), 1),
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 1),
+            "evictions": self.evictions,
+        }
+
+
+# Один реестр на процесс — его делят ocr_module и translator
+registry = ModelRegistry()
@@ -0,0 +1,236 @@
+# ocr_cache.py
+
+"""
+Дисковый кэш результатов OCR.
+
+Ключ — sha256 содержимого файла + язык OCR + версия OCR-модели.
+Дополнительно (опционально) — перцептивный хэш картинки: тот же чек,
+пересжатый или переснятый почти так же, находит уже распознанные строки.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+DEFAULT_DB_PATH = os.environ.get(
+    "SABAI_OCR_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "sabai_bill", "ocr_results.sqlite3"),
+)
+
+# Бюджет на сохранённые строки и максимальный возраст записи (по последнему использованию)
+DEFAULT_MAX_BYTES = int(os.environ.get("SABAI_OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_MAX_AGE_DAYS = float(os.environ.get("SABAI_OCR_CACHE_MAX_AGE_DAYS", "30"))
+
+# Порог похожести по перцептивному хэшу (бит из 256). Отрицательное — поиск дублей выключен.
+PHASH_MAX_DISTANCE = int(os.environ.get("SABAI_OCR_PHASH_DISTANCE", "-1"))
+
+OCR_CACHE_ENABLED = os.environ.get("SABAI_OCR_CACHE_ENABLED", "1") != "0"
+
+# Соотношение сторон у «того же» чека не должно заметно отличаться
+_ASPECT_TOLERANCE = 0.02
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    key           TEXT PRIMARY KEY,
+    ocr_lang      TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    phash         BLOB,
+    aspect        REAL,
+    lines         TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    created       REAL NOT NULL,
+    last_used     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_lang ON ocr_results(ocr_lang, model_version);
+-- Поиск почти-дублей читает только хэши: покрывающий индекс, без обращения к строкам с JSON
+CREATE INDEX IF NOT EXISTS idx_ocr_results_phash ON ocr_results(ocr_lang, model_version, aspect, phash, key)
+    WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_ocr_results_last_used ON ocr_results(last_used);
+"""
+
+
+def content_key(image_bytes: bytes, ocr_lang: str, model_version: str) -> str:
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{digest}:{ocr_lang}:{model_version}"
+
+
+def perceptual_hash(array) -> bytes:
+    """
+    256-битный dHash: картинка → серый 17×16 → знак горизонтального градиента.
+    Устойчив к пересжатию и небольшим изменениям яркости.
+    """
+    from PIL import Image
+
+    img = Image.fromarray(np.asarray(array)).convert("L").resize((17, 16))
+    px = np.asarray(img, dtype=np.int16)
+    bits = px[:, 1:] > px[:, :-1]
+    return np.packbits(bits.ravel()).tobytes()
+
+
+class OCRCache:
+    """
+    SQLite-кэш распознанных строк с вытеснением по размеру и возрасту.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_DB_PATH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+        phash_max_distance: int = PHASH_MAX_DISTANCE,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.phash_max_distance = phash_max_distance
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def get(self, key: str, ocr_lang: str, model_version: str, phash: bytes = None, aspect: float = None):
+        """
+        Точное попадание по ключу, затем (если включено) — ближайший по phash.
+        Возвращает list[str] или None.
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT key, lines FROM ocr_results WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None and phash is not None and self.phash_max_distance >= 0:
+                row = self._nearest_locked(conn, ocr_lang, model_version, phash, aspect)
+                if row is not None:
+                    self.near_hits += 1
+            elif row is not None:
+                self.hits += 1
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE ocr_results SET last_used = ? WHERE key = ?", (time.time(), row[0])
+            )
+            conn.commit()
+        return json.loads(row[1])
+
+    def _nearest_locked(self, conn, ocr_lang, model_version, phash, aspect):
+        # Сначала только хэши (без JSON строк), строки — для одного лучшего ключа
+        sql = (
+            "SELECT key, phash FROM ocr_results "
+            "WHERE ocr_lang = ? AND model_version = ? AND phash IS NOT NULL"
+        )
+        args = [ocr_lang, model_version]
+        if aspect is not None:
+            sql += " AND aspect BETWEEN ? AND ?"
+            args += [aspect * (1 - _ASPECT_TOLERANCE), aspect * (1 + _ASPECT_TOLERANCE)]
+        rows = [r for r in conn.execute(sql, args) if len(r[1]) == len(phash)]
+        if not rows:
+            return None
+
+        stored = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.uint8).reshape(len(rows), -1)
+        query = np.frombuffer(phash, dtype=np.uint8)
+        distances = np.unpackbits(stored ^ query, axis=1).sum(axis=1)
+        best = int(distances.argmin())
+        if distances[best] > self.phash_max_distance:
+            return None
+        return conn.execute(
+            "SELECT key, lines FROM ocr_results WHERE key = ?", (rows[best][0],)
+        ).fetchone()
+
+    def put(self, key: str, ocr_lang: str, model_version: str, lines, phash: bytes = None, aspect: float = None) -> None:
+        payload = json.dumps(list(lines), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_results "
+                "(key, ocr_lang, model_version, phash, aspect, lines, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, ocr_lang, model_version, phash, aspect, payload,
+                 len(payload.encode("utf-8")) + len(key), now, now),
+            )
+            conn.commit()
+            self._evict_locked(conn)
+
+    def _evict_locked(self, conn: sqlite3.Connection) -> None:
+        cur = conn.execute(
+            "DELETE FROM ocr_results WHERE last_used < ?",
+            (time.time() - self.max_age_days * 86400,),
+        )
+        self.evicted += cur.rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+        if total > self.max_bytes:
+            to_free = total - int(self.max_bytes * 0.9)
+            freed = 0
+            doomed = []
+            for key, size in conn.execute(
+                "SELECT key, size FROM ocr_results ORDER BY last_used ASC"
+            ):
+                doomed.append((key,))
+                freed += size
+                if freed >= to_free:
+                    break
+            conn.executemany("DELETE FROM ocr_results WHERE key = ?", doomed)
+            self.evicted += len(doomed)
+        conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_results"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM ocr_results")
+            conn.commit()
+
+
+@lru_cache(maxsize=1)
+def get_ocr_cache():
+    """
+    Общий на процесс кэш OCR (или None, если выключен).
+    """
+    if not OCR_CACHE_ENABLED:
+        return None
+    return OCRCache()
@@ -1,10 +1,69 @@
 # v1_ocr_module.py
 
-from paddleocr import PaddleOCR
+# paddleocr тянет за собой paddle (секунды импорта) — импортируем при первой загрузке модели
+from importlib import metadata
 from PIL import Image, UnidentifiedImageError
-from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import numpy as np
+import sqlite3
+import queue
+import threading
+import time
 import io
+import os
+
+import metrics
+from model_registry import registry
+from thread_budget import get_thread_budget
+from ocr_cache import get_ocr_cache, content_key, perceptual_hash
+
+
+# 🔽 Даунскейлим ОЧЕНЬ большие картинки, чтобы ускорить OCR
+MAX_SIDE = 1600
+
+# Отдавать в OCR серое изображение (JPEG тогда декодируется сразу в L — ещё быстрее)
+OCR_GRAYSCALE = os.environ.get("SABAI_OCR_GRAYSCALE", "0") == "1"
+
+# Строки с уверенностью распознавания ниже порога выбрасываются до парсинга и перевода
+# (0 — не фильтровать)
+OCR_MIN_SCORE = float(os.environ.get("SABAI_OCR_MIN_SCORE", "0.5"))
+
+
+def _paddleocr_version() -> str:
+    # Версию берём из метаданных пакета, не импортируя сам paddleocr
+    try:
+        return metadata.version("paddleocr")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Длинные чеки: вместо ужатия до MAX_SIDE режем на полосы почти в исходном разрешении.
+# auto — только для высоких картинок (высота/ширина >= OCR_TILE_MIN_ASPECT), 1 — всегда, 0 — никогда
+OCR_TILING = os.environ.get("SABAI_OCR_TILING", "auto")
+OCR_TILE_MIN_ASPECT = float(os.environ.get("SABAI_OCR_TILE_MIN_ASPECT", "2.5"))
+# Ширина, до которой уменьшаем чек при нарезке (высота — пропорционально, без лимита MAX_SIDE)
+OCR_TILE_WIDTH = int(os.environ.get("SABAI_OCR_TILE_WIDTH", "1600"))
+# Высота полосы и перекрытие (перекрытие — с запасом больше строки текста)
+OCR_TILE_HEIGHT = int(os.environ.get("SABAI_OCR_TILE_HEIGHT", "1280"))
+OCR_TILE_OVERLAP = int(os.environ.get("SABAI_OCR_TILE_OVERLAP", "192"))
+# Сколько экземпляров PaddleOCR на язык держит процесс (общий пул на все запросы,
+# см. _ocr_replica) — и сколько полос одного чека распознаём параллельно
+OCR_TILE_WORKERS = int(os.environ.get("SABAI_OCR_TILE_WORKERS", "2"))
+# Предел площади после масштабирования (защита от «простыней» в сотни мегапикселей)
+OCR_TILE_MAX_PIXELS = int(os.environ.get("SABAI_OCR_TILE_MAX_MPIX", "40")) * 1_000_000
+
+# Версия OCR для ключей кэша: всё, от чего зависит набор строк на выходе
+OCR_MODEL_VERSION = (
+    f"paddleocr-{_paddleocr_version()}"
+    f"/max{MAX_SIDE}/{'L' if OCR_GRAYSCALE else 'RGB'}"
+    + (f"/score{OCR_MIN_SCORE:g}" if OCR_MIN_SCORE else "")
+    + (f"/tile{OCR_TILE_WIDTH}x{OCR_TILE_HEIGHT}-{OCR_TILE_OVERLAP}" if OCR_TILING != "0" else "")
+)
+
+# Результат загрузки картинки: один массив и для показа, и для OCR
+IngestedImage = namedtuple("IngestedImage", ["array", "original_size", "timings"])
 
 
 # Поддерживаемые языки OCR, привязанные к PaddleOCR
@@ -21,17 +80,55 @@ SUPPORTED_OCR_LANGS = {
 }
 
 
-@lru_cache(maxsize=None)
-def get_ocr(lang_code: str = "ru") -> PaddleOCR:
+@metrics.traced("get_ocr")
+def get_ocr(lang_code: str = "ru", replica: int = 0):
     """
-    Кэшируем инстансы PaddleOCR по коду языка.
-    Чтобы модель не грузилась заново при каждом запросе.
+    Инстансы PaddleOCR по коду языка живут в общем реестре моделей.
+    Чтобы модель не грузилась заново при каждом запросе,
+    но и не висела в памяти вечно, если бюджет исчерпан.
+    replica > 0 — отдельный экземпляр для параллельных полос (PaddleOCR
+    не рассчитан на вызовы одного экземпляра из нескольких потоков).
     """
     if lang_code not in SUPPORTED_OCR_LANGS:
         lang_code = "en"
 
+    key = f"ocr:{lang_code}" if not replica else f"ocr:{lang_code}#{replica}"
+    return registry.get(key, lambda: _load_ocr(lang_code))
+
+
+# Свободные номера экземпляров по языку: очередь на процесс, а не на вызов,
+# чтобы параллельные запросы не делили один экземпляр PaddleOCR
+_replica_pools = {}
+_replica_pools_lock = threading.Lock()
+
+
+@contextmanager
+def _ocr_replica(lang_code: str):
+    """
+    Взять свободный экземпляр PaddleOCR для языка на время одного вызова ocr().
+    Всего экземпляров на язык — OCR_TILE_WORKERS (0-й — тот же, что get_ocr(lang)).
+    """
+    if lang_code not in SUPPORTED_OCR_LANGS:
+        lang_code = "en"
+    with _replica_pools_lock:
+        pool = _replica_pools.get(lang_code)
+        if pool is None:
+            pool = _replica_pools[lang_code] = queue.SimpleQueue()
+            for k in range(max(1, OCR_TILE_WORKERS)):
+                pool.put(k)
+    k = pool.get()
+    try:
+        yield get_ocr(lang_code, replica=k)
+    finally:
+        pool.put(k)
+
+
+def _load_ocr(lang_code: str):
+    from paddleocr import PaddleOCR
+
     return PaddleOCR(
         lang=lang_code,
+        cpu_threads=get_thread_budget().ocr_threads,  # доля ядер на один вызов, см. thread_budget
         #use_angle_cls=False,                  # убираем лишнюю голову для скорости
         use_doc_orientation_classify=False,
         use_doc_unwarping=False,
@@ -40,19 +137,18 @@ def get_ocr(lang_code: str = "ru") -> PaddleOCR:
     )
 
 
-def _to_ndarray(image_source):
+def _read_bytes(image_source) -> bytes:
     """
-    Приводим вход к формату, который понимает PaddleOCR:
+    Достаём байты картинки из любого поддерживаемого источника:
     - str: путь к файлу
     - streamlit UploadedFile / BytesIO / объект с .getvalue() или .read()
     - bytes / bytearray
     """
-    # Уже путь к файлу
     if isinstance(image_source, str):
-        return image_source
-
+        with open(image_source, "rb") as f:
+            image_bytes = f.read()
     # Streamlit UploadedFile или любой объект с .getvalue()
-    if hasattr(image_source, "getvalue"):
+    elif hasattr(image_source, "getvalue"):
         image_bytes = image_source.getvalue()
     elif isinstance(image_source, (bytes, bytearray)):
         image_bytes = image_source
@@ -75,66 +171,238 @@ def _to_ndarray(image_source):
 
     if not image_bytes:
         raise ValueError("Empty image data: got 0 bytes from uploaded file")
+    return image_bytes
+
+
+def ingest_image(image_source, max_side: int = MAX_SIDE, grayscale: bool = None) -> IngestedImage:
+    """
+    Декодируем картинку ОДИН раз, сразу в уменьшенном размере.
+    Для JPEG используем draft-режим PIL: декодер сам пропускает 1/2, 1/4 или 1/8
+    пикселей, так что 48-мегапиксельное фото не разворачивается целиком.
+    timings — миллисекунды по шагам (read / decode / resize / to_array).
+    """
+    if grayscale is None:
+        grayscale = OCR_GRAYSCALE
+    mode = "L" if grayscale else "RGB"
+    timings = {}
+
+    t0 = time.perf_counter()
+    image_bytes = _read_bytes(image_source)
+    t1 = time.perf_counter()
+    timings["read_ms"] = (t1 - t0) * 1000
 
     try:
-        pil_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        pil_img = Image.open(io.BytesIO(image_bytes))
+        w, h = pil_img.size
+        target = None
+        if max(w, h) > max_side:
+            scale = max_side / max(w, h)
+            target = (int(w * scale), int(h * scale))
+            # Для не-JPEG это no-op
+            pil_img.draft(mode, target)
+        pil_img = pil_img.convert(mode)
     except UnidentifiedImageError as e:
         raise UnidentifiedImageError(
             "PIL не смог распознать изображение. "
             "Проверь, что это действительно JPEG/PNG и файл не битый."
         ) from e
+    t2 = time.perf_counter()
+    timings["decode_ms"] = (t2 - t1) * 1000
+
+    # draft уменьшает только степенями двойки — доводим до точного размера
+    if target is not None and pil_img.size != target:
+        pil_img = pil_img.resize(target)
+    t3 = time.perf_counter()
+    timings["resize_ms"] = (t3 - t2) * 1000
 
-    # 🔽 Даунскейлим ОЧЕНЬ большие картинки, чтобы ускорить OCR
-    max_side = 1600
-    w, h = pil_img.size
-    if max(w, h) > max_side:
-        scale = max_side / max(w, h)
-        new_size = (int(w * scale), int(h * scale))
-        pil_img = pil_img.resize(new_size)
+    array = np.array(pil_img)
+    timings["to_array_ms"] = (time.perf_counter() - t3) * 1000
 
-    return np.array(pil_img)
+    return IngestedImage(array, (w, h), timings)
 
 
-def extract_text(image_source, ocr_lang: str = "ru"):
+@metrics.traced("to_ndarray")
+def _to_ndarray(image_source):
     """
-    OCR по изображению.
-    :param image_source: путь/байты/UploadedFile
-    :param ocr_lang: код языка для PaddleOCR (ru, en, latin, th, ...)
-    :return: list[str] — строки текста
+    Приводим вход к формату, который понимает PaddleOCR:
+    - str: путь к файлу (PaddleOCR читает сам)
+    - np.ndarray: уже загруженная картинка (например, из ingest_image)
+    - всё остальное — через ingest_image
     """
-    img_for_ocr = _to_ndarray(image_source)
-    ocr = get_ocr(ocr_lang)
+    # Уже путь к файлу или готовый массив
+    if isinstance(image_source, (str, np.ndarray)):
+        return image_source
+    if isinstance(image_source, IngestedImage):
+        return image_source.array
+
+    return ingest_image(image_source).array
+
+
+def _bounds(box):
+    """
+    Полигон [[x, y] x4] или прямоугольник [x0, y0, x1, y1] → (x0, y0, x1, y1).
+    """
+    if box is None:
+        return None
+    try:
+        arr = np.asarray(box, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if arr.shape == (4,):
+        return tuple(float(v) for v in arr)
+    if arr.size < 2 or arr.size % 2:
+        return None
+    pts = arr.reshape(-1, 2)
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    return float(x0), float(y0), float(x1), float(y1)
+
+
+class OCRResult:
+    """
+    Компактный результат OCR:
+        texts  — list[str], непустые строки;
+        boxes  — float32 (n, 4): x0, y0, x1, y1 (NaN, если рамки нет);
+        scores — float32 (n,): уверенность распознавания (NaN, если неизвестна).
+    Итерируется как список строк, поэтому годится везде, где ждут lines.
+    """
+    __slots__ = ("texts", "boxes", "scores")
+
+    def __init__(self, texts, boxes=None, scores=None):
+        n = len(texts)
+        self.texts = list(texts)
+        self.boxes = np.full((n, 4), np.nan, np.float32) if boxes is None else boxes
+        self.scores = np.full(n, np.nan, np.float32) if scores is None else scores
 
-    result = ocr.ocr(img_for_ocr)
+    def __len__(self):
+        return len(self.texts)
 
+    def __iter__(self):
+        return iter(self.texts)
+
+    def __repr__(self):
+        return f"OCRResult({len(self.texts)} lines)"
+
+    def _take(self, mask) -> "OCRResult":
+        idx = np.flatnonzero(mask)
+        return OCRResult([self.texts[i] for i in idx], self.boxes[idx], self.scores[idx])
+
+    def filter(self, min_score: float) -> "OCRResult":
+        """
+        Без строк с уверенностью ниже min_score (строки без оценки остаются).
+        """
+        if not min_score or not len(self.texts):
+            return self
+        keep = ~(self.scores < min_score)  # NaN < x → False, значит строка остаётся
+        return self if keep.all() else self._take(keep)
+
+    def entries(self):
+        """
+        (text, (x0, y0, x1, y1) | None, score | None) по строкам.
+        """
+        has_box = ~np.isnan(self.boxes).any(axis=1)
+        boxes = self.boxes.tolist()
+        for i, text in enumerate(self.texts):
+            score = float(self.scores[i])
+            yield (
+                text,
+                tuple(boxes[i]) if has_box[i] else None,
+                None if score != score else score,
+            )
+
+    @classmethod
+    def from_entries(cls, entries) -> "OCRResult":
+        entries = list(entries)
+        nan_box = (np.nan,) * 4
+        return cls(
+            [e[0] for e in entries],
+            np.array([e[1] if e[1] is not None else nan_box for e in entries],
+                     dtype=np.float32).reshape(-1, 4),
+            np.array([np.nan if e[2] is None else e[2] for e in entries], dtype=np.float32),
+        )
+
+    def to_dict(self) -> dict:
+        """
+        JSON-совместимое представление (NaN → None).
+        """
+        return {
+            "texts": list(self.texts),
+            "boxes": [None if np.isnan(b).any() else [float(v) for v in b] for b in self.boxes],
+            "scores": [None if np.isnan(v) else float(v) for v in self.scores],
+        }
+
+
+def _box_array(boxes, n: int):
+    """
+    Рамки одного блока PaddleX → float32 (n, 4): прямоугольники берём как есть,
+    полигоны сворачиваем в описанный прямоугольник одним векторным шагом.
+    """
+    if boxes is None or len(boxes) != n:
+        return None
+    try:
+        arr = np.asarray(boxes, dtype=np.float32)
+    except (TypeError, ValueError):
+        arr = None  # полигоны разной длины
+    if arr is not None and arr.shape == (n, 4):
+        return arr
+    if arr is not None and arr.ndim == 3 and arr.shape[0] == n and arr.shape[2] == 2:
+        return np.concatenate([arr.min(axis=1), arr.max(axis=1)], axis=1)
+    nan_box = (np.nan,) * 4
+    return np.array([_bounds(b) or nan_box for b in boxes], dtype=np.float32).reshape(n, 4)
+
+
+def parse_ocr_result(result, min_score: float = None) -> OCRResult:
+    """
+    Результат ocr.ocr() любого из известных форматов → OCRResult за один проход:
+    1) новый формат PaddleX — объект с .json;
+    2) dict: {'res': {..., 'rec_texts': [...]}} или сразу с 'rec_texts';
+    3) старый формат: [[box, (text, score)], ...];
+    4) объект с атрибутом rec_texts.
+    Пустые строки отбрасываются, затем — строки с уверенностью ниже min_score
+    (по умолчанию OCR_MIN_SCORE).
+    """
     # На всякий: генератор → список
     if not isinstance(result, (list, tuple)):
         result = list(result)
 
-    lines: list[str] = []
+    texts, box_parts, score_parts = [], [], []
+    nan_box = (np.nan,) * 4
 
     for res in result:
-        # 1) Новый формат PaddleX: объект результата с .json
-        if hasattr(res, "json"):
-            data = res.json  # dict
-            inner = data.get("res", data)
-            rec_texts = inner.get("rec_texts", [])
-            for t in rec_texts:
-                if isinstance(t, str) and t.strip():
-                    lines.append(t.strip())
-            continue
-
-        # 2) Просто dict: {'res': {..., 'rec_texts': [...]}} или сразу c 'rec_texts'
-        if isinstance(res, dict):
-            inner = res.get("res", res)
-            rec_texts = inner.get("rec_texts", [])
-            for t in rec_texts:
-                if isinstance(t, str) and t.strip():
-                    lines.append(t.strip())
-            continue
-
-        # 3) Старый формат: список [ [box, (text, score)], ... ]
-        if isinstance(res, list):
+        if hasattr(res, "json") or isinstance(res, dict) or hasattr(res, "rec_texts"):
+            if hasattr(res, "json"):
+                data = res.json  # dict
+                inner = data.get("res", data)
+            elif isinstance(res, dict):
+                inner = res.get("res", res)
+            else:
+                inner = {
+                    k: getattr(res, k, None)
+                    for k in ("rec_texts", "rec_scores", "rec_boxes", "rec_polys", "dt_polys")
+                }
+
+            rec_texts = list(inner.get("rec_texts") or [])
+            n = len(rec_texts)
+            if not n:
+                continue
+            boxes = _box_array(inner.get("rec_boxes"), n)
+            if boxes is None:
+                boxes = _box_array(inner.get("rec_polys"), n)
+            if boxes is None:
+                boxes = _box_array(inner.get("dt_polys"), n)
+            if boxes is None:
+                boxes = np.full((n, 4), np.nan, np.float32)
+
+            scores = inner.get("rec_scores")
+            if scores is None or len(scores) != n:
+                scores = np.full(n, np.nan, np.float32)
+
+            texts.extend(rec_texts)
+            box_parts.append(boxes)
+            score_parts.append(np.asarray(scores, dtype=np.float32))
+
+        elif isinstance(res, list):
+            block_boxes, block_scores = [], []
             for line in res:
                 if (
                     isinstance(line, (list, tuple))
@@ -142,17 +410,395 @@ def extract_text(image_source, ocr_lang: str = "ru"):
                     and isinstance(line[1], (list, tuple))
                     and len(line[1]) > 0
                 ):
-                    text = line[1][0]
-                    if isinstance(text, str) and text.strip():
-                        lines.append(text.strip())
-            continue
-
-        # 4) На всякий случай: объект с атрибутом rec_texts
-        if hasattr(res, "rec_texts"):
-            rec_texts = getattr(res, "rec_texts", []) or []
-            for t in rec_texts:
-                if isinstance(t, str) and t.strip():
-                    lines.append(t.strip())
-            continue
+                    texts.append(line[1][0])
+                    block_boxes.append(_bounds(line[0]) or nan_box)
+                    score = line[1][1] if len(line[1]) > 1 else None
+                    block_scores.append(np.nan if score is None else score)
+            if block_boxes:
+                box_parts.append(np.array(block_boxes, dtype=np.float32))
+                score_parts.append(np.array(block_scores, dtype=np.float32))
+
+    if not texts:
+        return OCRResult([])
+
+    boxes = np.concatenate(box_parts) if len(box_parts) > 1 else box_parts[0]
+    scores = np.concatenate(score_parts) if len(score_parts) > 1 else score_parts[0]
+
+    stripped = [t.strip() if isinstance(t, str) else "" for t in texts]
+    keep = np.fromiter((bool(t) for t in stripped), dtype=bool, count=len(stripped))
+    threshold = OCR_MIN_SCORE if min_score is None else min_score
+    if threshold:
+        dropped = keep & (scores < threshold)
+        if dropped.any():
+            metrics.count("ocr_low_score", int(dropped.sum()))
+            keep &= ~dropped
+
+    if keep.all():
+        return OCRResult(stripped, boxes, scores)
+    idx = np.flatnonzero(keep)
+    return OCRResult([stripped[i] for i in idx], boxes[idx], scores[idx])
+
+
+def _iter_entries(result, min_score: float = None):
+    """
+    Поток (text, (x0, y0, x1, y1) | None, score | None) по результату ocr.ocr().
+    """
+    return parse_ocr_result(result, min_score).entries()
+
+
+def extract_text(image_source, ocr_lang: str = "ru", structured: bool = False,
+                 min_score: float = None):
+    """
+    OCR по изображению.
+    :param image_source: путь/байты/UploadedFile/np.ndarray/IngestedImage
+    :param ocr_lang: код языка для PaddleOCR (ru, en, latin, th, ...)
+    :param structured: вернуть OCRResult (строки + рамки + уверенность)
+    :param min_score: порог уверенности (по умолчанию OCR_MIN_SCORE)
+    :return: list[str] — строки текста (или OCRResult)
+    """
+    if _wants_tiling(image_source):
+        return extract_text_tiled(image_source, ocr_lang, structured=structured, min_score=min_score)
+
+    img_for_ocr = _to_ndarray(image_source)
+
+    with _ocr_replica(ocr_lang) as ocr, metrics.stage("ocr") as span, get_thread_budget().slot("ocr"):
+        result = parse_ocr_result(ocr.ocr(img_for_ocr), min_score)
+        span.add(len(result))
+    return result if structured else result.texts
+
+
+# ------------------ STREAMING OCR ------------------
 
+# Высота полосы и перекрытие для потокового OCR (в пикселях уже уменьшенной картинки).
+# Перекрытие должно быть заметно больше высоты строки текста.
+OCR_BAND_HEIGHT = int(os.environ.get("SABAI_OCR_BAND_HEIGHT", "640"))
+OCR_BAND_OVERLAP = int(os.environ.get("SABAI_OCR_BAND_OVERLAP", "96"))
+
+
+def plan_bands(height: int, band_height: int, overlap: int) -> list:
+    """
+    Полосы (y0, y1, own0, own1): полоса режется по [y0, y1), а строка
+    засчитывается ей, только если центр строки попал в [own0, own1).
+    Зоны own соседних полос стыкуются посередине перекрытия, поэтому каждая
+    строка достаётся ровно одной полосе.
+    """
+    if height <= band_height + overlap:
+        return [(0, height, 0, height)]
+
+    overlap = min(overlap, band_height // 2)
+    step = band_height - overlap
+    starts = list(range(0, height - overlap, step))
+    bands = []
+    for k, y0 in enumerate(starts):
+        y1 = min(height, y0 + band_height)
+        own0 = 0 if k == 0 else y0 + overlap // 2
+        own1 = height if k == len(starts) - 1 else y1 - overlap // 2
+        bands.append((y0, y1, own0, own1))
+    return bands
+
+
+def _band_lines(ocr, img, band) -> list:
+    y0, y1, own0, own1 = band
+    lines = []
+    with metrics.stage("ocr") as span:
+        with get_thread_budget().slot("ocr"):
+            result = ocr.ocr(img[y0:y1])
+        for text, box, _score in _iter_entries(result):
+            if box is not None and not (own0 <= y0 + (box[1] + box[3]) / 2 < own1):
+                continue
+            lines.append(text)
+        span.add(len(lines))
     return lines
+
+
+def iter_text(image_source, ocr_lang: str = "ru", band_height: int = None, overlap: int = None):
+    """
+    Потоковый OCR: картинка режется на горизонтальные полосы с перекрытием,
+    строки отдаются по мере готовности каждой полосы (сверху вниз).
+    Длинный чек (см. OCR_TILING) — полосами в высоком разрешении, параллельно.
+    """
+    if _wants_tiling(image_source):
+        yield from iter_text_tiled(image_source, ocr_lang)
+        return
+
+    img = _to_ndarray(image_source)
+    if isinstance(img, str):
+        img = ingest_image(img).array
+
+    bands = plan_bands(
+        img.shape[0],
+        band_height or OCR_BAND_HEIGHT,
+        OCR_BAND_OVERLAP if overlap is None else overlap,
+    )
+    for band in bands:
+        # Экземпляр берём на полосу, а не на весь генератор: между полосами он свободен
+        with _ocr_replica(ocr_lang) as ocr:
+            lines = _band_lines(ocr, img, band)
+        yield from lines
+
+
+# ------------------ TILED OCR (ДЛИННЫЕ ЧЕКИ) ------------------
+
+# Насколько близко к краю полосы должна быть рамка, чтобы считать строку обрезанной
+_TILE_EDGE_PX = 2
+
+
+def _wants_tiling(image_source) -> bool:
+    """
+    Резать ли на полосы: только исходник (путь/байты/файл) — у уже
+    уменьшенного массива высокого разрешения не вернуть.
+    """
+    if OCR_TILING == "0" or isinstance(image_source, (np.ndarray, IngestedImage)):
+        return False
+    if OCR_TILING == "1":
+        return True
+    try:
+        w, h = Image.open(io.BytesIO(_read_bytes(image_source))).size
+    except (OSError, UnidentifiedImageError):
+        return False
+    return h >= w * OCR_TILE_MIN_ASPECT and h > MAX_SIDE
+
+
+def _tile_image(image_source) -> np.ndarray:
+    """
+    Картинка для нарезки: ширина не больше OCR_TILE_WIDTH, высота пропорционально,
+    площадь — не больше OCR_TILE_MAX_PIXELS.
+    """
+    image_bytes = _read_bytes(image_source)
+    w, h = Image.open(io.BytesIO(image_bytes)).size
+    scale = min(1.0, OCR_TILE_WIDTH / w, (OCR_TILE_MAX_PIXELS / (w * h)) ** 0.5)
+    return ingest_image(image_bytes, max_side=max(1, int(max(w, h) * scale))).array
+
+
+def plan_tiles(height: int, tile_height: int, overlap: int) -> list:
+    """
+    Полосы (y0, y1) с перекрытием overlap; последняя доходит до низа картинки.
+    """
+    if height <= tile_height:
+        return [(0, height)]
+    overlap = min(overlap, tile_height // 2)
+    step = tile_height - overlap
+    tiles = []
+    y0 = 0
+    while True:
+        y1 = min(height, y0 + tile_height)
+        tiles.append((y0, y1))
+        if y1 >= height:
+            return tiles
+        y0 += step
+
+
+def _same_line(a, b) -> bool:
+    """
+    Две рамки (x0, y0, x1, y1) — одна и та же строка из соседних полос:
+    сильно пересекаются и по вертикали, и по горизонтали.
+    """
+    dy = min(a[3], b[3]) - max(a[1], b[1])
+    dx = min(a[2], b[2]) - max(a[0], b[0])
+    if dy <= 0 or dx <= 0:
+        return False
+    min_h = min(a[3] - a[1], b[3] - b[1]) or 1
+    min_w = min(a[2] - a[0], b[2] - b[0]) or 1
+    return dy / min_h >= 0.5 and dx / min_w >= 0.5
+
+
+class _TileMerger:
+    """
+    Склейка полос сверху вниз. Строка из зоны перекрытия, найденная в двух
+    полосах, остаётся одна: целая важнее обрезанной краем полосы, при прочих
+    равных — более длинный текст. Порядок строк — как в полосах.
+    """
+
+    def __init__(self, height: int):
+        self.height = height
+        self.kept = []      # [text, box | None, score | None, clipped]
+        self.emitted = 0
+
+    def push(self, tile, entries) -> None:
+        y0, y1 = tile
+        for text, box, score in entries:
+            if box is None:
+                self.kept.append([text, None, score, False])
+                continue
+            gbox = (box[0], box[1] + y0, box[2], box[3] + y0)
+            clipped = (y0 > 0 and gbox[1] <= y0 + _TILE_EDGE_PX) or (
+                y1 < self.height and gbox[3] >= y1 - _TILE_EDGE_PX
+            )
+            # Дубли возможны только среди ещё не отданных строк (см. ready)
+            for entry in self.kept[self.emitted:]:
+                if entry[1] is not None and _same_line(entry[1], gbox):
+                    if (entry[3] and not clipped) or (
+                        entry[3] == clipped and len(text) > len(entry[0])
+                    ):
+                        entry[:] = [text, gbox, score, clipped]
+                    break
+            else:
+                self.kept.append([text, gbox, score, clipped])
+
+    def ready(self, next_y0: int = None) -> list:
+        """
+        Строки (text, box, score), которые уже не изменятся: целиком выше
+        следующей полосы (или все, если полос больше нет).
+        """
+        out = []
+        while self.emitted < len(self.kept):
+            text, box, score, _clipped = self.kept[self.emitted]
+            if next_y0 is not None and box is not None and box[3] >= next_y0:
+                break
+            out.append((text, box, score))
+            self.emitted += 1
+        return out
+
+
+def _iter_tile_entries(img: np.ndarray, ocr_lang: str, tiles: list, workers: int = None,
+                       min_score: float = None):
+    """
+    OCR полос параллельно; результаты — по порядку полос: (tile, entries).
+    Экземпляры PaddleOCR — из общего пула процесса (_ocr_replica).
+    """
+    # Потоков больше, чем слотов OCR в бюджете, не нужно: лишние только ждали бы слот
+    # (и держали бы лишний экземпляр модели) — например, в воркере ocr_pool слот один
+    workers = workers or min(OCR_TILE_WORKERS, get_thread_budget().limiters["ocr"].limit)
+    workers = max(1, min(workers, len(tiles)))
+
+    def run(tile):
+        with _ocr_replica(ocr_lang) as ocr, metrics.stage("ocr") as span:
+            with get_thread_budget().slot("ocr"):
+                result = ocr.ocr(img[tile[0]:tile[1]])
+            entries = list(_iter_entries(result, min_score))
+            span.add(len(entries))
+        return entries
+
+    if workers == 1:
+        for tile in tiles:
+            yield tile, run(tile)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sabai-tile") as ex:
+        futures = [ex.submit(metrics.bind(run), tile) for tile in tiles]
+        try:
+            for tile, fut in zip(tiles, futures):
+                yield tile, fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
+def _iter_tiled(image_source, ocr_lang: str, tile_height: int = None, overlap: int = None,
+                workers: int = None, min_score: float = None):
+    img = _tile_image(image_source)
+    tiles = plan_tiles(
+        img.shape[0],
+        tile_height or OCR_TILE_HEIGHT,
+        OCR_TILE_OVERLAP if overlap is None else overlap,
+    )
+    merger = _TileMerger(img.shape[0])
+    for k, (tile, entries) in enumerate(_iter_tile_entries(img, ocr_lang, tiles, workers, min_score)):
+        merger.push(tile, entries)
+        yield from merger.ready(tiles[k + 1][0] if k + 1 < len(tiles) else None)
+
+
+def iter_text_tiled(image_source, ocr_lang: str = "ru", tile_height: int = None,
+                    overlap: int = None, workers: int = None, min_score: float = None):
+    """
+    OCR длинного чека полосами в высоком разрешении. Строки отдаются,
+    как только ниже них готова следующая полоса.
+    """
+    for text, _box, _score in _iter_tiled(image_source, ocr_lang, tile_height, overlap,
+                                          workers, min_score):
+        yield text
+
+
+def extract_text_tiled(image_source, ocr_lang: str = "ru", tile_height: int = None,
+                       overlap: int = None, workers: int = None, structured: bool = False,
+                       min_score: float = None):
+    entries = _iter_tiled(image_source, ocr_lang, tile_height, overlap, workers, min_score)
+    if structured:
+        return OCRResult.from_entries(entries)
+    return [text for text, _box, _score in entries]
+
+
+# ------------------ DISK CACHE ------------------
+
+def _cache_probe(image_source, ocr_lang: str, image=None):
+    """
+    Ищет строки в дисковом кэше.
+    Возвращает (lines | None, store), где store(lines) сохраняет результат после OCR.
+    """
+    cache = get_ocr_cache()
+    if cache is None:
+        return None, lambda lines: None
+
+    image_bytes = _read_bytes(image_source)
+    key = content_key(image_bytes, ocr_lang, OCR_MODEL_VERSION)
+
+    phash = aspect = None
+    if cache.phash_max_distance >= 0:
+        if image is None:
+            image = ingest_image(image_bytes).array
+        phash = perceptual_hash(image)
+        aspect = image.shape[1] / image.shape[0]
+
+    try:
+        lines = cache.get(key, ocr_lang, OCR_MODEL_VERSION, phash, aspect)
+    except sqlite3.Error:
+        return None, lambda lines: None
+    metrics.cache("ocr_cache", lines is not None)
+
+    def store(lines):
+        try:
+            cache.put(key, ocr_lang, OCR_MODEL_VERSION, lines, phash, aspect)
+        except sqlite3.Error:
+            pass
+
+    return lines, store
+
+
+def _ocr_input(image_source, image=None):
+    """
+    Что отдать в OCR: уже декодированный массив, если он есть, —
+    кроме длинных чеков, которые режутся из исходника.
+    """
+    if image is None or _wants_tiling(image_source):
+        return image_source
+    return image
+
+
+def extract_text_cached(image_source, ocr_lang: str = "ru", image=None, extract=None):
+    """
+    extract_text через дисковый кэш (ocr_cache).
+    :param image: уже декодированный массив, чтобы не декодировать второй раз
+    :param extract: чем распознавать при промахе (по умолчанию extract_text,
+                    можно передать, например, OCRPool.extract)
+    """
+    extract = extract or extract_text
+    if ocr_lang not in SUPPORTED_OCR_LANGS:
+        ocr_lang = "en"
+
+    lines, store = _cache_probe(image_source, ocr_lang, image)
+    if lines is not None:
+        return lines
+
+    lines = extract(_ocr_input(image_source, image), ocr_lang=ocr_lang)
+    store(lines)
+    return lines
+
+
+def iter_text_cached(image_source, ocr_lang: str = "ru", image=None):
+    """
+    iter_text через дисковый кэш: при попадании строки отдаются сразу,
+    при промахе — потоково, а в конце результат сохраняется.
+    """
+    if ocr_lang not in SUPPORTED_OCR_LANGS:
+        ocr_lang = "en"
+
+    lines, store = _cache_probe(image_source, ocr_lang, image)
+    if lines is not None:
+        yield from lines
+        return
+
+    collected = []
+    for line in iter_text(_ocr_input(image_source, image), ocr_lang):
+        collected.append(line)
+        yield line
+    store(collected)
@@ -0,0 +1,253 @@
+# ocr_pool.py
+
+"""
+Пул OCR-процессов с заранее загруженными моделями PaddleOCR.
+
+Каждый воркер — отдельный процесс со своей очередью задач и своим
+набором языков. Запрос уходит тому воркеру, у которого язык уже загружен
+и меньше всего задач в очереди.
+"""
+
+import os
+import time
+import queue
+import atexit
+import itertools
+import threading
+import multiprocessing as mp
+from functools import lru_cache
+from concurrent.futures import Future
+
+from ocr_module import SUPPORTED_OCR_LANGS
+from thread_budget import get_thread_budget, worker_share
+
+# Число OCR-процессов. 0 — пул выключен, OCR идёт прямо в потоке сессии.
+OCR_WORKERS = int(os.environ.get("SABAI_OCR_WORKERS", "0"))
+
+# Как часто (в секундах) проверять, живы ли воркеры — и при потоке результатов тоже
+OCR_REAP_INTERVAL = float(os.environ.get("SABAI_OCR_REAP_INTERVAL", "1.0"))
+
+# Какие языки грузим заранее (через запятую)
+OCR_PRELOAD_LANGS = [
+    lang.strip()
+    for lang in os.environ.get("SABAI_OCR_PRELOAD_LANGS", "th,ru,en").split(",")
+    if lang.strip() in SUPPORTED_OCR_LANGS
+]
+
+
+def _worker_main(worker_id: int, langs, jobs, results, cpu_threads: int = 0) -> None:
+    """
+    Цикл воркера: грузим свои языки, затем обрабатываем задачи до None.
+    cpu_threads — доля OCR-ядер родителя на этот процесс (0 — бюджет по умолчанию).
+    Воркер берёт задачи по одной: один вызов OCR на все свои ядра
+    (полосы длинного чека внутри воркера идут последовательно).
+    """
+    if cpu_threads:
+        import thread_budget
+        thread_budget.configure(cpu_threads=cpu_threads, ocr_share=1.0,
+                                ocr_concurrency=1, translate_concurrency=1)
+
+    from ocr_module import get_ocr, extract_text
+
+    for lang in langs:
+        get_ocr(lang)
+    results.put(("ready", worker_id, list(langs)))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, image_source, lang = job
+        try:
+            lines = extract_text(image_source, ocr_lang=lang)
+            results.put(("done", job_id, lines))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+
+
+def assign_langs(langs, workers: int) -> list:
+    """
+    Раскладывает языки по воркерам: каждый язык хотя бы на одном воркере,
+    при избытке воркеров языки реплицируются.
+    """
+    plan = [[] for _ in range(workers)]
+    if not langs or workers <= 0:
+        return plan
+    replicas = max(1, workers // len(langs))
+    for j, lang in enumerate(langs):
+        for r in range(replicas):
+            plan[(j * replicas + r) % workers].append(lang)
+    return plan
+
+
+class _Worker:
+    def __init__(self, worker_id: int, langs, ctx, results, cpu_threads: int = 0):
+        self.id = worker_id
+        self.langs = set(langs)
+        self.cpu_threads = cpu_threads
+        self.ready = False
+        self.pending = {}  # job_id -> Future
+        self.jobs = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(worker_id, list(langs), self.jobs, results, cpu_threads),
+            daemon=True,
+        )
+        self.process.start()
+
+
+class OCRPool:
+    """
+    Пул процессов для OCR.
+    submit() → Future со списком строк, extract() — блокирующая обёртка.
+    """
+
+    def __init__(self, workers: int = None, preload_langs=None):
+        workers = workers if workers is not None else max(1, OCR_WORKERS)
+        preload_langs = list(preload_langs if preload_langs is not None else OCR_PRELOAD_LANGS)
+
+        # spawn: не тащим в воркеры потоки и состояние streamlit
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+
+        # Воркеры делят между собой OCR-долю ядер (остальное — переводу в главном процессе)
+        cpu_threads = worker_share(workers, get_thread_budget().ocr_cores)
+        self._workers = [
+            _Worker(i, langs, self._ctx, self._results, cpu_threads)
+            for i, langs in enumerate(assign_langs(preload_langs, workers))
+        ]
+        self._jobs = {}  # job_id -> worker
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    # ---------- маршрутизация ----------
+
+    def _pick_worker(self, lang: str) -> _Worker:
+        # Упавший, но ещё не заменённый воркер задачу не получит
+        alive = [w for w in self._workers if w.process.is_alive()] or self._workers
+        warm = [w for w in alive if lang in w.langs]
+        candidates = warm or alive
+        worker = min(candidates, key=lambda w: len(w.pending))
+        # Воркер загрузит язык при первой задаче — дальше считаем его тёплым
+        worker.langs.add(lang)
+        return worker
+
+    def submit(self, image_source, ocr_lang: str = "ru") -> Future:
+        if ocr_lang not in SUPPORTED_OCR_LANGS:
+            ocr_lang = "en"
+
+        # UploadedFile и прочие file-like между процессами не передаются
+        if hasattr(image_source, "getvalue"):
+            image_source = image_source.getvalue()
+        elif hasattr(image_source, "read"):
+            image_source = image_source.read()
+
+        fut = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("OCRPool is shut down")
+            job_id = next(self._ids)
+            worker = self._pick_worker(ocr_lang)
+            worker.pending[job_id] = fut
+            self._jobs[job_id] = worker
+            worker.jobs.put((job_id, image_source, ocr_lang))
+        return fut
+
+    def extract(self, image_source, ocr_lang: str = "ru", timeout: float = None) -> list:
+        return self.submit(image_source, ocr_lang).result(timeout=timeout)
+
+    # ---------- сбор результатов ----------
+
+    def _collect(self) -> None:
+        next_reap = time.monotonic() + OCR_REAP_INTERVAL
+        while True:
+            # Проверка по таймеру, а не только в тишине: пока другие воркеры
+            # присылают результаты, упавший тоже должен быть замечен
+            if time.monotonic() >= next_reap:
+                self._reap_dead()
+                next_reap = time.monotonic() + OCR_REAP_INTERVAL
+            try:
+                msg = self._results.get(timeout=OCR_REAP_INTERVAL)
+            except queue.Empty:
+                if self._closed:
+                    return
+                continue
+
+            kind, key, payload = msg
+            with self._lock:
+                if kind == "ready":
+                    self._workers[key].ready = True
+                    continue
+                worker = self._jobs.pop(key, None)
+                fut = worker.pending.pop(key, None) if worker else None
+
+            if fut is None:
+                continue
+            if kind == "done":
+                fut.set_result(payload)
+            else:
+                fut.set_exception(RuntimeError(payload))
+
+    def _reap_dead(self) -> None:
+        """
+        Упавший воркер: валим его задачи и поднимаем замену с теми же языками.
+        """
+        with self._lock:
+            for i, w in enumerate(self._workers):
+                if w.process.is_alive() or self._closed:
+                    continue
+                for job_id, fut in w.pending.items():
+                    self._jobs.pop(job_id, None)
+                    fut.set_exception(RuntimeError(f"OCR worker {w.id} died"))
+                self._workers[i] = _Worker(w.id, w.langs, self._ctx, self._results, w.cpu_threads)
+
+    # ---------- наблюдаемость ----------
+
+    def queue_depth(self) -> int:
+        """
+        Сколько задач сейчас в работе или в очереди у всех воркеров.
+        """
+        with self._lock:
+            return sum(len(w.pending) for w in self._workers)
+
+    def stats(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "worker": w.id,
+                    "pid": w.process.pid,
+                    "alive": w.process.is_alive(),
+                    "ready": w.ready,
+                    "langs": sorted(w.langs),
+                    "queue_depth": len(w.pending),
+                }
+                for w in self._workers
+            ]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for w in self._workers:
+                w.jobs.put(None)
+        for w in self._workers:
+            w.process.join(timeout=5)
+            if w.process.is_alive():
+                w.process.terminate()
+
+
+@lru_cache(maxsize=1)
+def get_ocr_pool():
+    """
+    Общий пул на процесс (или None, если SABAI_OCR_WORKERS=0).
+    """
+    if OCR_WORKERS <= 0:
+        return None
+    pool = OCRPool()
+    atexit.register(pool.shutdown)
+    return pool
@@ -2,8 +2,11 @@
 
 import re
 import pandas as pd
+from collections import namedtuple
 from typing import Optional
 
+import metrics
+
 PRICE_PATTERN = r'(\d+[.,]?\d*)$'            # цена в конце строки
 QTY_PATTERN = r'^(?:x|\*)?(\d+)[\s\-]?'      # количество в начале строки
 
@@ -17,57 +20,81 @@ META_KEYWORDS = [
     "save",
 ]
 
+# Телефоны вида 0-2826-7744 и даты 23/11/68
+PHONE_PATTERN = r"\d-\d{3,}"
+DATE_PATTERN = r"\d{1,2}/\d{1,2}/\d{2,4}"
 
-def looks_like_metadata(line: str, price_value: Optional[float]) -> bool:
-    """
-    Фильтруем служебные строки: VAT-коды, телефоны, даты, итоговые суммы и т.п.
-    """
-    low = (line or "").lower()
-
-    # Служебные слова
-    if any(k in low for k in META_KEYWORDS):
-        return True
+# Всё компилируем один раз при импорте.
+_PRICE_RE = re.compile(PRICE_PATTERN)
+_QTY_RE = re.compile(QTY_PATTERN)
+_HAS_LETTERS_RE = re.compile(r"[^\d.,]")
+_JUNK_NAME_RE = re.compile(r"[\W_]+")
+# Один автомат на все признаки служебной строки: ключевые слова + телефон + дата.
+_META_RE = re.compile(
+    "|".join([re.escape(k) for k in META_KEYWORDS] + [PHONE_PATTERN, DATE_PATTERN])
+)
 
-    # Очень большие числа почти наверняка не отдельный товар
-    if price_value is not None and price_value >= 150:
-        return True
+# Очень большие числа почти наверняка не отдельный товар
+MAX_ITEM_PRICE = 150
+# Очень мелкие цены (1–2 бат) часто пакеты/штампы/скидочные маркеры
+MIN_ITEM_PRICE = 3
 
-    # Телефоны вида 0-2826-7744
-    if re.search(r"\d-\d{3,}", line):
-        return True
+ITEM_COLUMNS = ["item", "qty", "price", "total"]
+ReceiptItem = namedtuple("ReceiptItem", ITEM_COLUMNS)
 
-    # Даты 23/11/68
-    if re.search(r"\d{1,2}/\d{1,2}/\d{2,4}", line):
-        return True
 
-    return False
+class LineToken:
+    """
+    Строка OCR, разобранная один раз: цена в конце, есть ли буквы,
+    похожа ли на служебную (без учёта величины цены).
+    """
+    __slots__ = ("text", "price", "price_start", "has_letters", "is_meta")
+
+    def __init__(self, text: str):
+        self.text = text
+        m = _PRICE_RE.search(text)
+        if m:
+            self.price = float(m.group(1).replace(",", "."))
+            self.price_start = m.start()
+        else:
+            self.price = None
+            self.price_start = -1
+        self.has_letters = _HAS_LETTERS_RE.search(text) is not None
+        # В строке из одних цифр/точек/запятых нет ни слов, ни телефонов, ни дат
+        self.is_meta = self.has_letters and _META_RE.search(text.lower()) is not None
+
+
+def tokenize_line(raw_line) -> Optional[LineToken]:
+    """
+    Пустые строки → None, остальное → LineToken.
+    """
+    line = (raw_line or "").strip()
+    return LineToken(line) if line else None
 
 
-def parse_line_with_price(line: str):
+def looks_like_metadata(line: str, price_value: Optional[float]) -> bool:
     """
-    Разбирает строку, где уже точно есть цена в конце.
-    Возвращает (name, qty, price) или (None, None, None), если это мусор.
+    Фильтруем служебные строки: VAT-коды, телефоны, даты, итоговые суммы и т.п.
     """
-    line = line.strip()
-    price_match = re.search(PRICE_PATTERN, line)
-    if not price_match:
-        return None, None, None
+    if price_value is not None and price_value >= MAX_ITEM_PRICE:
+        return True
+    return _META_RE.search((line or "").lower()) is not None
 
-    price_str = price_match.group(1).replace(",", ".")
-    try:
-        price = float(price_str)
-    except ValueError:
-        return None, None, None
 
+def _item_from_priced(tok: LineToken) -> Optional[ReceiptItem]:
+    """
+    Строка, где есть и текст, и цена в конце: 'Название  x2  40.00'.
+    """
+    price = tok.price
     # Отсекаем явные метаданные
-    if looks_like_metadata(line, price):
-        return None, None, None
+    if tok.is_meta or price >= MAX_ITEM_PRICE:
+        return None
 
     # удаляем цену
-    clean = re.sub(PRICE_PATTERN, "", line).strip()
+    clean = tok.text[:tok.price_start].strip()
 
     # Количество в начале
-    qty_match = re.match(QTY_PATTERN, clean)
+    qty_match = _QTY_RE.match(clean)
     if qty_match:
         qty = int(qty_match.group(1))
         clean = clean[qty_match.end():].strip()
@@ -77,118 +104,96 @@ def parse_line_with_price(line: str):
     name = clean
 
     # Слишком короткие/мусорные названия не берём
-    if not name or len(name) < 2 or re.fullmatch(r"[\W_]+", name):
-        return None, None, None
+    if not name or len(name) < 2 or _JUNK_NAME_RE.fullmatch(name):
+        return None
 
-    # Очень мелкие цены (1–2 бат) часто пакеты/штампы/скидочные маркеры
-    # Если нужно будет их учитывать — потом ослабим этот фильтр.
-    if price < 3:
-        return None, None, None
+    # Если нужно будет учитывать мелочь — потом ослабим этот фильтр.
+    if price < MIN_ITEM_PRICE:
+        return None
 
-    return name, qty, price
+    return ReceiptItem(name, qty, price, qty * price)
 
 
-def parse_receipt(lines):
+def parse_line_with_price(line: str):
     """
-    Принимает список ОРИГИНАЛЬНЫХ строк OCR (НЕ перевода!)
-    Возвращает DataFrame: item, qty, price, total.
+    Разбирает строку, где уже точно есть цена в конце.
+    Возвращает (name, qty, price) или (None, None, None), если это мусор.
+    """
+    tok = tokenize_line(line)
+    if tok is None or tok.price is None:
+        return None, None, None
+    item = _item_from_priced(tok)
+    if item is None:
+        return None, None, None
+    return item.item, item.qty, item.price
+
+
+def iter_items(lines):
+    """
+    Однопроходный разбор: принимает любой итерируемый источник строк OCR
+    (список, генератор, файл) и отдаёт ReceiptItem по одному.
 
     Паттерны:
       1) 'Название  x2  40.00'
       2) '40.00' на одной строке и 'Название' на следующей (часто в 7-Eleven TH).
     """
-    items = []
-    pending_name: Optional[str] = None
-    i = 0
-    n = len(lines)
-
-    while i < n:
-        raw_line = lines[i]
-        line = (raw_line or "").strip()
-        if not line:
-            i += 1
-            continue
+    tokens = (tok for tok in map(tokenize_line, lines) if tok is not None)
+    pending: Optional[LineToken] = None
+    tok = next(tokens, None)
 
-        price_match = re.search(PRICE_PATTERN, line)
-        has_letters = bool(re.search(r"[^\d.,]", line))
+    while tok is not None:
+        price = tok.price
 
         # --- 1. Текст + цена в одной строке ---
-        if price_match and has_letters:
-            name, qty, price = parse_line_with_price(line)
-            if name and price is not None:
-                items.append({
-                    "item": name,
-                    "qty": qty,
-                    "price": price,
-                    "total": qty * price,
-                })
-            pending_name = None
-            i += 1
+        if price is not None and tok.has_letters:
+            item = _item_from_priced(tok)
+            if item is not None:
+                yield item
+            pending = None
+            tok = next(tokens, None)
             continue
 
         # --- 2. Строка только с ЦЕНОЙ ---
-        if price_match and not has_letters:
-            price_str = price_match.group(1).replace(",", ".")
-            try:
-                price = float(price_str)
-            except ValueError:
-                pending_name = None
-                i += 1
-                continue
-
+        if price is not None:
             # Мелочь игнорируем
-            if price < 3:
-                pending_name = None
-                i += 1
+            if price < MIN_ITEM_PRICE:
+                pending = None
+                tok = next(tokens, None)
                 continue
 
             # 2A. Тайский формат: цена → следующая строка = название
-            j = i + 1
-            while j < n and not (lines[j] or "").strip():
-                j += 1
-
-            if j < n:
-                next_raw = lines[j]
-                next_line = (next_raw or "").strip()
-                next_has_letters = bool(re.search(r"[^\d.,]", next_line))
-                next_price_match = re.search(PRICE_PATTERN, next_line)
-
-                if next_line and next_has_letters and not next_price_match:
-                    combined = f"{next_line} {line}"
-                    if not looks_like_metadata(combined, price):
-                        items.append({
-                            "item": next_line,
-                            "qty": 1,
-                            "price": price,
-                            "total": price,
-                        })
-                        pending_name = None
-                        i = j + 1
-                        continue
+            nxt = next(tokens, None)
+            if nxt is not None and nxt.has_letters and nxt.price is None:
+                if not (nxt.is_meta or price >= MAX_ITEM_PRICE):
+                    yield ReceiptItem(nxt.text, 1, price, price)
+                    pending = None
+                    tok = next(tokens, None)
+                    continue
 
             # 2B. Fallback: "предыдущая строка = название"
-            if pending_name:
-                combined = f"{pending_name} {line}"
-                if not looks_like_metadata(combined, price):
-                    items.append({
-                        "item": pending_name,
-                        "qty": 1,
-                        "price": price,
-                        "total": price,
-                    })
-
-            pending_name = None
-            i += 1
+            if pending is not None and not (pending.is_meta or price >= MAX_ITEM_PRICE):
+                yield ReceiptItem(pending.text, 1, price, price)
+
+            pending = None
+            tok = nxt
             continue
 
         # --- 3. Строка с буквами, но без цены: кандидаты на название ---
-        if has_letters and not price_match:
-            pending_name = line
-            i += 1
-            continue
+        if tok.has_letters:
+            pending = tok
 
         # Остальное (голые цифры) игнорируем
-        i += 1
+        tok = next(tokens, None)
+
 
-    df = pd.DataFrame(items)
-    return df
+@metrics.traced("parse_receipt", items=len)
+def parse_receipt(lines, as_frame: bool = True):
+    """
+    Принимает список ОРИГИНАЛЬНЫХ строк OCR (НЕ перевода!)
+    Возвращает DataFrame: item, qty, price, total.
+    С as_frame=False — просто list[ReceiptItem], без pandas.
+    """
+    items = list(iter_items(lines))
+    if not as_frame:
+        return items
+    return pd.DataFrame(items, columns=ITEM_COLUMNS)
@@ -0,0 +1,418 @@
+# pipeline.py
+
+"""
+Безголовый (без Streamlit) конвейер обработки чеков:
+OCR → нормализация строк → язык → parse_receipt → перевод → категории.
+
+Запуск пачкой:
+    python pipeline.py ./receipts --out results.jsonl --ocr-lang th --workers 4
+    python pipeline.py "archive/2024-*/*.jpg" --out results.csv --format csv
+Повторный запуск с тем же --out продолжает с места падения.
+"""
+
+import os
+import sys
+import io
+import csv
+import glob
+import json
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import metrics
+from thread_budget import worker_share
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+CSV_FIELDS = [
+    "source", "ocr_lang", "src_lang", "item", "qty", "price", "total",
+    "item_en", "category", "item_translated", "error",
+    "receipt_rows",  # сколько строк у чека: по нему при продолжении видно недописанные чеки
+]
+
+
+def normalize_lines(lines) -> list:
+    """
+    Приводит результат OCR (строка или список) к списку непустых строк.
+    """
+    if isinstance(lines, str):
+        return [ln.strip() for ln in lines.splitlines() if ln.strip()]
+    return [str(ln).strip() for ln in lines if str(ln).strip()]
+
+
+def process_lines(lines, target_lang: str = None, ocr_lang: str = None) -> dict:
+    """
+    Всё, что идёт после OCR: язык, структура, перевод и категории.
+    """
+    from translator import detect_lang_code
+    from parser import parse_receipt
+
+    lines = normalize_lines(lines)
+    src_lang = detect_lang_code("\n".join(lines), ocr_lang)
+
+    items = parse_receipt(lines, as_frame=False)
+    metrics.count("ocr_lines", len(lines))
+    metrics.count("items", len(items))
+    return {
+        "src_lang": src_lang,
+        "lines": lines,
+        "items": _enrich(items, src_lang, target_lang) if items else [],
+    }
+
+
+def process_receipt(image_source, ocr_lang: str = "ru", target_lang: str = None) -> dict:
+    """
+    Полный конвейер для одного изображения.
+    """
+    from ocr_module import extract_text_cached
+
+    with metrics.receipt_trace(image_source if isinstance(image_source, str) else None):
+        lines = extract_text_cached(image_source, ocr_lang=ocr_lang)
+        result = process_lines(lines, target_lang, ocr_lang)
+    result["ocr_lang"] = ocr_lang
+    return result
+
+
+# ------------------ STREAMING ------------------
+
+# Сколько готовых позиций максимум переводим за один шаг потока
+STREAM_CHUNK_ITEMS = int(os.environ.get("SABAI_STREAM_CHUNK_ITEMS", "8"))
+
+
+def _enrich(items, src_lang: str, target_lang: str = None) -> list:
+    """
+    Перевод в EN + категория (+ перевод на целевой язык) для пачки ReceiptItem.
+    """
+    from translator import translate_batch
+    from category_module import categorize_many
+
+    names = [it.item for it in items]
+    items_en = translate_batch(names, src_lang, "en")
+    categories = list(categorize_many(items_en))
+    translated = translate_batch(names, src_lang, target_lang) if target_lang else None
+
+    rows = []
+    for i, it in enumerate(items):
+        row = it._asdict()
+        row["item_en"] = items_en[i]
+        row["category"] = categories[i]
+        if translated is not None:
+            row["item_translated"] = translated[i]
+        rows.append(row)
+    return rows
+
+
+def iter_process(image_source, ocr_lang: str = "ru", target_lang: str = None,
+                 image=None, chunk_size: int = None):
+    """
+    Потоковый конвейер. OCR (по полосам) и разбор идут в фоновом потоке,
+    а здесь готовые позиции переводятся и категоризуются, пока OCR продолжается.
+
+    Генерирует события:
+        {"event": "lines", "lines": [...]}  — новые строки OCR
+        {"event": "items", "items": [...]}  — готовые позиции (перевод + категория)
+        {"event": "done", "src_lang": ..., "lines": [...], "items": [...], "revised": bool}
+
+    В done язык определён по всему тексту (как в process_lines). Если он
+    разошёлся с предварительным (по строкам до первой позиции), позиции
+    в done переведены заново — revised=True.
+    """
+    from ocr_module import iter_text_cached
+    from parser import iter_items
+    from translator import detect_lang_code
+
+    chunk_size = chunk_size or STREAM_CHUNK_ITEMS
+    events = queue.Queue()
+
+    def produce():
+        def line_source():
+            # Те же строки, что дала бы normalize_lines: позиции совпадут с parse_receipt
+            for line in iter_text_cached(image_source, ocr_lang=ocr_lang, image=image):
+                line = str(line).strip()
+                if line:
+                    events.put(("line", line))
+                    yield line
+
+        try:
+            for item in iter_items(line_source()):
+                events.put(("item", item))
+        except Exception as e:
+            events.put(("error", e))
+        finally:
+            events.put(("end", None))
+
+    # Трасса чека; поток OCR пишет в неё же (bind копирует контекст)
+    trace = metrics.start_receipt(image_source if isinstance(image_source, str) else None)
+    threading.Thread(target=metrics.bind(produce), name="sabai-stream-ocr", daemon=True).start()
+
+    lines, items, rows = [], [], []
+    src_lang = None
+    revised = False
+    finished = False
+
+    try:
+        while not finished:
+            # Ждём хотя бы одно событие, затем забираем всё, что уже накопилось
+            pending = [events.get()]
+            while len(pending) < chunk_size * 4:
+                try:
+                    pending.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            new_lines, new_items = [], []
+            for kind, payload in pending:
+                if kind == "line":
+                    new_lines.append(payload)
+                elif kind == "item":
+                    new_items.append(payload)
+                elif kind == "error":
+                    raise payload
+                else:
+                    finished = True
+
+            if new_lines:
+                lines.extend(new_lines)
+                yield {"event": "lines", "lines": new_lines}
+
+            for start in range(0, len(new_items), chunk_size):
+                if src_lang is None:
+                    # Язык — по строкам, прочитанным к первой готовой позиции
+                    src_lang = detect_lang_code("\n".join(lines), ocr_lang)
+                batch = new_items[start:start + chunk_size]
+                items.extend(batch)
+                chunk = _enrich(batch, src_lang, target_lang)
+                rows.extend(chunk)
+                yield {"event": "items", "items": chunk}
+
+        final_lang = detect_lang_code("\n".join(lines), ocr_lang)
+        if src_lang is not None and final_lang != src_lang and items:
+            rows = _enrich(items, final_lang, target_lang)
+            revised = True
+        src_lang = final_lang
+        if trace is not None:
+            trace.count("ocr_lines", len(lines))
+            trace.count("items", len(rows))
+    finally:
+        metrics.finish_receipt(trace)
+
+    yield {"event": "done", "src_lang": src_lang, "lines": lines, "items": rows, "revised": revised}
+
+
+# ------------------ BATCH / CLI ------------------
+
+def collect_inputs(pattern: str) -> list:
+    """
+    Папка → все картинки в ней (рекурсивно), иначе — glob-шаблон.
+    """
+    if os.path.isdir(pattern):
+        paths = []
+        for root, _dirs, files in os.walk(pattern):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+    else:
+        paths = [p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)]
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def load_done(out_path: str, fmt: str) -> set:
+    """
+    Источники, уже успешно записанные в выходной файл (для продолжения после падения).
+    Решает последняя попытка по источнику: если она с ошибкой (модель не загрузилась,
+    не хватило памяти) или чек в CSV недописан — обработаем заново; успешный
+    повтор перекрывает прежнюю ошибку.
+    """
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+
+    with open(out_path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            # source -> [строк, ожидается (None — оборванная строка), ошибка] последней попытки
+            attempts = {}
+            reader = csv.DictReader(f)
+            # Файлы старых версий без receipt_rows: каждая строка — отдельная запись
+            legacy = "receipt_rows" not in (reader.fieldnames or [])
+            for row in reader:
+                source = row.get("source")
+                if not source:
+                    continue
+                try:
+                    expected = 0 if legacy else int(row["receipt_rows"])
+                except (TypeError, ValueError):
+                    expected = None  # строка оборвана на середине
+                error = bool(row.get("error"))
+                last = attempts.get(source)
+                # Новая попытка: прошлая дописана целиком или строка явно из другой записи
+                if (last is None or (last[1] is not None and last[0] >= last[1])
+                        or (last[1], last[2]) != (expected, error)):
+                    last = attempts[source] = [0, expected, error]
+                last[0] += 1
+            for source, (n, expected, error) in attempts.items():
+                if not error and expected is not None and n >= expected:
+                    done.add(source)
+        else:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record.get("error"):
+                        done.discard(record["source"])
+                    else:
+                        done.add(record["source"])
+                except (ValueError, KeyError, AttributeError):
+                    # Недописанная последняя строка после падения — переделаем
+                    continue
+    return done
+
+
+def _csv_header(path: str) -> list:
+    with open(path, encoding="utf-8", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def _init_worker(ocr_lang: str, cpu_threads: int = 0) -> None:
+    # Ядра делим между процессами, иначе каждый возьмёт пулы потоков на все.
+    # Внутри процесса чек идёт по стадиям по очереди: и OCR, и перевод — на все его ядра
+    if cpu_threads:
+        import thread_budget
+        thread_budget.configure(cpu_threads=cpu_threads, ocr_share=1.0,
+                                ocr_concurrency=1, translate_concurrency=1,
+                                ocr_threads=cpu_threads, torch_threads=cpu_threads)
+
+    # Модели грузим один раз на процесс, а не на каждый чек
+    from ocr_module import get_ocr
+    from translator import get_model
+    get_ocr(ocr_lang)
+    get_model()
+
+
+def _run_one(path: str, ocr_lang: str, target_lang: str) -> dict:
+    try:
+        result = process_receipt(path, ocr_lang=ocr_lang, target_lang=target_lang)
+    except Exception as e:
+        return {"source": path, "ocr_lang": ocr_lang, "error": f"{type(e).__name__}: {e}"}
+    result["source"] = path
+    return result
+
+
+def _write_result(f, writer, result: dict) -> None:
+    if writer is None:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    else:
+        base = {
+            "source": result["source"],
+            "ocr_lang": result.get("ocr_lang", ""),
+            "src_lang": result.get("src_lang", ""),
+            "error": result.get("error", ""),
+        }
+        items = result.get("items") or [{}]
+        base["receipt_rows"] = len(items)
+        # Все строки чека — одной записью в файл, а не по мере заполнения буфера
+        chunk = io.StringIO()
+        chunk_writer = csv.DictWriter(chunk, fieldnames=writer.fieldnames, extrasaction="ignore")
+        for item in items:
+            row = dict(base)
+            row.update({k: v for k, v in item.items() if k in CSV_FIELDS})
+            chunk_writer.writerow(row)
+        f.write(chunk.getvalue())
+    f.flush()
+
+
+def run_batch(
+    inputs,
+    out_path: str,
+    fmt: str = "jsonl",
+    ocr_lang: str = "ru",
+    target_lang: str = None,
+    workers: int = None,
+    history: bool = False,
+) -> int:
+    """
+    Обрабатывает список картинок пулом процессов, результаты пишутся
+    в out_path по мере готовности. Возвращает число обработанных чеков.
+    history=True — ещё и в историю чеков (receipt_history, ключ — путь к файлу).
+    """
+    done = load_done(out_path, fmt)
+    todo = [p for p in inputs if p not in done]
+    if not todo:
+        return 0
+
+    store = None
+    if history:
+        from receipt_history import get_receipt_history
+        store = get_receipt_history()
+
+    new_file = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    processed = 0
+
+    # Если процесс упал посреди записи, добиваем перевод строки
+    if not new_file:
+        with open(out_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) not in (b"\n", b"\r"):
+                f.write(b"\n")
+
+    with open(out_path, "a", encoding="utf-8", newline="") as f:
+        writer = None
+        if fmt == "csv":
+            # Дописываем в старый файл — с его заголовком (до receipt_rows колонки не было)
+            fieldnames = CSV_FIELDS if new_file else _csv_header(out_path) or CSV_FIELDS
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(ocr_lang, worker_share(workers or os.cpu_count() or 1)),
+        ) as pool:
+            futures = [pool.submit(_run_one, p, ocr_lang, target_lang) for p in todo]
+            for fut in as_completed(futures):
+                result = fut.result()
+                _write_result(f, writer, result)
+                if store is not None and "error" not in result:
+                    store.save_receipt(
+                        result["source"], result["items"],
+                        ocr_lang=result.get("ocr_lang"), src_lang=result.get("src_lang"),
+                    )
+                processed += 1
+
+    return processed
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="SabAI Bill: пакетная обработка чеков без UI")
+    ap.add_argument("input", help="папка с картинками или glob-шаблон")
+    ap.add_argument("--out", required=True, help="выходной файл (.jsonl или .csv)")
+    ap.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                    help="формат вывода (по умолчанию — по расширению --out)")
+    ap.add_argument("--ocr-lang", default="ru", help="язык PaddleOCR (ru, th, latin, ...)")
+    ap.add_argument("--target-lang", default=None, help="язык перевода позиций (ru, en, ...)")
+    ap.add_argument("--workers", type=int, default=None, help="число процессов")
+    ap.add_argument("--history", action="store_true", help="сохранять чеки в историю (SABAI_HISTORY_PATH)")
+    args = ap.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.out.lower().endswith(".csv") else "jsonl")
+    inputs = collect_inputs(args.input)
+    if not inputs:
+        print(f"Нет изображений по пути: {args.input}", file=sys.stderr)
+        return 1
+
+    n = run_batch(
+        inputs,
+        args.out,
+        fmt=fmt,
+        ocr_lang=args.ocr_lang,
+        target_lang=args.target_lang,
+        workers=args.workers,
+        history=args.history,
+    )
+    print(f"Обработано чеков: {n} (всего найдено: {len(inputs)})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# pipeline_state.py
+
+"""
+Состояние конвейера между перезапусками скрипта Streamlit.
+
+Каждая стадия помнит версии своих входов: если ни один вход не менялся,
+значение берётся из прошлого прогона. Пересчитываются только стадии
+ниже изменившегося входа — например, выбор групп в split bill не трогает
+разбор, перевод и категории.
+
+    state = st.session_state.setdefault("pipeline", PipelineState())
+    state.begin()
+    state.input("ocr_lines", lines, key=ocr_key)
+    state.input("target_lang", target_lang)
+    df = state.stage("items", ["ocr_lines"], parse_receipt)
+"""
+
+_SAME = object()
+
+
+class _Node:
+    __slots__ = ("value", "version", "signature")
+
+    def __init__(self, value, version, signature):
+        self.value = value
+        self.version = version
+        self.signature = signature
+
+
+class PipelineState:
+    """
+    Граф стадий с версиями. Входы — значения снаружи (строки OCR, выбранный
+    язык); стадии — функции от значений других узлов.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._clock = 0
+        self.recomputed = []  # стадии, пересчитанные с последнего begin()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def begin(self) -> None:
+        """Начало очередного прогона скрипта."""
+        self.recomputed = []
+
+    def input(self, name: str, value, key=_SAME):
+        """
+        Задаёт вход. key — чем сравнивать с прошлым значением (по умолчанию само
+        значение; для больших объектов передайте хэш). Должен поддерживать ==.
+        """
+        token = value if key is _SAME else key
+        node = self._nodes.get(name)
+        if node is None or node.signature != token:
+            self._nodes[name] = _Node(value, self._tick(), token)
+        else:
+            node.value = value
+        return value
+
+    def stage(self, name: str, deps, fn, params=(), keep=None):
+        """
+        Значение стадии: fn(*значения deps). Пересчёт — только если поменялась
+        версия хотя бы одного узла из deps или params (простые значения).
+        keep(value) -> False — результат временный (например, перевод не удался):
+        он отдаётся дальше, но в следующем прогоне стадия считается заново.
+        """
+        signature = (tuple(self._nodes[d].version for d in deps), params)
+        node = self._nodes.get(name)
+        if node is not None and node.signature == signature:
+            return node.value
+
+        value = fn(*(self._nodes[d].value for d in deps))
+        if keep is not None and not keep(value):
+            signature = None
+        self._nodes[name] = _Node(value, self._tick(), signature)
+        self.recomputed.append(name)
+        return value
+
+    def get(self, name: str, default=None):
+        node = self._nodes.get(name)
+        return default if node is None else node.value
+
+    def version(self, name: str) -> int:
+        node = self._nodes.get(name)
+        return 0 if node is None else node.version
+
+    def invalidate(self, name: str = None) -> None:
+        """Сбросить одну стадию (или всё состояние)."""
+        if name is None:
+            self._nodes.clear()
+        else:
+            self._nodes.pop(name, None)
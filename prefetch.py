@@ -0,0 +1,269 @@
+# prefetch.py
+
+"""
+Упреждающий перевод позиций на вероятные языки показа.
+
+После разбора чека названия в фоне переводятся на самые частые целевые
+языки (из SABAI_PREFETCH_LANGS или выученные по выбору пользователей).
+Смена языка в UI тогда берёт готовый результат, а не ждёт NLLB.
+
+Фоновый поток — с пониженным приоритетом, работает маленькими кусками
+и уступает модель переднему плану (foreground). Новый чек отменяет
+незавершённую работу по старому — только в той же сессии (session):
+пользователи одного процесса не отменяют друг другу фон.
+"""
+
+import os
+import json
+import queue
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+# SABAI_PREFETCH=0 — не переводить заранее
+PREFETCH_ENABLED = os.environ.get("SABAI_PREFETCH", "1") != "0"
+
+# Языки через запятую; пусто — учимся по выбору пользователей
+PREFETCH_LANGS = [
+    lang.strip() for lang in os.environ.get("SABAI_PREFETCH_LANGS", "").split(",") if lang.strip()
+]
+
+# Сколько языков переводить заранее (без учёта уже показанного)
+PREFETCH_TOP_N = int(os.environ.get("SABAI_PREFETCH_TOP_N", "2"))
+
+# Пока статистики нет — самые частые языки интерфейса
+PREFETCH_DEFAULT_LANGS = ("ru", "en", "zh")
+
+# Названий за один вызов модели: между кусками проверяем отмену и передний план
+PREFETCH_CHUNK = int(os.environ.get("SABAI_PREFETCH_CHUNK", "8"))
+
+# nice для фонового потока (Linux: приоритет отдельного потока)
+PREFETCH_NICE = int(os.environ.get("SABAI_PREFETCH_NICE", "10"))
+
+# Сколько наборов готовых переводов держать в памяти
+PREFETCH_MAX_RESULTS = int(os.environ.get("SABAI_PREFETCH_MAX_RESULTS", "32"))
+
+# Сколько сессий помнить (самые давние забываются, их фон отменяется)
+PREFETCH_MAX_SESSIONS = int(os.environ.get("SABAI_PREFETCH_MAX_SESSIONS", "256"))
+
+STATS_PATH = os.environ.get(
+    "SABAI_PREFETCH_STATS_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "sabai_bill", "target_langs.json"),
+)
+
+
+class TranslationPrefetcher:
+    """
+    Очередь упреждающих переводов с одним фоновым потоком.
+    """
+
+    def __init__(self, langs=None, top_n: int = PREFETCH_TOP_N, stats_path: str = STATS_PATH):
+        self.langs = list(langs or [])
+        self.top_n = top_n
+        self.stats_path = stats_path
+        self.usage = self._load_usage()
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._foreground = 0
+        self._generation = 0
+        self._sessions = OrderedDict()  # session -> (receipt_key, generation)
+        self._scheduled = set()  # (session, key) в очереди
+        self._results = OrderedDict()  # (src, tgt, names) -> переводы
+        self._thread = None
+        self.done = 0
+        self.cancelled = 0
+        self.hits = 0
+
+    # ---------- статистика языков ----------
+
+    def _load_usage(self) -> Counter:
+        try:
+            with open(self.stats_path, encoding="utf-8") as f:
+                return Counter({k: int(v) for k, v in json.load(f).items()})
+        except (OSError, ValueError, AttributeError):
+            return Counter()
+
+    def record_choice(self, lang: str) -> None:
+        """
+        Пользователь выбрал язык показа — учитываем в статистике.
+        """
+        with self._lock:
+            self.usage[lang] += 1
+            snapshot = dict(self.usage)
+        try:
+            os.makedirs(os.path.dirname(self.stats_path) or ".", exist_ok=True)
+            tmp = f"{self.stats_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.stats_path)
+        except OSError:
+            pass
+
+    def likely_langs(self, exclude=()) -> list:
+        """
+        До top_n языков: заданные явно, иначе самые частые по статистике,
+        добитые языками по умолчанию.
+        """
+        exclude = set(exclude)
+        if self.langs:
+            ranked = self.langs
+        else:
+            with self._lock:
+                ranked = [lang for lang, _n in self.usage.most_common()]
+            ranked += [lang for lang in PREFETCH_DEFAULT_LANGS if lang not in ranked]
+        return [lang for lang in ranked if lang not in exclude][: self.top_n]
+
+    # ---------- планирование ----------
+
+    def schedule(self, receipt_key, names, src_lang: str, exclude=(), session=None) -> list:
+        """
+        Поставить в очередь перевод names на вероятные языки.
+        Другой receipt_key в той же session отменяет всё, что осталось
+        по прошлому чеку этой сессии; чужие сессии не трогаются.
+        Возвращает языки, которые реально поставлены в очередь.
+        """
+        names = tuple(str(n) if n is not None else "" for n in names)
+        if not any(n.strip() for n in names):
+            return []
+
+        langs = self.likely_langs(exclude=set(exclude) | {src_lang})
+        queued = []
+        with self._lock:
+            current = self._sessions.get(session)
+            if current is None or current[0] != receipt_key:
+                self._drop_session(session)
+                self._generation += 1
+                current = (receipt_key, self._generation)
+            self._sessions[session] = current
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > PREFETCH_MAX_SESSIONS:
+                self._drop_session(next(iter(self._sessions)))
+
+            for tgt in langs:
+                key = (src_lang, tgt, names)
+                if (session, key) in self._scheduled or key in self._results:
+                    continue
+                self._scheduled.add((session, key))
+                self._jobs.put((session, current[1], key))
+                queued.append(tgt)
+            if queued:
+                self._ensure_thread()
+        return queued
+
+    def cancel(self, session=None) -> None:
+        """
+        Отменить фон сессии (session=None — сессии по умолчанию).
+        """
+        with self._lock:
+            self._drop_session(session)
+
+    def _drop_session(self, session) -> None:
+        # Под self._lock: задания сессии перестают быть текущими
+        self._sessions.pop(session, None)
+        self._scheduled = {item for item in self._scheduled if item[0] != session}
+        self._idle.notify_all()
+
+    def get(self, names, src_lang: str, tgt_lang: str):
+        """
+        Готовый перевод names или None.
+        """
+        key = (src_lang, tgt_lang, tuple(str(n) if n is not None else "" for n in names))
+        with self._lock:
+            out = self._results.get(key)
+            if out is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+            return out
+
+    @contextmanager
+    def foreground(self):
+        """
+        Обёртка для перевода «на глазах у пользователя»: фон ждёт, пока она идёт.
+        """
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                self._idle.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._jobs.qsize(),
+                "done": self.done,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "results": len(self._results),
+                "usage": dict(self.usage),
+            }
+
+    # ---------- фоновый поток ----------
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sabai-prefetch", daemon=True)
+            self._thread.start()
+
+    def _current(self, session, generation: int) -> bool:
+        """
+        Дождаться свободной модели; False — задание отменено.
+        """
+        with self._lock:
+            while self._foreground and self._live(session, generation):
+                self._idle.wait(0.5)
+            return self._live(session, generation)
+
+    def _live(self, session, generation: int) -> bool:
+        current = self._sessions.get(session)
+        return current is not None and current[1] == generation
+
+    def _run(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+        except (AttributeError, OSError):
+            pass
+
+        from translator import translate_batch
+
+        while True:
+            session, generation, key = self._jobs.get()
+            src_lang, tgt_lang, names = key
+            out = []
+            with self._lock:
+                ready = key in self._results  # уже перевела другая сессия
+            for start in range(0, 0 if ready else len(names), PREFETCH_CHUNK):
+                if not self._current(session, generation):
+                    break
+                chunk = list(names[start:start + PREFETCH_CHUNK])
+                try:
+                    out.extend(translate_batch(chunk, src_lang, tgt_lang))
+                except Exception:
+                    break
+
+            with self._lock:
+                self._scheduled.discard((session, key))
+                if ready:
+                    continue
+                if len(out) != len(names):
+                    self.cancelled += 1
+                    continue
+                self._results[key] = [tr if n.strip() else n for n, tr in zip(names, out)]
+                while len(self._results) > PREFETCH_MAX_RESULTS:
+                    self._results.popitem(last=False)
+                self.done += 1
+
+
+@lru_cache(maxsize=1)
+def get_prefetcher():
+    """
+    Общий экземпляр на процесс (None, если SABAI_PREFETCH=0).
+    """
+    if not PREFETCH_ENABLED:
+        return None
+    return TranslationPrefetcher(PREFETCH_LANGS)
@@ -0,0 +1,391 @@
+# receipt_history.py
+
+"""
+История чеков с инкрементальными агрегатами (SQLite).
+
+Позиции сохраняются вместе с категорией, языком и раскладкой по группам
+split bill. При каждой вставке обновляется сводная таблица aggregates:
+сумма и число позиций по категории, по группе и по чекам — за всё время,
+по месяцам и по дням. Дашборд читает только сводки (по первичному ключу),
+а не пересчитывает все позиции.
+
+Суммы хранятся в минимальных единицах (как в split_engine): на сотнях
+тысяч чеков не копятся ошибки округления float.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+
+from category_module import OTHER
+
+DEFAULT_DB_PATH = os.environ.get(
+    "SABAI_HISTORY_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "sabai_bill", "history.sqlite3"),
+)
+
+# SABAI_HISTORY=0 — не сохранять историю
+HISTORY_ENABLED = os.environ.get("SABAI_HISTORY", "1") != "0"
+
+# Окна агрегатов: период -> формат корзины (strftime, локальное время)
+PERIODS = {"all": None, "month": "%Y-%m", "day": "%Y-%m-%d"}
+
+# Измерения агрегатов
+DIMENSIONS = ("category", "group", "receipts")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id        INTEGER PRIMARY KEY,
+    key       TEXT NOT NULL UNIQUE,
+    created   REAL NOT NULL,
+    ocr_lang  TEXT,
+    src_lang  TEXT,
+    n_items   INTEGER NOT NULL,
+    total     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_created ON receipts(created);
+
+CREATE TABLE IF NOT EXISTS receipt_items (
+    receipt_id INTEGER NOT NULL,
+    pos        INTEGER NOT NULL,
+    item       TEXT NOT NULL,
+    item_en    TEXT,
+    category   TEXT NOT NULL,
+    qty        REAL,
+    price      REAL,
+    total      INTEGER NOT NULL,
+    groups     TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (receipt_id, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_receipt_items_category ON receipt_items(category);
+
+CREATE TABLE IF NOT EXISTS receipt_shares (
+    receipt_id INTEGER NOT NULL,
+    grp        TEXT NOT NULL,
+    amount     INTEGER NOT NULL,
+    n_items    INTEGER NOT NULL,
+    PRIMARY KEY (receipt_id, grp)
+);
+
+-- dim: category | group | receipts; period: all | month | day; bucket: '' | 2026-10 | 2026-10-17
+CREATE TABLE IF NOT EXISTS aggregates (
+    dim    TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    key    TEXT NOT NULL,
+    total  INTEGER NOT NULL,
+    count  INTEGER NOT NULL,
+    PRIMARY KEY (dim, period, bucket, key)
+) WITHOUT ROWID;
+"""
+
+_UPSERT = (
+    "INSERT INTO aggregates (dim, period, bucket, key, total, count) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(dim, period, bucket, key) DO UPDATE SET "
+    "total = total + excluded.total, count = count + excluded.count"
+)
+
+
+def _minor(value, minor_units: int) -> int:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(round(value * minor_units)) if value == value else 0  # NaN → 0
+
+
+def _number(value):
+    # numpy-скаляры из DataFrame sqlite3 не принимает
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+def _buckets(created: float) -> list:
+    local = time.localtime(created)
+    return [(period, time.strftime(fmt, local) if fmt else "") for period, fmt in PERIODS.items()]
+
+
+def _deltas(created: float, items, shares, sign: int = 1) -> list:
+    """
+    Строки для aggregates от одного чека: items — [(category, total)],
+    shares — [(group, amount, n_items)]. sign=-1 — вычесть (замена/удаление).
+    """
+    acc = {}
+
+    def add(dim, key, total, count):
+        for period, bucket in _buckets(created):
+            k = (dim, period, bucket, key)
+            t, c = acc.get(k, (0, 0))
+            acc[k] = (t + total, c + count)
+
+    for category, total in items:
+        add("category", category, total, 1)
+    for grp, amount, n_items in shares:
+        add("group", grp, amount, n_items)
+    add("receipts", "", sum(total for _c, total in items), 1)
+    return [(*k, sign * t, sign * c) for k, (t, c) in acc.items()]
+
+
+def _shares(totals_minor, assignments, weights, caps, minor_units: int) -> list:
+    """
+    Доли групп через split_engine.split_matrix: [(group, amount, n_items)].
+    assignments — {позиция: [группы]}.
+    """
+    import numpy as np
+    from split_engine import split_matrix, group_caps
+
+    groups = []
+    for pos in range(len(totals_minor)):
+        for g in assignments.get(pos, ()):
+            if g not in groups:
+                groups.append(g)
+    if not groups:
+        return []
+
+    col = {g: j for j, g in enumerate(groups)}
+    assign = np.zeros((len(totals_minor), len(groups)), dtype=bool)
+    for pos in range(len(totals_minor)):
+        for g in assignments.get(pos, ()):
+            assign[pos, col[g]] = True
+
+    w = np.array([weights.get(g, 1.0) for g in groups], dtype=np.float64) if weights else None
+    c = group_caps(caps, groups)
+    totals = np.asarray(totals_minor, dtype=np.float64) / minor_units
+    result = split_matrix(totals, assign, w, c, minor_units)
+    counts = assign.sum(axis=0)
+    return [(g, int(result.shares[j]), int(counts[j])) for j, g in enumerate(groups)]
+
+
+class ReceiptHistory:
+    """
+    Хранилище чеков: позиции, доли групп и сводки, обновляемые при вставке.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, minor_units: int = None):
+        if minor_units is None:
+            from split_engine import MINOR_UNITS
+            minor_units = MINOR_UNITS
+        self.path = path
+        self.minor_units = minor_units
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # После fork соединение родителя использовать нельзя — открываем своё
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    # ---------- запись ----------
+
+    def save_receipt(self, key: str, items, assignments=None, ocr_lang: str = None,
+                     src_lang: str = None, created: float = None, weights=None, caps=None) -> int:
+        """
+        Сохранить чек. items — словари с item, total, category (+ item_en, qty, price),
+        например df.to_dict("records") или items из pipeline.process_receipt.
+        assignments — {позиция: [группы]}; weights/caps — как в split_bill.
+        Чек с тем же key заменяется: его вклад сначала вычитается из сводок.
+        Возвращает id чека.
+        """
+        items = list(items)
+        assignments = assignments or {}
+        totals = [_minor(it.get("total"), self.minor_units) for it in items]
+        shares = _shares(totals, assignments, weights, caps, self.minor_units)
+
+        rows = []
+        for pos, (it, total) in enumerate(zip(items, totals)):
+            rows.append((
+                pos,
+                str(it.get("item") or ""),
+                it.get("item_en"),
+                str(it.get("category") or OTHER),
+                _number(it.get("qty")),
+                _number(it.get("price")),
+                total,
+                ",".join(assignments.get(pos, ())),
+            ))
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                old = conn.execute("SELECT id, created FROM receipts WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._remove_locked(conn, *old)
+                    created = old[1] if created is None else created
+                created = time.time() if created is None else created
+
+                receipt_id = conn.execute(
+                    "INSERT INTO receipts (key, created, ocr_lang, src_lang, n_items, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, created, ocr_lang, src_lang, len(rows), sum(totals)),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO receipt_items "
+                    "(receipt_id, pos, item, item_en, category, qty, price, total, groups) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(receipt_id, *row) for row in rows],
+                )
+                conn.executemany(
+                    "INSERT INTO receipt_shares (receipt_id, grp, amount, n_items) VALUES (?, ?, ?, ?)",
+                    [(receipt_id, *share) for share in shares],
+                )
+                conn.executemany(
+                    _UPSERT, _deltas(created, [(row[3], row[6]) for row in rows], shares)
+                )
+        return receipt_id
+
+    def delete_receipt(self, key: str) -> bool:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                old = conn.execute("SELECT id, created FROM receipts WHERE key = ?", (key,)).fetchone()
+                if old is None:
+                    return False
+                self._remove_locked(conn, *old)
+        return True
+
+    def _remove_locked(self, conn: sqlite3.Connection, receipt_id: int, created: float) -> None:
+        items = conn.execute(
+            "SELECT category, total FROM receipt_items WHERE receipt_id = ?", (receipt_id,)
+        ).fetchall()
+        shares = conn.execute(
+            "SELECT grp, amount, n_items FROM receipt_shares WHERE receipt_id = ?", (receipt_id,)
+        ).fetchall()
+        deltas = _deltas(created, items, shares, sign=-1)
+        conn.executemany(_UPSERT, deltas)
+        # Опустевшие корзины не храним
+        conn.executemany(
+            "DELETE FROM aggregates WHERE dim = ? AND period = ? AND bucket = ? AND key = ? AND count <= 0",
+            [d[:4] for d in deltas],
+        )
+        conn.execute("DELETE FROM receipt_items WHERE receipt_id = ?", (receipt_id,))
+        conn.execute("DELETE FROM receipt_shares WHERE receipt_id = ?", (receipt_id,))
+        conn.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
+
+    def rebuild_aggregates(self) -> None:
+        """
+        Пересчитать сводки с нуля по сохранённым позициям (после ручной правки базы).
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM aggregates")
+                for period, fmt in PERIODS.items():
+                    bucket = "strftime(?, r.created, 'unixepoch', 'localtime')" if fmt else "?"
+                    arg = (period, fmt or "")
+                    conn.execute(
+                        f"INSERT INTO aggregates SELECT 'category', ?, {bucket}, i.category, SUM(i.total), COUNT(*) "
+                        "FROM receipt_items i JOIN receipts r ON r.id = i.receipt_id GROUP BY 3, 4",
+                        arg,
+                    )
+                    conn.execute(
+                        f"INSERT INTO aggregates SELECT 'group', ?, {bucket}, s.grp, SUM(s.amount), SUM(s.n_items) "
+                        "FROM receipt_shares s JOIN receipts r ON r.id = s.receipt_id GROUP BY 3, 4",
+                        arg,
+                    )
+                    conn.execute(
+                        f"INSERT INTO aggregates SELECT 'receipts', ?, {bucket}, '', SUM(r.total), COUNT(*) "
+                        "FROM receipts r GROUP BY 3",
+                        arg,
+                    )
+
+    # ---------- чтение ----------
+
+    def _where(self, dim: str, period: str, start: str, end: str):
+        if dim not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension {dim!r}, expected one of {DIMENSIONS}")
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period {period!r}, expected one of {tuple(PERIODS)}")
+        sql, args = "dim = ? AND period = ?", [dim, period]
+        if start is not None:
+            sql += " AND bucket >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND bucket <= ?"
+            args.append(end)
+        return sql, args
+
+    def totals(self, dim: str = "category", period: str = "all", start: str = None, end: str = None) -> list:
+        """
+        Суммы по ключам измерения dim за корзины периода в [start, end]
+        (например, period="month", start="2026-01"): [{"key", "total", "count"}],
+        по убыванию суммы.
+        """
+        where, args = self._where(dim, period, start, end)
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                f"SELECT key, SUM(total), SUM(count) FROM aggregates WHERE {where} "
+                "GROUP BY key ORDER BY 2 DESC",
+                args,
+            ).fetchall()
+        return [{"key": k, "total": t / self.minor_units, "count": c} for k, t, c in rows]
+
+    def timeline(self, dim: str = "receipts", period: str = "month", start: str = None,
+                 end: str = None) -> list:
+        """
+        Ряд по корзинам: [{"bucket", "key", "total", "count"}] по возрастанию корзины.
+        """
+        where, args = self._where(dim, period, start, end)
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                f"SELECT bucket, key, total, count FROM aggregates WHERE {where} ORDER BY bucket, key",
+                args,
+            ).fetchall()
+        return [{"bucket": b, "key": k, "total": t / self.minor_units, "count": c} for b, k, t, c in rows]
+
+    def recent(self, limit: int = 20) -> list:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT key, created, ocr_lang, src_lang, n_items, total FROM receipts "
+                "ORDER BY created DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"key": k, "created": c, "ocr_lang": o, "src_lang": s, "n_items": n, "total": t / self.minor_units}
+            for k, c, o, s, n, t in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            receipts, items, aggregates = conn.execute(
+                "SELECT (SELECT COUNT(*) FROM receipts), (SELECT COUNT(*) FROM receipt_items), "
+                "(SELECT COUNT(*) FROM aggregates)"
+            ).fetchone()
+        return {"path": self.path, "receipts": receipts, "items": items, "aggregates": aggregates}
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for table in ("receipts", "receipt_items", "receipt_shares", "aggregates"):
+                    conn.execute(f"DELETE FROM {table}")
+
+
+@lru_cache(maxsize=1)
+def get_receipt_history():
+    """
+    Общая на процесс история чеков (или None, если SABAI_HISTORY=0).
+    """
+    if not HISTORY_ENABLED:
+        return None
+    return ReceiptHistory()
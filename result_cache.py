@@ -0,0 +1,168 @@
+# result_cache.py
+
+"""
+Ограниченный кэш результатов для слоя Streamlit (OCR-строки, переводы).
+
+В отличие от st.cache_data без лимитов:
+  - общий бюджет в байтах, размер каждой записи считается при вставке;
+  - TTL — устаревшие записи не отдаются и вычищаются;
+  - LRU-вытеснение при переполнении, статистика попаданий и вытеснений;
+  - ключ — короткий хэш (digest), а не сами байты картинки;
+  - значения компактные: кортежи строк, а не DataFrame.
+"""
+
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("SABAI_UI_CACHE_MB", "64")) * 1024 * 1024
+RESULT_CACHE_TTL_S = float(os.environ.get("SABAI_UI_CACHE_TTL_S", "3600"))
+
+MISSING = object()
+
+
+def digest(*parts) -> str:
+    """
+    Короткий ключ из байтов/строк/последовательностей строк.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        elif isinstance(part, (list, tuple)):
+            for item in part:
+                h.update(str(item).encode("utf-8"))
+                h.update(b"\0")
+        else:
+            h.update(str(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def sizeof(value) -> int:
+    """
+    Примерный размер значения в памяти: sys.getsizeof с обходом контейнеров.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(sizeof(v) for v in value)
+    nbytes = getattr(value, "nbytes", None)  # numpy
+    return size + (nbytes if isinstance(nbytes, int) else 0)
+
+
+class BoundedCache:
+    """
+    LRU с бюджетом по байтам и TTL. Потокобезопасный.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL_S):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at <= now:
+                self._drop(key, size)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> bool:
+        """
+        Сохраняет значение; False — если оно одно больше всего бюджета.
+        """
+        size = sizeof(key) + sizeof(value)
+        if size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size, now + self.ttl)
+            self.bytes += size
+            self._expire(now)
+            while self.bytes > self.max_bytes and self._data:
+                old_key, (_v, old_size, _e) = next(iter(self._data.items()))
+                self._drop(old_key, old_size)
+                self.evictions += 1
+        return True
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _drop(self, key, size) -> None:
+        del self._data[key]
+        self.bytes -= size
+
+    def _expire(self, now) -> None:
+        # Записи идут в порядке последнего использования, но TTL считается от вставки —
+        # проходим все; их немного (бюджет ограничен)
+        expired = [k for k, (_v, _s, exp) in self._data.items() if exp <= now]
+        for key in expired:
+            self._drop(key, self._data[key][1])
+        self.expirations += len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejected": self.rejected,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_result_cache() -> BoundedCache:
+    """
+    Общий кэш процесса (одного сервера Streamlit на все сессии).
+    """
+    return BoundedCache()
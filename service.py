@@ -0,0 +1,390 @@
+# service.py
+
+"""
+Локальный HTTP-сервис на asyncio (только стандартная библиотека).
+
+    python service.py --port 8765
+
+Эндпоинты:
+    GET  /health                         — состояние, очереди, прогрев, бюджет потоков
+    GET  /metrics                        — метрики стадий в формате Prometheus (SABAI_METRICS=1)
+    POST /receipt?ocr_lang=th&target=ru  — тело: картинка; OCR → parse → перевод → категории
+    POST /translate                      — {"texts": [...], "src": "th", "tgt": "en"}
+    POST /split                          — {"items": [{"total": 40.0}, ...],
+                                            "assignments": {"0": ["A", "B"]},
+                                            "weights": {...}, "caps": {...}}
+
+Переводы от всех одновременных клиентов собираются в общие микробатчи
+для NLLB. Очереди ограничены: при перегрузке сервис отвечает 429.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+HTTP_HOST = os.environ.get("SABAI_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.environ.get("SABAI_HTTP_PORT", "8765"))
+
+# Микробатчинг перевода: сколько строк максимум и сколько ждём попутчиков
+BATCH_MAX_ITEMS = int(os.environ.get("SABAI_BATCH_MAX_ITEMS", "32"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("SABAI_BATCH_MAX_WAIT_MS", "10"))
+
+# Границы очередей: запросов на перевод в ожидании и одновременных OCR
+TRANSLATE_QUEUE_MAX = int(os.environ.get("SABAI_TRANSLATE_QUEUE_MAX", "256"))
+OCR_INFLIGHT_MAX = int(os.environ.get("SABAI_OCR_INFLIGHT_MAX", "4"))
+
+MAX_BODY_BYTES = int(os.environ.get("SABAI_MAX_BODY_MB", "25")) * 1024 * 1024
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class Overloaded(Exception):
+    """Очередь заполнена — клиенту 429."""
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class TranslationBatcher:
+    """
+    Собирает запросы на перевод от разных клиентов в общие батчи.
+    Модель вызывается в одном потоке — NLLB всё равно не параллелится на CPU.
+    """
+
+    def __init__(self, max_items: int = BATCH_MAX_ITEMS, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 queue_max: int = TRANSLATE_QUEUE_MAX):
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=queue_max)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nllb")
+        self.batches = 0
+        self.items = 0
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def translate(self, texts, src_lang: str, tgt_lang: str) -> list:
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((list(texts), src_lang, tgt_lang, fut))
+        except asyncio.QueueFull:
+            raise Overloaded("translation queue is full")
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self.queue.get()
+            batch = [first]
+            count = len(first[0])
+            deadline = loop.time() + self.max_wait
+
+            # Добираем попутчиков, пока не истекло окно или не набрали батч
+            while count < self.max_items:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    req = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(req)
+                count += len(req[0])
+
+            # Один вызов модели на пару языков, повторы внутри батча — один раз
+            by_pair = {}
+            for req in batch:
+                by_pair.setdefault((req[1], req[2]), []).append(req)
+
+            for (src, tgt), reqs in by_pair.items():
+                unique = list(dict.fromkeys(t for req in reqs for t in req[0]))
+                try:
+                    out = await loop.run_in_executor(self.executor, _translate, unique, src, tgt)
+                except Exception as e:
+                    for req in reqs:
+                        if not req[3].done():
+                            req[3].set_exception(e)
+                    continue
+                mapping = dict(zip(unique, out))
+                for req in reqs:
+                    if not req[3].done():
+                        req[3].set_result([mapping[t] for t in req[0]])
+
+            self.batches += 1
+            self.items += count
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_max": self.queue.maxsize,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": (self.items / self.batches) if self.batches else 0.0,
+        }
+
+
+def _translate(texts, src_lang, tgt_lang):
+    from translator import translate_batch
+    return translate_batch(texts, src_lang, tgt_lang)
+
+
+def _ocr(image_bytes: bytes, ocr_lang: str):
+    from ocr_module import extract_text_cached
+    from ocr_pool import get_ocr_pool
+
+    pool = get_ocr_pool()
+    return extract_text_cached(
+        image_bytes, ocr_lang=ocr_lang, extract=pool.extract if pool is not None else None
+    )
+
+
+def _detect(lines, ocr_lang: str):
+    from translator import detect_lang_code
+    return detect_lang_code("\n".join(lines), ocr_lang)
+
+
+class ReceiptService:
+    def __init__(self):
+        self.batcher = TranslationBatcher()
+        self.ocr_inflight = 0
+        self.executor = ThreadPoolExecutor(max_workers=OCR_INFLIGHT_MAX + 2, thread_name_prefix="ocr")
+        self.rejected = 0
+
+    def start(self) -> None:
+        self.batcher.start()
+
+    # ---------- обработчики ----------
+
+    async def health(self, query, body):
+        from warmup import warmup_status
+        from thread_budget import get_thread_budget
+        return {
+            "ok": True,
+            "translate": self.batcher.stats(),
+            "ocr_inflight": self.ocr_inflight,
+            "ocr_inflight_max": OCR_INFLIGHT_MAX,
+            "rejected": self.rejected,
+            "warmup": warmup_status(),
+            "threads": get_thread_budget().allocation(),
+        }
+
+    async def prometheus(self, query, body):
+        return metrics.prometheus_text()
+
+    async def receipt(self, query, body):
+        with metrics.receipt_trace(query.get("id")):
+            return await self._receipt(query, body)
+
+    async def _receipt(self, query, body):
+        from parser import parse_receipt
+        from category_module import categorize_many
+        from pipeline import normalize_lines
+
+        if not body:
+            raise HTTPError(400, "empty body: expected image bytes")
+        ocr_lang = query.get("ocr_lang", "ru")
+        target = query.get("target")
+
+        if self.ocr_inflight >= OCR_INFLIGHT_MAX:
+            raise Overloaded("OCR is at capacity")
+        loop = asyncio.get_running_loop()
+        self.ocr_inflight += 1
+        try:
+            lines = await loop.run_in_executor(self.executor, metrics.bind(_ocr), body, ocr_lang)
+        finally:
+            self.ocr_inflight -= 1
+
+        lines = normalize_lines(lines)
+        src_lang = await loop.run_in_executor(self.executor, metrics.bind(_detect), lines, ocr_lang)
+        items = parse_receipt(lines, as_frame=False)
+        metrics.count("ocr_lines", len(lines))
+        metrics.count("items", len(items))
+        names = [it.item for it in items]
+
+        translated = [[], []]
+        if names:
+            jobs = [self.batcher.translate(names, src_lang, "en")]
+            if target:
+                jobs.append(self.batcher.translate(names, src_lang, target))
+            translated = await asyncio.gather(*jobs)
+
+        categories = list(categorize_many(translated[0]))
+        out = []
+        for i, it in enumerate(items):
+            row = it._asdict()
+            row["item_en"] = translated[0][i]
+            row["category"] = categories[i]
+            if target:
+                row["item_translated"] = translated[1][i]
+            out.append(row)
+        return {"ocr_lang": ocr_lang, "src_lang": src_lang, "lines": lines, "items": out}
+
+    async def translate(self, query, body):
+        data = _json(body)
+        texts = data.get("texts")
+        if not isinstance(texts, list):
+            raise HTTPError(400, "'texts' must be a list of strings")
+        src = data.get("src", "en")
+        tgt = data.get("tgt", "en")
+        return {"translations": await self.batcher.translate([str(t) for t in texts], src, tgt)}
+
+    async def split(self, query, body):
+        import pandas as pd
+        from split_engine import split_bill
+
+        data = _json(body)
+        items = data.get("items")
+        if not isinstance(items, list):
+            raise HTTPError(400, "'items' must be a list of {total: ...}")
+        for field in ("assignments", "weights", "caps"):
+            if not isinstance(data.get(field) or {}, dict):
+                raise HTTPError(400, f"'{field}' must be an object {{group: ...}}")
+        try:
+            df = pd.DataFrame({"total": [float(it["total"]) for it in items]})
+            assignments = {}
+            for k, v in (data.get("assignments") or {}).items():
+                if not isinstance(v, list):
+                    raise TypeError(f"assignments[{k!r}] must be a list of groups")
+                assignments[int(k)] = v
+            totals = split_bill(df, assignments, weights=data.get("weights"), caps=data.get("caps"))
+        except (KeyError, TypeError, ValueError) as e:
+            # Нечисловые, отрицательные, null-веса и лимиты (split_matrix/group_caps
+            # отвечают ValueError) — тоже ошибка клиента
+            raise HTTPError(400, f"bad split payload: {e}")
+        return {"totals": totals}
+
+    # ---------- HTTP ----------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, payload = await self._dispatch(reader)
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        if isinstance(payload, str):
+            # Текстовые ответы (Prometheus)
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            + ("Retry-After: 1\r\n" if status == 429 else "")
+            + "Connection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, reader):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            method, target, _version = request_line.split(" ", 2)
+        except ValueError:
+            return 400, {"error": "malformed request line"}
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        raw_length = headers.get("content-length")
+        if raw_length is None:
+            if method == "POST":
+                return 411, {"error": "Content-Length required"}
+            raw_length = "0"
+        if not raw_length.isdigit():
+            return 400, {"error": f"bad Content-Length: {raw_length!r}"}
+        length = int(raw_length)
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": f"body larger than {MAX_BODY_BYTES} bytes"}
+        try:
+            body = await reader.readexactly(length) if length else b""
+        except asyncio.IncompleteReadError:
+            return 400, {"error": "body shorter than Content-Length"}
+
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.prometheus,
+            ("POST", "/receipt"): self.receipt,
+            ("POST", "/translate"): self.translate,
+            ("POST", "/split"): self.split,
+        }
+        handler = routes.get((method, url.path))
+        if handler is None:
+            known = {path for _m, path in routes}
+            return (405 if url.path in known else 404), {"error": f"{method} {url.path}"}
+
+        try:
+            return 200, await handler(query, body)
+        except Overloaded as e:
+            self.rejected += 1
+            return 429, {"error": str(e)}
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+
+
+def _reject_constant(name: str):
+    # json по умолчанию пропускает NaN/Infinity — в стандартном JSON их нет
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def _json(body: bytes) -> dict:
+    try:
+        data = json.loads(body or b"{}", parse_constant=_reject_constant)
+    except ValueError as e:
+        raise HTTPError(400, f"invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "expected a JSON object")
+    return data
+
+
+async def serve(host: str = HTTP_HOST, port: int = HTTP_PORT) -> None:
+    from warmup import start_warmup
+
+    service = ReceiptService()
+    service.start()
+    start_warmup()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"SabAI Bill service on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="SabAI Bill: локальный HTTP-сервис")
+    ap.add_argument("--host", default=HTTP_HOST)
+    ap.add_argument("--port", type=int, default=HTTP_PORT)
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,172 @@
 # split_engine.py
 
-def split_bill(df, assignments):
-    groups = {}
-    for idx, row in df.iterrows():
-        item_total = row["total"]
-        assigned_groups = assignments.get(idx, [])
-        
-        if not assigned_groups: # Если никто не выбран, пропускаем позицию
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+
+# Сколько минимальных единиц в одной денежной (сатанги, копейки, центы)
+MINOR_UNITS = 100
+
+# shares — сколько платит каждая группа (в минимальных единицах),
+# unassigned — позиции, которые никто не взял, over_cap — то, что не влезло в лимиты
+SplitResult = namedtuple("SplitResult", ["shares", "unassigned", "over_cap"])
+
+
+def _largest_remainder(amounts, weights):
+    """
+    Делит целые amounts[i] между столбцами weights[i] пропорционально весам.
+    Сначала всем — целая часть доли, остаток раздаём по одной единице тем,
+    у кого дробная часть больше (при равенстве — группе с меньшим индексом).
+    Сумма по строке всегда равна amounts[i].
+    """
+    amounts = np.asarray(amounts, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    wsum = weights.sum(axis=1, keepdims=True)
+    safe = np.where(wsum > 0, wsum, 1.0)
+
+    exact = amounts[:, None] * (weights / safe)
+    base = np.floor(exact).astype(np.int64)
+    remainder = amounts - base.sum(axis=1)
+
+    frac = np.where(weights > 0, exact - base, -1.0)
+    order = np.argsort(-frac, axis=1, kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(order.shape[1])[None, :], axis=1)
+    base += rank < remainder[:, None]
+
+    # Строки без весов ничего не получают
+    return np.where(wsum > 0, base, 0)
+
+
+def _apply_caps(shares, caps_minor):
+    """
+    Срезает превышение лимитов и раздаёт его группам, у которых ещё есть
+    запас, пропорционально их текущей доле. Возвращает (shares, неразмещённое).
+    """
+    shares = shares.copy()
+    for _ in range(len(shares) + 1):
+        over = np.maximum(shares - caps_minor, 0)
+        excess = int(over.sum())
+        if excess == 0:
+            return shares, 0
+        shares -= over
+
+        room = caps_minor - shares
+        open_ = room > 0
+        if not open_.any():
+            return shares, excess
+
+        basis = np.where(open_, np.maximum(shares, 0), 0).astype(np.float64)
+        if basis.sum() == 0:
+            basis = open_.astype(np.float64)
+        shares += _largest_remainder([excess], basis[None, :])[0]
+
+    over = np.maximum(shares - caps_minor, 0)
+    return shares - over, int(over.sum())
+
+
+def split_matrix(totals, assign, weights=None, caps=None, minor_units: int = MINOR_UNITS) -> SplitResult:
+    """
+    Векторный расчёт долей.
+    :param totals: суммы позиций (n_items,)
+    :param assign: bool-матрица (n_items, n_groups) — кто участвует в позиции
+    :param weights: веса групп (n_groups,) или (n_items, n_groups), по умолчанию поровну
+    :param caps: лимит на группу в денежных единицах (n_groups,), >= 0; inf — без лимита
+    :return: SplitResult, всё в минимальных единицах (int64);
+             shares.sum() + unassigned + over_cap == сумме чека в минимальных единицах
+    :raises ValueError: форма assign не та; суммы не конечны; веса отрицательны,
+             не конечны или их сумма переполняется; лимиты отрицательны или nan
+    """
+    totals = np.asarray(totals, dtype=np.float64)
+    if not np.isfinite(totals).all():
+        raise ValueError("totals must be finite")
+    totals_minor = np.rint(totals * minor_units).astype(np.int64)
+    assign = np.asarray(assign, dtype=bool)
+    if assign.ndim != 2 or assign.shape[0] != totals_minor.shape[0]:
+        raise ValueError(
+            f"assign must be (n_items, n_groups), got {assign.shape} for {totals_minor.shape[0]} items"
+        )
+
+    if weights is None:
+        w = assign.astype(np.float64)
+    else:
+        w = np.broadcast_to(np.asarray(weights, dtype=np.float64), assign.shape)
+        if not np.isfinite(w).all():
+            raise ValueError("weights must be finite")
+        if (w < 0).any():
+            raise ValueError("weights must be non-negative")
+        w = np.where(assign, w, 0.0)
+        with np.errstate(over="ignore"):
+            if not np.isfinite(w.sum(axis=1)).all():
+                raise ValueError("weights are too large: their sum overflows")
+        # Выбраны, но все веса нулевые — делим поровну
+        w = np.where((w.sum(axis=1) == 0)[:, None], assign, w)
+
+    taken = assign.any(axis=1)
+    unassigned = int(totals_minor[~taken].sum())
+
+    shares = _largest_remainder(np.where(taken, totals_minor, 0), w).sum(axis=0)
+
+    over_cap = 0
+    if caps is not None:
+        caps = np.asarray(caps, dtype=np.float64)
+        if np.isnan(caps).any() or (caps < 0).any():
+            raise ValueError("caps must be non-negative numbers (inf — no cap)")
+        caps_minor = np.where(
+            np.isfinite(caps), np.rint(caps * minor_units), np.iinfo(np.int64).max // 2
+        ).astype(np.int64)
+        shares, over_cap = _apply_caps(shares, caps_minor)
+
+    return SplitResult(shares, unassigned, over_cap)
+
+
+def group_caps(caps, groups):
+    """
+    Лимиты из словаря {группа: сумма} в вектор по groups (None, если лимитов нет).
+    Заданный лимит — конечное неотрицательное число; группы без лимита — inf.
+    """
+    if not caps:
+        return None
+    for g in groups:
+        if g not in caps:
             continue
+        try:
+            value = float(caps[g])
+        except (TypeError, ValueError):
+            value = np.nan
+        if not (np.isfinite(value) and value >= 0):
+            raise ValueError(f"cap for group {g!r} must be a finite non-negative number, got {caps[g]!r}")
+    return np.array([caps.get(g, np.inf) for g in groups], dtype=np.float64)
+
+
+@metrics.traced("split_bill")
+def split_bill(df, assignments, weights=None, caps=None, minor_units: int = MINOR_UNITS):
+    """
+    Совместимый интерфейс: assignments — {индекс строки df: [группы]}.
+    weights/caps — словари {группа: значение}; группа без лимита — просто не в caps.
+    Возвращает {группа: сумма} только для групп, у которых есть позиции;
+    сумма долей сходится с суммой выбранных позиций до копейки.
+    """
+    groups = []
+    for idx in df.index:
+        for g in assignments.get(idx, []):
+            if g not in groups:
+                groups.append(g)
+    if not groups:
+        return {}
+
+    col = {g: j for j, g in enumerate(groups)}
+    assign = np.zeros((len(df), len(groups)), dtype=bool)
+    for i, idx in enumerate(df.index):
+        for g in assignments.get(idx, []):
+            assign[i, col[g]] = True
+
+    w = None
+    if weights:
+        w = np.array([weights.get(g, 1.0) for g in groups], dtype=np.float64)
+    c = group_caps(caps, groups)
 
-        share = item_total / len(assigned_groups)
-        for g in assigned_groups:
-            groups[g] = groups.get(g, 0) + share
-    return groups
\ No newline at end of file
+    result = split_matrix(df["total"].to_numpy(dtype=np.float64), assign, w, c, minor_units)
+    return {g: int(result.shares[j]) / minor_units for j, g in enumerate(groups)}
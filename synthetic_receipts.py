@@ -0,0 +1,114 @@
+# synthetic_receipts.py
+
+"""
+Детерминированный генератор синтетических чеков для бенчмарков.
+
+Строки OCR в тех раскладках, которые понимает parser.py:
+  - "7eleven_th": цена отдельной строкой, название — следующей (7-Eleven TH);
+  - "ru":         'Название  x2  89,90' с запятой в цене, служебные строки по-русски;
+  - "latin":      'x2 Coffee 3.50' / 'Bread 2.10', VAT/TOTAL внизу.
+И картинки чеков разных размеров (JPEG/PNG байты).
+"""
+
+import io
+import random
+
+LAYOUTS = ("7eleven_th", "ru", "latin")
+
+_TH_ITEMS = [
+    "น้ำดื่ม", "กาแฟเย็น", "ชาเขียว", "ไก่ทอด", "ขนมปัง", "นมสด", "เบียร์ช้าง",
+    "สบู่", "ยาสีฟัน", "ข้าวผัดกุ้ง", "บะหมี่กึ่งสำเร็จรูป", "โค้ก", "มันฝรั่งทอด",
+]
+_RU_ITEMS = [
+    "Молоко 3,2%", "Хлеб белый", "Куриное филе", "Вода питьевая", "Кофе растворимый",
+    "Чай чёрный", "Сок яблочный", "Мыло детское", "Зубная паста", "Сыр российский",
+]
+_LATIN_ITEMS = [
+    "Coffee", "Green tea", "Chicken rice", "Beef noodle soup", "Water", "Orange juice",
+    "Shampoo", "Toothpaste", "Tissue", "Beer", "Shrimp fried rice", "Service charge",
+]
+
+
+def _price(rng: random.Random) -> float:
+    # 3..149 — в пределах фильтров парсера
+    return round(rng.uniform(3, 149), 2)
+
+
+def receipt_lines(n_items: int, layout: str = "7eleven_th", seed: int = 0) -> list:
+    """
+    Список строк OCR примерно с n_items позициями.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown layout {layout!r}, expected one of {LAYOUTS}")
+    rng = random.Random(f"{layout}:{n_items}:{seed}")
+    total = 0.0
+
+    if layout == "7eleven_th":
+        lines = ["7-Eleven", "CP ALL PUBLIC COMPANY", "TAX#0107542000011 (VAT Included)",
+                 "POS#E123456 R#0001234", "Tel 0-2826-7744"]
+        for _ in range(n_items):
+            p = _price(rng)
+            total += p
+            lines.append(f"{p:.2f}")
+            lines.append(rng.choice(_TH_ITEMS))
+        lines += [f"รวม {total:.2f}", f"เงินทอน {rng.randint(0, 99):.2f}", "23/11/68 14:05"]
+        return lines
+
+    if layout == "ru":
+        lines = ["ООО \"Продукты\"", "ИНН 7701234567", "Кассовый чек", "Кассир Иванова"]
+        for _ in range(n_items):
+            p = _price(rng)
+            qty = rng.choice([1, 1, 1, 2, 3])
+            total += p * qty
+            name = rng.choice(_RU_ITEMS)
+            prefix = f"x{qty} " if qty > 1 else ""
+            lines.append(f"{prefix}{name}  {p:.2f}".replace(".", ","))
+        lines += [f"ИТОГ {total:.2f}".replace(".", ","), "Налог НДС 20%", "12/03/2024 10:15"]
+        return lines
+
+    lines = ["CORNER CAFE", "123 Main Street", "Tel 555-0199"]
+    for _ in range(n_items):
+        p = _price(rng)
+        qty = rng.choice([1, 1, 2])
+        total += p * qty
+        prefix = f"x{qty} " if qty > 1 else ""
+        lines.append(f"{prefix}{rng.choice(_LATIN_ITEMS)} {p:.2f}")
+    lines += [f"VAT 7% {total * 0.07:.2f}", f"TOTAL {total:.2f}", "03/12/2024"]
+    return lines
+
+
+def corpus(n_receipts: int, n_items: int = 20, seed: int = 0) -> list:
+    """
+    Набор чеков вперемешку по раскладкам: [(layout, lines), ...].
+    """
+    return [
+        (LAYOUTS[i % len(LAYOUTS)], receipt_lines(n_items, LAYOUTS[i % len(LAYOUTS)], seed + i))
+        for i in range(n_receipts)
+    ]
+
+
+def receipt_image(width: int, height: int, n_items: int = 30, seed: int = 0,
+                  fmt: str = "JPEG", quality: int = 90) -> bytes:
+    """
+    Картинка «чека» заданного размера: латинские строки на светлом фоне
+    с лёгким шумом (чтобы JPEG не был вырожденно маленьким).
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    nrng = np.random.default_rng(seed)
+    noise = nrng.normal(235, 8, size=(height, width)).clip(0, 255).astype("uint8")
+    img = Image.fromarray(noise, mode="L").convert("RGB")
+    draw = ImageDraw.Draw(img)
+
+    lines = receipt_lines(n_items, "latin", seed)
+    step = max(12, height // (len(lines) + 2))
+    for k, line in enumerate(lines):
+        draw.text((width // 20, step * (k + 1)), line, fill=(20, 20, 20))
+
+    buf = io.BytesIO()
+    if fmt.upper() == "JPEG":
+        img.save(buf, "JPEG", quality=quality)
+    else:
+        img.save(buf, fmt)
+    return buf.getvalue()
@@ -0,0 +1,21 @@
+# test_benchmark.py
+
+import json
+
+import benchmark
+import ocr_module
+import translator
+
+
+def test_benchmark_runs_offline_with_stubs(tmp_path, capsys):
+    get_ocr, generate = ocr_module.get_ocr, translator._generate
+    out = tmp_path / "bench.json"
+
+    assert benchmark.main(["--repeat", "1", "--only", "image,translate", "--out", str(out)]) == 0
+
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert report["meta"]["stub_models"] is True
+    assert {"extract_text/stub", "translate_batch/th-en"} <= set(report["stages"])
+    assert "extract_text/stub" in capsys.readouterr().out
+    # Заглушки снимаются после прогона
+    assert ocr_module.get_ocr is get_ocr and translator._generate is generate
@@ -0,0 +1,85 @@
+# test_receipt_history.py
+
+import pandas as pd
+import pytest
+
+from category_module import OTHER
+from receipt_history import ReceiptHistory
+from split_engine import split_bill
+
+# 2026-01-15 00:00 UTC; дни и месяцы ниже — смещения от неё
+T0 = 1768435200.0
+DAY = 86400.0
+
+
+def _aggregates(history: ReceiptHistory) -> list:
+    return sorted(history._connect().execute("SELECT * FROM aggregates").fetchall())
+
+
+def _assert_matches_rebuild(history: ReceiptHistory) -> None:
+    incremental = _aggregates(history)
+    history.rebuild_aggregates()
+    assert incremental == _aggregates(history)
+
+
+@pytest.fixture
+def history():
+    return ReceiptHistory(":memory:")
+
+
+def test_resave_replaces_contribution(history):
+    history.save_receipt("r1", [
+        {"item": "rice", "total": 40.0, "category": "Food"},
+        {"item": "tea", "total": 15.5, "category": "Drinks"},
+    ], {0: ["A"], 1: ["A", "B"]}, created=T0)
+    history.save_receipt("r2", [{"item": "soap", "total": 9.9, "category": "Household"}],
+                         {0: ["B"]}, created=T0 + DAY)
+    # Тот же чек заново: другие позиции, группы и лимит — старый вклад должен уйти целиком
+    history.save_receipt("r1", [
+        {"item": "beer", "total": 60.0, "category": "Drinks"},
+        {"item": "tip", "total": 5.0, "category": "Service & Fees"},
+    ], {0: ["A", "C"], 1: ["C"]}, caps={"A": 20.0})
+
+    _assert_matches_rebuild(history)
+    categories = {row["key"]: row["total"] for row in history.totals("category")}
+    assert categories == {"Drinks": 60.0, "Household": 9.9, "Service & Fees": 5.0}
+
+
+def test_delete_drops_emptied_buckets(history):
+    history.save_receipt("jan", [{"item": "rice", "total": 10.0, "category": "Food"}],
+                         {0: ["A"]}, created=T0)
+    history.save_receipt("feb", [{"item": "rice", "total": 7.0, "category": "Food"}],
+                         {0: ["A", "B"]}, created=T0 + 31 * DAY)
+    assert history.delete_receipt("feb")
+    assert not history.delete_receipt("feb")
+
+    _assert_matches_rebuild(history)
+    assert [row["key"] for row in history.totals("group")] == ["A"]
+    assert history.totals("receipts", period="month", start="2026-02") == []
+
+
+def test_other_category_path(history):
+    # Без категории и с явным OTHER — одна корзина
+    history.save_receipt("r1", [{"item": "x", "total": 1.0}], created=T0)
+    history.save_receipt("r2", [{"item": "y", "total": 2.0, "category": OTHER}], created=T0)
+    assert history.totals("category") == [{"key": OTHER, "total": 3.0, "count": 2}]
+    _assert_matches_rebuild(history)
+
+    # Категорию уточнили — из OTHER вклад уходит
+    history.save_receipt("r1", [{"item": "x", "total": 1.0, "category": "Food"}])
+    _assert_matches_rebuild(history)
+    assert {row["key"]: row["count"] for row in history.totals("category")} == {OTHER: 1, "Food": 1}
+
+
+def test_group_totals_match_split_bill(history):
+    items = [
+        {"item": "hot pot", "total": 333.33, "category": "Food"},
+        {"item": "cola", "total": 45.0, "category": "Drinks"},
+        {"item": "service", "total": 37.83, "category": "Service & Fees"},
+    ]
+    assignments = {0: ["A", "B", "C"], 1: ["B"], 2: ["A", "C"]}
+    weights, caps = {"A": 2.0, "B": 1.0, "C": 1.0}, {"C": 50.0}
+    history.save_receipt("r", items, assignments, created=T0, weights=weights, caps=caps)
+
+    expected = split_bill(pd.DataFrame(items), assignments, weights, caps)
+    assert {row["key"]: row["total"] for row in history.totals("group")} == pytest.approx(expected)
@@ -0,0 +1,113 @@
+# test_split_engine.py
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from split_engine import MINOR_UNITS, split_bill, split_matrix
+
+
+def _random_case(rng: random.Random):
+    n_items = rng.randint(1, 40)
+    n_groups = rng.randint(1, 6)
+    totals = [round(rng.uniform(0, 500), 2) for _ in range(n_items)]
+    assign = np.array(
+        [[rng.random() < 0.4 for _ in range(n_groups)] for _ in range(n_items)], dtype=bool
+    )
+    weights = None
+    if rng.random() < 0.5:
+        weights = [rng.choice([0.0, 0.5, 1.0, 2.0, 3.0]) for _ in range(n_groups)]
+    caps = None
+    if rng.random() < 0.5:
+        caps = [rng.choice([np.inf, 0.0, round(rng.uniform(0, 800), 2)]) for _ in range(n_groups)]
+    return totals, assign, weights, caps
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_split_matrix_reconciles_to_the_cent(seed):
+    totals, assign, weights, caps = _random_case(random.Random(seed))
+    result = split_matrix(totals, assign, weights, caps)
+
+    totals_minor = np.rint(np.asarray(totals) * MINOR_UNITS).astype(np.int64)
+    assert result.shares.dtype == np.int64
+    assert int(result.shares.sum()) + result.unassigned + result.over_cap == int(totals_minor.sum())
+    assert result.unassigned == int(totals_minor[~assign.any(axis=1)].sum())
+    assert (result.shares >= 0).all()
+    if caps is None:
+        assert result.over_cap == 0
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_split_matrix_respects_caps(seed):
+    totals, assign, weights, caps = _random_case(random.Random(seed))
+    if caps is None:
+        caps = [round(random.Random(-seed).uniform(0, 300), 2) for _ in range(assign.shape[1])]
+    result = split_matrix(totals, assign, weights, caps)
+
+    caps = np.asarray(caps, dtype=np.float64)
+    limited = np.isfinite(caps)
+    assert (result.shares[limited] <= np.rint(caps[limited] * MINOR_UNITS)).all()
+    # Переполнение остаётся, только если все группы упёрлись в лимит
+    if result.over_cap:
+        assert limited.all()
+        assert (result.shares == np.rint(caps * MINOR_UNITS)).all()
+
+
+def test_split_matrix_equal_split_of_odd_cents():
+    result = split_matrix([0.10], np.array([[True, True, True]]))
+    assert sorted(result.shares.tolist()) == [3, 3, 4]
+    assert result.unassigned == 0 and result.over_cap == 0
+
+
+def test_split_matrix_rejects_bad_shapes_and_weights():
+    with pytest.raises(ValueError):
+        split_matrix([1.0, 2.0], np.array([[True]]))
+    with pytest.raises(ValueError):
+        split_matrix([1.0], np.array([[True, True]]), weights=[1.0, -1.0])
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"weights": [np.nan, 1.0]},
+    {"weights": [np.inf, 1.0]},
+    {"weights": [1e308, 1e308]},
+    {"caps": [-5.0, np.inf]},
+    {"caps": [np.nan, np.inf]},
+    {"caps": [-np.inf, np.inf]},
+])
+def test_split_matrix_rejects_values_that_break_reconciliation(kwargs):
+    with pytest.raises(ValueError):
+        split_matrix([10.0], np.array([[True, True]]), **kwargs)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"weights": {"A": None}},
+    {"weights": {"A": float("inf")}},
+    {"weights": {"A": 1e308, "B": 1e308}},
+    {"caps": {"A": -5}},
+    {"caps": {"A": None}},
+    {"caps": {"A": float("nan")}},
+    {"caps": {"A": float("inf")}},
+])
+def test_split_bill_rejects_bad_weights_and_caps(kwargs):
+    df = pd.DataFrame({"total": [10.0]})
+    with pytest.raises(ValueError):
+        split_bill(df, {0: ["A", "B"]}, **kwargs)
+
+
+def test_split_bill_uncapped_groups_are_left_out_of_caps():
+    df = pd.DataFrame({"total": [10.0]})
+    assert split_bill(df, {0: ["A", "B"]}, caps={"A": 2}) == {"A": 2.0, "B": 8.0}
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_split_bill_matches_selected_items(seed):
+    rng = random.Random(seed)
+    df = pd.DataFrame({"total": [round(rng.uniform(1, 99), 2) for _ in range(rng.randint(1, 15))]})
+    assignments = {idx: rng.sample("ABCD", rng.randint(0, 3)) for idx in df.index}
+    totals = split_bill(df, assignments)
+
+    selected = sum(round(df.at[idx, "total"] * MINOR_UNITS) for idx, g in assignments.items() if g)
+    assert round(sum(totals.values()) * MINOR_UNITS) == selected
+    assert set(totals) == {g for groups in assignments.values() for g in groups}
@@ -0,0 +1,190 @@
+# thread_budget.py
+
+"""
+Общий бюджет потоков CPU для PaddleOCR и PyTorch (NLLB).
+
+Без него оба движка берут пулы потоков на все ядра, и когда OCR одного
+пользователя совпадает с переводом другого, машина перегружена вдвое.
+Здесь ядра делятся между движками (SABAI_OCR_CPU_SHARE), а число
+одновременных вызовов каждого вида ограничено семафором:
+
+    потоков на вызов OCR   = ядра * доля_OCR / SABAI_OCR_CONCURRENCY
+    потоков на вызов NLLB  = ядра * (1 - доля_OCR) / SABAI_TRANSLATE_CONCURRENCY
+
+Например, 8 ядер, доля 0.5, OCR по 2, перевод по 1: OCR — 2 вызова по 2 потока,
+NLLB — 1 вызов на 4 потока, в сумме ровно 8.
+
+    with get_thread_budget().slot("ocr"):
+        result = ocr.ocr(img)
+
+allocation() — текущее распределение и очереди (см. /health в service.py).
+Процессы-воркеры (ocr_pool, пакетный режим pipeline) получают свою долю
+через configure(cpu_threads=...).
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+def _available_cpus() -> int:
+    # Учитываем affinity/cgroup-ограничения, где это возможно
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+# Сколько ядер процессу всего (0 — все доступные)
+CPU_THREADS = int(os.environ.get("SABAI_CPU_THREADS", "0")) or _available_cpus()
+
+# Доля ядер под OCR, остальное — под перевод
+OCR_CPU_SHARE = float(os.environ.get("SABAI_OCR_CPU_SHARE", "0.5"))
+
+# Сколько вызовов каждого вида идёт одновременно (остальные ждут слота)
+OCR_CONCURRENCY = int(os.environ.get("SABAI_OCR_CONCURRENCY", "2"))
+TRANSLATE_CONCURRENCY = int(os.environ.get("SABAI_TRANSLATE_CONCURRENCY", "1"))
+
+# Явное число потоков на вызов (0 — считать из бюджета)
+OCR_THREADS = int(os.environ.get("SABAI_OCR_THREADS", "0"))
+TORCH_THREADS = int(os.environ.get("SABAI_TORCH_THREADS", "0"))
+
+
+class _Limiter:
+    """
+    Семафор со статистикой: сколько вызовов идёт, сколько ждёт и сколько ждали.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.calls = 0
+        self.wait_s = 0.0
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self.waiting += 1
+        t0 = time.perf_counter()
+        self._sem.acquire()
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.calls += 1
+            self.wait_s += waited
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": self.waiting,
+                "calls": self.calls,
+                "wait_s": round(self.wait_s, 3),
+            }
+
+
+class ThreadBudget:
+    """
+    Распределение ядер между движками и лимиты одновременных вызовов.
+    """
+
+    def __init__(self, cpu_threads: int = CPU_THREADS, ocr_share: float = OCR_CPU_SHARE,
+                 ocr_concurrency: int = OCR_CONCURRENCY,
+                 translate_concurrency: int = TRANSLATE_CONCURRENCY,
+                 ocr_threads: int = OCR_THREADS, torch_threads: int = TORCH_THREADS):
+        self.cpu_threads = max(1, cpu_threads)
+        self.ocr_share = min(1.0, max(0.0, ocr_share))
+        self.ocr_cores = ocr_cores = max(1, round(self.cpu_threads * self.ocr_share))
+        self.translate_cores = translate_cores = max(1, self.cpu_threads - ocr_cores)
+
+        self.limiters = {
+            "ocr": _Limiter(ocr_concurrency),
+            "translate": _Limiter(translate_concurrency),
+        }
+        self.ocr_threads = ocr_threads or max(1, ocr_cores // self.limiters["ocr"].limit)
+        self.torch_threads = torch_threads or max(1, translate_cores // self.limiters["translate"].limit)
+        self._torch_applied = None
+
+    def slot(self, kind: str):
+        """
+        Контекстный менеджер: ждать свободного слота для вызова вида kind.
+        """
+        return self.limiters[kind].slot()
+
+    def apply_torch(self) -> None:
+        """
+        Выставить потоки torch (настройка на весь процесс). Межоперационный пул
+        задаётся только до первого параллельного вызова — позже молча оставляем как есть.
+        """
+        if self._torch_applied == self.torch_threads:
+            return
+        import torch
+
+        torch.set_num_threads(self.torch_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        self._torch_applied = self.torch_threads
+
+    def onnx_session_options(self):
+        """
+        SessionOptions для ONNX Runtime с тем же числом потоков, что и у torch.
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.torch_threads
+        options.inter_op_num_threads = 1
+        return options
+
+    def allocation(self) -> dict:
+        return {
+            "cpu_threads": self.cpu_threads,
+            "ocr_share": self.ocr_share,
+            "ocr": {"threads_per_call": self.ocr_threads, **self.limiters["ocr"].stats()},
+            "translate": {"threads_per_call": self.torch_threads, **self.limiters["translate"].stats()},
+        }
+
+
+_override = {}
+
+
+def configure(**kwargs) -> ThreadBudget:
+    """
+    Переопределить бюджет процесса (до загрузки моделей), например в воркере
+    пула: configure(cpu_threads=2, ocr_share=1.0, ocr_concurrency=1).
+    """
+    _override.clear()
+    _override.update(kwargs)
+    get_thread_budget.cache_clear()
+    return get_thread_budget()
+
+
+@lru_cache(maxsize=1)
+def get_thread_budget() -> ThreadBudget:
+    """
+    Бюджет процесса (из SABAI_* или configure()).
+    """
+    return ThreadBudget(**_override)
+
+
+def worker_share(workers: int, cores: int = None) -> int:
+    """
+    Сколько ядер (из cores, по умолчанию из всех) достаётся одному
+    из workers процессов-воркеров.
+    """
+    return max(1, (cores or CPU_THREADS) // max(1, workers))
@@ -0,0 +1,201 @@
+# translation_memory.py
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+
+# Где лежит база переводов. Один файл на машину — его могут делить
+# несколько процессов (streamlit-воркеры, batch-CLI и т.п.).
+DEFAULT_DB_PATH = os.environ.get(
+    "SABAI_TM_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "sabai_bill", "translations.sqlite3"),
+)
+
+# Бюджет на полезные данные (текст + перевод) в байтах.
+# При превышении выкидываем давно не использованные записи.
+DEFAULT_MAX_BYTES = int(os.environ.get("SABAI_TM_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Выключатель: SABAI_TM_ENABLED=0 — работаем без персистентного кэша
+TM_ENABLED = os.environ.get("SABAI_TM_ENABLED", "1") != "0"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    src         TEXT NOT NULL,
+    tgt         TEXT NOT NULL,
+    text        TEXT NOT NULL,
+    translation TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0,
+    last_used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used);
+"""
+
+
+def make_key(text: str, src_lang: str, tgt_lang: str, model_name: str) -> str:
+    """
+    Ключ записи: хэш от (модель, src, tgt, текст).
+    Смена MODEL_NAME автоматически даёт новые ключи.
+    """
+    raw = "\x00".join((model_name, src_lang, tgt_lang, text))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """
+    Персистентная память переводов на SQLite.
+    Считает попадания/промахи и держит суммарный размер в пределах max_bytes.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # После fork соединение родителя использовать нельзя — открываем своё
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def get_many(self, texts, src_lang: str, tgt_lang: str, model_name: str) -> dict:
+        """
+        Возвращает {text: translation} для найденных строк.
+        Ненайденные просто отсутствуют в словаре.
+        """
+        unique = list(dict.fromkeys(texts))
+        if not unique:
+            return {}
+
+        keys = {make_key(t, src_lang, tgt_lang, model_name): t for t in unique}
+        found = {}
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            key_list = list(keys)
+            # SQLite ограничивает число параметров в запросе
+            for start in range(0, len(key_list), 500):
+                part = key_list[start:start + 500]
+                rows = conn.execute(
+                    "SELECT key, translation FROM translations WHERE key IN (%s)"
+                    % ",".join("?" * len(part)),
+                    part,
+                ).fetchall()
+                for key, translation in rows:
+                    found[keys[key]] = translation
+
+            if found:
+                hit_keys = [k for k, t in keys.items() if t in found]
+                conn.executemany(
+                    "UPDATE translations SET hits = hits + 1, last_used = ? WHERE key = ?",
+                    [(now, k) for k in hit_keys],
+                )
+                conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+
+        return found
+
+    def put_many(self, pairs, src_lang: str, tgt_lang: str, model_name: str) -> None:
+        """
+        Сохраняет пары (text, translation).
+        """
+        now = time.time()
+        rows = []
+        for text, translation in pairs:
+            size = len(text.encode("utf-8")) + len(translation.encode("utf-8"))
+            rows.append((
+                make_key(text, src_lang, tgt_lang, model_name),
+                model_name, src_lang, tgt_lang, text, translation, size, now,
+            ))
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO translations "
+                "(key, model, src, tgt, text, translation, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            self._evict_locked(conn)
+
+    def _evict_locked(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Чистим с запасом до 90% бюджета, чтобы не дёргать eviction на каждой вставке
+        target = int(self.max_bytes * 0.9)
+        to_free = total - target
+        freed = 0
+        doomed = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM translations ORDER BY last_used ASC"
+        ):
+            doomed.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+
+        conn.executemany("DELETE FROM translations WHERE key = ?", doomed)
+        conn.commit()
+        self.evicted += len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evicted": self.evicted,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM translations")
+            conn.commit()
+
+
+@lru_cache(maxsize=1)
+def get_translation_memory():
+    """
+    Общий на процесс экземпляр памяти переводов (или None, если выключена).
+    """
+    if not TM_ENABLED:
+        return None
+    return TranslationMemory()
@@ -0,0 +1,137 @@
+# translation_parity.py
+
+"""
+Проверка паритета бэкендов перевода относительно fp32.
+
+    python translation_parity.py --backend int8
+    python translation_parity.py --backend onnx --src th --tgt en --file items.txt
+
+Считает долю точных совпадений, средний chrF (символьные n-граммы, 0..100)
+и время на строку для обоих бэкендов. Память переводов не используется —
+сравниваются именно модели.
+"""
+
+import sys
+import time
+import argparse
+from collections import Counter
+
+from translator import _generate, TRANSLATE_BATCH_SIZE
+
+# Типичные позиции из чеков (TH / RU), если свой список не передан
+SAMPLE_ITEMS = {
+    "th": [
+        "ข้าวผัดกุ้ง", "น้ำดื่ม", "กาแฟเย็น", "ชาเขียว", "ไก่ทอด", "ขนมปัง",
+        "นมสด", "เบียร์ช้าง", "สบู่", "ยาสีฟัน", "ถุงพลาสติก", "บะหมี่กึ่งสำเร็จรูป",
+    ],
+    "ru": [
+        "Молоко 3,2%", "Хлеб белый", "Куриное филе", "Вода питьевая", "Кофе растворимый",
+        "Чай чёрный", "Сок яблочный", "Мыло детское", "Зубная паста", "Пакет",
+    ],
+}
+
+
+def _char_ngrams(text: str, n: int) -> Counter:
+    text = " ".join(text.split())
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def chrf(hypothesis: str, reference: str, max_n: int = 6, beta: float = 2.0) -> float:
+    """
+    Упрощённый chrF: средние по n точность/полнота символьных n-грамм, F-beta.
+    """
+    if hypothesis == reference:
+        return 100.0
+    precisions, recalls = [], []
+    for n in range(1, max_n + 1):
+        hyp, ref = _char_ngrams(hypothesis, n), _char_ngrams(reference, n)
+        if not hyp or not ref:
+            continue
+        overlap = sum((hyp & ref).values())
+        precisions.append(overlap / sum(hyp.values()))
+        recalls.append(overlap / sum(ref.values()))
+    if not precisions:
+        return 0.0
+    p = sum(precisions) / len(precisions)
+    r = sum(recalls) / len(recalls)
+    if p == 0 and r == 0:
+        return 0.0
+    b2 = beta * beta
+    return 100.0 * (1 + b2) * p * r / (b2 * p + r)
+
+
+def _timed(texts, src_lang, tgt_lang, backend, batch_size):
+    # Первый прогон — прогрев (загрузка модели), в замер не идёт
+    _generate(texts[:1], src_lang, tgt_lang, batch_size, backend)
+    start = time.perf_counter()
+    out = _generate(texts, src_lang, tgt_lang, batch_size, backend)
+    return out, (time.perf_counter() - start) / len(texts)
+
+
+def parity_check(texts, src_lang: str, tgt_lang: str, backend: str, reference: str = "fp32",
+                 batch_size: int = TRANSLATE_BATCH_SIZE) -> dict:
+    """
+    Переводит texts обоими бэкендами и сравнивает результат.
+    """
+    texts = [t.strip() for t in texts if t and t.strip()]
+    if not texts:
+        raise ValueError("parity_check needs at least one non-empty text")
+
+    ref_out, ref_sec = _timed(texts, src_lang, tgt_lang, reference, batch_size)
+    cand_out, cand_sec = _timed(texts, src_lang, tgt_lang, backend, batch_size)
+
+    scores = [chrf(c, r) for c, r in zip(cand_out, ref_out)]
+    exact = sum(c == r for c, r in zip(cand_out, ref_out))
+    worst = sorted(zip(scores, texts, ref_out, cand_out))[:5]
+
+    return {
+        "backend": backend,
+        "reference": reference,
+        "n": len(texts),
+        "exact_match": exact / len(texts),
+        "chrf_mean": sum(scores) / len(scores),
+        "chrf_min": min(scores),
+        "ms_per_item": {reference: ref_sec * 1000, backend: cand_sec * 1000},
+        "speedup": ref_sec / cand_sec if cand_sec else float("inf"),
+        "worst": [
+            {"text": t, reference: r, backend: c, "chrf": round(s, 1)}
+            for s, t, r, c in worst
+        ],
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Паритет бэкенда перевода относительно fp32")
+    ap.add_argument("--backend", required=True, choices=["int8", "onnx", "fp32"])
+    ap.add_argument("--reference", default="fp32", choices=["int8", "onnx", "fp32"])
+    ap.add_argument("--src", default="th", help="исходный язык (ru, th, ...)")
+    ap.add_argument("--tgt", default="en", help="язык перевода")
+    ap.add_argument("--file", default=None, help="файл со строками (по одной на строку)")
+    ap.add_argument("--min-chrf", type=float, default=None,
+                    help="вернуть код 1, если средний chrF ниже порога")
+    args = ap.parse_args(argv)
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            texts = f.read().splitlines()
+    else:
+        texts = SAMPLE_ITEMS.get(args.src, SAMPLE_ITEMS["th"])
+
+    report = parity_check(texts, args.src, args.tgt, args.backend, args.reference)
+
+    print(f"{report['backend']} vs {report['reference']} на {report['n']} строках")
+    print(f"  точных совпадений: {report['exact_match']:.0%}")
+    print(f"  chrF: среднее {report['chrf_mean']:.1f}, минимум {report['chrf_min']:.1f}")
+    for name, ms in report["ms_per_item"].items():
+        print(f"  {name}: {ms:.1f} мс/строку")
+    print(f"  ускорение: ×{report['speedup']:.2f}")
+    for w in report["worst"]:
+        print(f"  [{w['chrf']}] {w['text']!r}: {w[report['reference']]!r} → {w[report['backend']]!r}")
+
+    if args.min_chrf is not None and report["chrf_mean"] < args.min_chrf:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
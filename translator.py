@@ -1,20 +1,103 @@
 # translator.py
 
-import torch
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+import os
+import re
+import sqlite3
+import threading
 from functools import lru_cache
-from langdetect import detect
+from collections import Counter
+
+# torch / transformers / langdetect импортируются при первом использовании:
+# страница приложения рисуется, не дожидаясь их загрузки
+
+import glossary
+import metrics
+from model_registry import registry
+from thread_budget import get_thread_budget
+from translation_memory import get_translation_memory
 
 # Используем дистиллированную версию для скорости (около 2.4 ГБ)
 MODEL_NAME = "facebook/nllb-200-distilled-600M"
 
-@lru_cache(maxsize=1)
-def get_model():
+# Сколько строк гоняем через model.generate за один проход.
+# На CPU 8–16 — разумный компромисс между паддингом и накладными расходами.
+TRANSLATE_BATCH_SIZE = int(os.environ.get("SABAI_TRANSLATE_BATCH_SIZE", "16"))
+
+# Бэкенд модели перевода:
+#   fp32 — обычная PyTorch-модель (как раньше)
+#   int8 — динамическая int8-квантизация Linear-слоёв (torch.quantization)
+#   onnx — экспорт в ONNX Runtime через optimum (нужен pip install optimum[onnxruntime])
+TRANSLATOR_BACKENDS = ("fp32", "int8", "onnx")
+TRANSLATOR_BACKEND = os.environ.get("SABAI_TRANSLATOR_BACKEND", "fp32")
+
+# Папка с уже экспортированной ONNX-моделью (иначе экспортируем при первой загрузке)
+ONNX_MODEL_DIR = os.environ.get("SABAI_ONNX_MODEL_DIR", "")
+
+
+def _backend(backend: str = None) -> str:
+    backend = backend or TRANSLATOR_BACKEND
+    if backend not in TRANSLATOR_BACKENDS:
+        raise ValueError(f"Unknown translator backend {backend!r}, expected one of {TRANSLATOR_BACKENDS}")
+    return backend
+
+
+def model_id(backend: str = None) -> str:
+    """
+    Идентификатор модели для кэшей: у разных бэкендов переводы могут отличаться.
+    """
+    backend = _backend(backend)
+    return MODEL_NAME if backend == "fp32" else f"{MODEL_NAME}#{backend}"
+
+
+def get_model(backend: str = None):
+    backend = _backend(backend)
+    # У ONNX Runtime весов в parameters() нет — размер из таблицы реестра (MODEL_SIZES_MB)
+    size_fn = _model_size if backend != "onnx" else None
+    return registry.get(f"nllb:{model_id(backend)}", lambda: _load_model(backend), size_fn)
+
+
+def _load_model(backend: str = "fp32"):
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    budget = get_thread_budget()
+
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError as e:
+            raise RuntimeError(
+                "Бэкенд onnx требует optimum и onnxruntime: pip install optimum[onnxruntime]"
+            ) from e
+        options = budget.onnx_session_options()
+        if ONNX_MODEL_DIR:
+            model = ORTModelForSeq2SeqLM.from_pretrained(ONNX_MODEL_DIR, session_options=options)
+        else:
+            model = ORTModelForSeq2SeqLM.from_pretrained(MODEL_NAME, export=True, session_options=options)
+        return tokenizer, model
+
+    # Пул потоков torch — по бюджету, а не на все ядра (иначе делит их с PaddleOCR)
+    budget.apply_torch()
     model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
     model.eval()
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
     return tokenizer, model
 
+
+def _model_size(loaded) -> int:
+    # Веса + буферы; токенизатор на этом фоне копейки
+    _tokenizer, model = loaded
+    tensors = list(model.parameters()) + list(model.buffers())
+    # int8 (quantize_dynamic): веса Linear упакованы, в parameters() их нет — weight() их отдаёт
+    tensors += [m.weight() for m in model.modules() if callable(getattr(m, "weight", None))]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+# Токенизатор общий (из реестра), а язык источника — его изменяемое поле:
+# от присваивания src_lang до конца токенизации держим блокировку
+_TOKENIZE_LOCK = threading.Lock()
+
 # Карта соответствия коротких кодов кодам NLLB
 NLLB_LANG_MAP = {
     "ru": "rus_Cyrl",
@@ -27,25 +110,157 @@ NLLB_LANG_MAP = {
     "ar": "ary_Arab"
 }
 
+@metrics.traced("translate_text")
 def translate_text(text: str, src_lang: str, tgt_lang: str) -> str:
     if not text or not text.strip():
         return ""
+    return translate_batch([text], src_lang, tgt_lang)[0]
+
+
+@metrics.traced("translate_batch", items=len)
+def translate_batch(
+    texts, src_lang: str, tgt_lang: str, batch_size: int = None, backend: str = None
+) -> list:
+    """
+    Перевод списка строк микробатчами.
+    Перед моделью — дешёвые шаги (см. _pretranslate): повторы, коды/SKU,
+    пустые языковые пары, глоссарий; затем персистентная память переводов.
+    В модель уходят только оставшиеся уникальные строки, отсортированные по длине.
+    Результат возвращается в исходном порядке. Пустые строки → "".
+    """
+    texts = [str(t).strip() if t is not None else "" for t in texts]
+    resolved = _pretranslate(texts, src_lang, tgt_lang)
+
+    pending = list(dict.fromkeys(t for t in texts if t and t not in resolved))
+    if pending:
+        resolved.update(_translate_unique(pending, src_lang, tgt_lang, batch_size, backend))
+
+    return [resolved.get(t, "") if t else "" for t in texts]
+
+
+# Счётчики: сколько строк решилось на каждом шаге (для метрик/отладки)
+TRANSLATE_STATS = Counter()
+
+# Коды, штрихкоды, SKU: одно "слово" из ASCII, в котором есть цифра
+_CODE_RE = re.compile(r"[\x21-\x7e]*\d[\x21-\x7e]*")
+_NO_LETTERS_RE = re.compile(r"[\W\d_]+")
+
+
+def _pretranslate(texts, src_lang: str, tgt_lang: str) -> dict:
+    """
+    Строки, которым модель не нужна: {текст: результат}.
+    """
+    unique = [t for t in dict.fromkeys(texts) if t]
+    TRANSLATE_STATS["duplicate"] += sum(1 for t in texts if t) - len(unique)
+
+    # Пара языков, которая для NLLB одна и та же
+    if NLLB_LANG_MAP.get(src_lang, "eng_Latn") == NLLB_LANG_MAP.get(tgt_lang, "rus_Cyrl"):
+        TRANSLATE_STATS["noop_pair"] += len(unique)
+        return {t: t for t in unique}
+
+    src_script = _lang_script(src_lang)
+    tgt_script = _lang_script(tgt_lang)
+
+    resolved = {}
+    for t in unique:
+        if _NO_LETTERS_RE.fullmatch(t) or _CODE_RE.fullmatch(t):
+            resolved[t] = t
+            TRANSLATE_STATS["code"] += 1
+            continue
+
+        # Уже написано письменностью цели (бренд латиницей в тайском чеке при tgt=en и т.п.)
+        if tgt_script and src_script and tgt_script != src_script:
+            counts = script_histogram(t)
+            if counts and set(counts) == {tgt_script}:
+                resolved[t] = t
+                TRANSLATE_STATS["target_script"] += 1
+                continue
+
+        hit = glossary.lookup(t, src_lang, tgt_lang)
+        if hit is not None:
+            resolved[t] = hit
+            TRANSLATE_STATS["glossary"] += 1
+
+    return resolved
+
+
+def _translate_unique(texts: list, src_lang: str, tgt_lang: str, batch_size: int = None,
+                      backend: str = None) -> dict:
+    """
+    Уникальные строки → память переводов → NLLB для промахов.
+    """
+    backend = _backend(backend)
+    mid = model_id(backend)
+
+    memory = get_translation_memory()
+    cached = {}
+    if memory is not None:
+        try:
+            cached = memory.get_many(texts, src_lang, tgt_lang, mid)
+        except sqlite3.Error:
+            memory = None
+    TRANSLATE_STATS["memory"] += len(cached)
+
+    missing = [t for t in texts if t not in cached]
+    if memory is not None:
+        metrics.cache("translation_memory", True, len(cached))
+        metrics.cache("translation_memory", False, len(missing))
+    if not missing:
+        return cached
+
+    translated = _generate(missing, src_lang, tgt_lang, batch_size or TRANSLATE_BATCH_SIZE, backend)
+    TRANSLATE_STATS["model"] += len(missing)
+    pairs = list(zip(missing, translated))
+    cached.update(pairs)
+
+    if memory is not None:
+        try:
+            memory.put_many(pairs, src_lang, tgt_lang, mid)
+        except sqlite3.Error:
+            pass
+
+    return cached
+
+
+@metrics.traced("nllb_generate", items=len)
+def _generate(texts: list, src_lang: str, tgt_lang: str, batch_size: int, backend: str = None) -> list:
+    """
+    Прогоняет непустые строки через NLLB, отсортировав их по длине.
+    """
+    import torch
+
+    tokenizer, model = get_model(backend)
 
-    tokenizer, model = get_model()
-    
     # Получаем полные коды языков для NLLB
     src_code = NLLB_LANG_MAP.get(src_lang, "eng_Latn")
     tgt_code = NLLB_LANG_MAP.get(tgt_lang, "rus_Cyrl")
 
-    inputs = tokenizer(text, return_tensors="pt")
-    
-    translated_tokens = model.generate(
-        **inputs, 
-        forced_bos_token_id=tokenizer.lang_code_to_id[tgt_code], 
-        max_length=128
-    )
-    
-    return tokenizer.batch_decode(translated_tokens, skip_special_tokens=True)[0]
+    results = [""] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batch_size = max(1, batch_size)
+
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        with _TOKENIZE_LOCK:
+            tokenizer.src_lang = src_code
+            inputs = tokenizer(
+                [texts[i] for i in chunk],
+                return_tensors="pt",
+                padding=True,
+            )
+
+        with get_thread_budget().slot("translate"), torch.inference_mode():
+            translated_tokens = model.generate(
+                **inputs,
+                forced_bos_token_id=tokenizer.lang_code_to_id[tgt_code],
+                max_length=128
+            )
+
+        decoded = tokenizer.batch_decode(translated_tokens, skip_special_tokens=True)
+        for i, out in zip(chunk, decoded):
+            results[i] = out
+
+    return results
 
 
 # ------------------ LANGUAGE DETECTION ------------------
@@ -69,13 +284,133 @@ LANG_DISPLAY = {
 }
 
 
-def detect_lang_code(text: str) -> str:
+# Письменности → диапазоны Unicode
+_SCRIPT_RANGES = {
+    "thai": "\u0e00-\u0e7f",
+    "cyrillic": "\u0400-\u04ff",
+    "hangul": "\u1100-\u11ff\u3130-\u318f\uac00-\ud7af",
+    "kana": "\u3040-\u30ff\u31f0-\u31ff\uff66-\uff9f",
+    "han": "\u3400-\u4dbf\u4e00-\u9fff",
+    "arabic": "\u0600-\u06ff\u0750-\u077f",
+    "hebrew": "\u0590-\u05ff",
+    "georgian": "\u10a0-\u10ff",
+    "armenian": "\u0530-\u058f",
+    "latin": "A-Za-z\u00c0-\u024f",
+}
+_SCRIPT_RES = {name: re.compile(f"[{chars}]") for name, chars in _SCRIPT_RANGES.items()}
+
+# Однозначные письменности → код языка
+_SCRIPT_LANG = {
+    "thai": "th",
+    "cyrillic": "ru",
+    "hangul": "ko",
+    "kana": "ja",
+    "han": "zh",
+    "arabic": "ar",
+    "hebrew": "he",
+    "georgian": "ka",
+    "armenian": "hy",
+}
+
+# Язык OCR (PaddleOCR) → ожидаемый язык текста
+OCR_LANG_HINTS = {
+    "ru": "ru",
+    "en": "en",
+    "th": "th",
+    "ch": "zh",
+    "chinese_cht": "zh",
+    "japan": "ja",
+    "korean": "ko",
+    "arabic": "ar",
+}
+
+# Доля букв не-латинской письменности, с которой она считается языком чека
+# (в тайских/русских чеках полно латиницы: бренды, коды, "VAT")
+SCRIPT_MIN_SHARE = 0.15
+
+
+def script_histogram(text: str) -> dict:
+    """
+    {письменность: число символов} — только ненулевые.
+    """
+    counts = {}
+    for name, rx in _SCRIPT_RES.items():
+        n = len(rx.findall(text))
+        if n:
+            counts[name] = n
+    return counts
+
+
+def _statistical_lang(text: str, default: str) -> str:
+    # langdetect только для неоднозначной латиницы, с фиксированным seed
     try:
-        return detect(text)
+        from langdetect import DetectorFactory, detect
+        DetectorFactory.seed = 0
+        code = detect(text)
     except Exception:
+        return default
+    return code.split("-")[0]
+
+
+@lru_cache(maxsize=256)
+def detect_receipt_lang(text: str, ocr_lang: str = None) -> str:
+    """
+    Детерминированное определение языка чека:
+    1) гистограмма письменностей (тайский, кириллица, хангыль, кана, ханьцзы, арабский...);
+    2) подсказка от выбранного языка OCR;
+    3) langdetect — только если текст латиницей и подсказка не помогла.
+    Результат кэшируется по (text, ocr_lang).
+    """
+    hint = OCR_LANG_HINTS.get(ocr_lang)
+    counts = script_histogram(text or "")
+    letters = sum(counts.values())
+    if not letters:
+        return hint or "en"
+
+    shares = {script: n / letters for script, n in counts.items()}
+
+    # Кана — однозначно японский, даже если иероглифов больше
+    if shares.get("kana", 0) >= SCRIPT_MIN_SHARE / 3:
+        return "ja"
+
+    # Письменность, которую ждали по языку OCR, принимаем и при меньшей доле
+    hint_script = next((sc for sc, code in _SCRIPT_LANG.items() if code == hint), None)
+    if hint_script and shares.get(hint_script, 0) >= SCRIPT_MIN_SHARE / 3:
+        return hint
+
+    non_latin = [(share, script) for script, share in shares.items() if script != "latin"]
+    if non_latin:
+        share, script = max(non_latin)
+        if share >= SCRIPT_MIN_SHARE:
+            return _SCRIPT_LANG[script]
+
+    # Латиница: английский чек не гоняем через статистику
+    if hint == "en":
         return "en"
+    return _statistical_lang(text, default="en")
+
+
+def _lang_script(lang: str):
+    """
+    Письменность языка: однозначные — из _SCRIPT_LANG, плюс латиница для en.
+    Для остальных (латиница vi/tr/id...) — None.
+    """
+    if lang == "en":
+        return "latin"
+    for script, code in _SCRIPT_LANG.items():
+        if code == lang:
+            return script
+    return None
 
 
-def detect_lang_for_display(text: str) -> str:
-    code = detect_lang_code(text)
+def lang_display(code: str) -> str:
     return LANG_DISPLAY.get(code, f"🌍 {code}")
+
+
+@metrics.traced("detect_lang")
+def detect_lang_code(text: str, ocr_lang: str = None) -> str:
+    return detect_receipt_lang(text or "", ocr_lang)
+
+
+def detect_lang_for_display(text: str, ocr_lang: str = None) -> str:
+    return lang_display(detect_lang_code(text, ocr_lang))
@@ -0,0 +1,99 @@
+# warmup.py
+
+"""
+Фоновый прогрев моделей: пока пользователь выбирает файл, в отдельном
+потоке грузятся нужные языки PaddleOCR и NLLB. Статус можно показать в UI.
+"""
+
+import os
+import time
+import threading
+
+# SABAI_WARMUP=0 — не прогревать (модели загрузятся на первом чеке)
+WARMUP_ENABLED = os.environ.get("SABAI_WARMUP", "1") != "0"
+
+# Какие языки OCR прогревать (пусто — те же, что у пула OCR: ocr_pool.OCR_PRELOAD_LANGS)
+WARMUP_OCR_LANGS = os.environ.get("SABAI_WARMUP_OCR_LANGS", "")
+
+_lock = threading.Lock()
+_status = {}  # имя модели -> "pending" | "loading" | "ready" | "error: ..."
+_timings = {}  # имя модели -> секунды загрузки
+_thread = None
+
+
+def _set(name: str, state: str) -> None:
+    with _lock:
+        _status[name] = state
+
+
+def _load(name: str, loader) -> None:
+    _set(name, "loading")
+    start = time.perf_counter()
+    try:
+        loader()
+    except Exception as e:
+        _set(name, f"error: {type(e).__name__}: {e}")
+        return
+    with _lock:
+        _timings[name] = time.perf_counter() - start
+    _set(name, "ready")
+
+
+def _run(ocr_langs, translator: bool) -> None:
+    # Перевод нужен на каждом чеке — грузим его первым
+    if translator:
+        from translator import get_model
+        _load("nllb", get_model)
+
+    if ocr_langs:
+        from ocr_module import get_ocr
+        for lang in ocr_langs:
+            _load(f"ocr:{lang}", lambda lang=lang: get_ocr(lang))
+
+
+def start_warmup(ocr_langs=None, translator: bool = True) -> bool:
+    """
+    Запускает прогрев в фоне (один раз на процесс).
+    Возвращает True, если поток запущен этим вызовом.
+    """
+    global _thread
+
+    if not WARMUP_ENABLED:
+        return False
+
+    if ocr_langs is None:
+        ocr_langs = [lang.strip() for lang in WARMUP_OCR_LANGS.split(",") if lang.strip()]
+        if not ocr_langs:
+            from ocr_pool import OCR_PRELOAD_LANGS
+            ocr_langs = list(OCR_PRELOAD_LANGS)
+
+    with _lock:
+        if _thread is not None:
+            return False
+        if translator:
+            _status["nllb"] = "pending"
+        for lang in ocr_langs:
+            _status[f"ocr:{lang}"] = "pending"
+        _thread = threading.Thread(
+            target=_run, args=(list(ocr_langs), translator), name="sabai-warmup", daemon=True
+        )
+        _thread.start()
+    return True
+
+
+def warmup_status() -> dict:
+    """
+    {модель: состояние} — копия, можно спокойно показывать в UI.
+    """
+    with _lock:
+        return dict(_status)
+
+
+def warmup_timings() -> dict:
+    with _lock:
+        return dict(_timings)
+
+
+def is_ready() -> bool:
+    with _lock:
+        return bool(_status) and all(state == "ready" for state in _status.values())